@@ -0,0 +1,85 @@
+"""
+Benchmark of the shacl validation per dataset and per batch of datasets
+
+Each call of pyshacl validate has a fixed cost for mixing the graphs and
+preparing the shapes. The benchmark validates a synthetic catalog with the
+shapes and vocabularies of the repository, once dataset by dataset and
+once in batches as the shaclchecker does with the option batch_size.
+
+Run from the repository root: python -m benchmarks.bench_batch_validation
+"""
+import time
+
+from rdflib import Graph
+
+from benchmarks.bench_ontology_pruning import ONT_FILES, SHACL_FILE
+from ckan_pkg_checker.utils import rdf_utils
+
+NR_DATASETS = 200
+BATCH_SIZE = 100
+DATASET = """
+@prefix dcat: <http://www.w3.org/ns/dcat#> .
+@prefix dct: <http://purl.org/dc/terms/> .
+@prefix vcard: <http://www.w3.org/2006/vcard/ns#> .
+
+<https://example.org/dataset/{index}> a dcat:Dataset ;
+    dct:identifier "dataset-{index}@org" ;
+    dct:title "Datensatz {index}"@de ;
+    dct:description "Beschreibung"@de ;
+    dct:accrualPeriodicity <http://publications.europa.eu/resource/authority/frequency/DAILY> ;
+    dcat:theme <http://publications.europa.eu/resource/authority/data-theme/GOVE> ;
+    dcat:contactPoint [ a vcard:Organization ; vcard:hasEmail <mailto:info@example.org> ] ;
+    dcat:distribution <https://example.org/distribution/{index}/1>,
+        <https://example.org/distribution/{index}/2> .
+
+<https://example.org/distribution/{index}/1> a dcat:Distribution ;
+    dct:title "CSV"@de ;
+    dct:format <http://publications.europa.eu/resource/authority/file-type/CSV> ;
+    dct:license <http://dcat-ap.ch/vocabulary/licenses/terms_by> ;
+    dcat:accessURL <https://example.org/{index}/data.csv> .
+
+<https://example.org/distribution/{index}/2> a dcat:Distribution ;
+    dct:format <http://example.org/unknown-format> ;
+    dcat:accessURL <https://example.org/{index}/data.unknown> .
+"""
+
+
+def get_dataset_graphs():
+    return [
+        Graph().parse(data=DATASET.format(index=index), format="turtle")
+        for index in range(NR_DATASETS)
+    ]
+
+
+def main():
+    shacl_graph, ont_graph = rdf_utils.load_shacl_graphs(
+        SHACL_FILE, ONT_FILES, prune=True
+    )
+    dataset_graphs = get_dataset_graphs()
+
+    start = time.perf_counter()
+    single_results = [
+        rdf_utils.get_shacl_results(dataset_graph, shacl_graph, ont_graph)
+        for dataset_graph in dataset_graphs
+    ]
+    duration = time.perf_counter() - start
+    print(f"per dataset:    {NR_DATASETS} datasets in {duration:.2f}s")
+
+    start = time.perf_counter()
+    batch_results = []
+    for offset in range(0, NR_DATASETS, BATCH_SIZE):
+        batch_results += rdf_utils.get_batch_shacl_results(
+            dataset_graphs[offset : offset + BATCH_SIZE], shacl_graph, ont_graph
+        )
+    duration = time.perf_counter() - start
+    print(f"batches of {BATCH_SIZE}: {NR_DATASETS} datasets in {duration:.2f}s")
+
+    same_results = all(
+        set(single) == set(batch)
+        for single, batch in zip(single_results, batch_results)
+    )
+    print(f"same results: {same_results}")
+
+
+if __name__ == "__main__":
+    main()
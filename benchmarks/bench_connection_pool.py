@@ -0,0 +1,48 @@
+"""
+Benchmark of the link checks with and without a connection pool
+
+The urls are checked against a local http server: without a session each
+check opens a new connection, with the session of request_utils the
+connections are kept open and reused.
+
+Run from the repository root: python -m benchmarks.bench_connection_pool
+"""
+import time
+
+from ckan_pkg_checker.utils import request_utils
+from tests.local_server import LocalServer
+
+NR_URLS = 500
+
+
+def check_urls(urls, session=None):
+    start = time.perf_counter()
+    for url in urls:
+        request_utils.check_url(url, session=session)
+    return time.perf_counter() - start
+
+
+def main():
+    with LocalServer() as server:
+        urls = [server.url(f"/ok?item={index}") for index in range(NR_URLS)]
+
+        duration = check_urls(urls)
+        connections = len(server.connections)
+        print(
+            f"connection per url: {NR_URLS} urls in {duration:.2f}s, "
+            f"{connections} connections"
+        )
+
+        server.connections.clear()
+        session = request_utils.get_session()
+        duration = check_urls(urls, session=session)
+        session.close()
+        connections = len(server.connections)
+        print(
+            f"pooled session:     {NR_URLS} urls in {duration:.2f}s, "
+            f"{connections} connections"
+        )
+
+
+if __name__ == "__main__":
+    main()
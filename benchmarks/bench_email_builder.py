@@ -0,0 +1,111 @@
+"""
+Benchmark of the email builder with a million result rows
+
+A synthetic shacl result csv is built with many rows per contact. The mails
+are built per row, with a file open and a template render per row and
+contact, as the email builder did before, and with the email builder, that
+renders each row once and writes each mail file at once. The per row build
+is measured on the first rows only, as it takes long for all of them.
+
+Run from the repository root: python -m benchmarks.bench_email_builder
+"""
+import configparser
+import csv
+import resource
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from ckan_pkg_checker.email_builder import EmailBuilder
+from ckan_pkg_checker.utils import utils
+from tests.helpers import DEFAULT_EMAIL, FIELDNAMES, build_mails_per_row
+
+NR_ROWS = 1000000
+NR_PER_ROW_ROWS = 100000
+NR_CONTACTS = 2000
+
+
+def get_row(index):
+    contact = index % NR_CONTACTS
+    return {
+        "contact_email": f"person-{contact}@org.ch",
+        "contact_name": f"Person {contact}",
+        "organization_name": f"org-{contact % 100}",
+        "dataset_title": f"Datensatz {index}",
+        "dataset_url": f"https://ckan.org/dataset/dataset-{index}",
+        "node": f"https://example.org/distribution/{index}",
+        "property": "dct:description",
+        "value": "",
+        "severity": "Violation",
+        "error_msg": "description is missing",
+        "pkg_type": utils.GEOCAT if contact % 5 == 0 else utils.DCAT,
+        "checker_type": utils.MODE_SHACL,
+        "template": "shaclchecker_error.html",
+    }
+
+
+def write_results(csvpath, nr_rows):
+    with open(csvpath, "w") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(get_row(index) for index in range(nr_rows))
+
+
+def get_config():
+    config = configparser.ConfigParser()
+    config.read_dict(
+        {
+            "shaclchecker": {
+                "csvfile": "shaclchecker.csv",
+                "statfile": "shaclstatistics.csv",
+            },
+            "contacts": {"statsfile": "contactstats.csv"},
+            "emailbuilder": {"default_name": "Admin", "default_email": DEFAULT_EMAIL},
+        }
+    )
+    return config
+
+
+def main():
+    tmpdir = Path(tempfile.mkdtemp())
+    try:
+        rundir = tmpdir / "run"
+        mailpath = utils.get_maildir(rundir)
+        mailpath.mkdir(parents=True)
+        utils.get_csvdir(rundir).mkdir(parents=True)
+        csvpath = utils.get_csvdir(rundir) / "shaclchecker.csv"
+        write_results(csvpath, NR_ROWS)
+
+        per_row_path = tmpdir / "per_row"
+        per_row_path.mkdir()
+        start = time.perf_counter()
+        build_mails_per_row(
+            (get_row(index) for index in range(NR_PER_ROW_ROWS)), per_row_path
+        )
+        duration = time.perf_counter() - start
+        print(
+            f"per row:       {NR_PER_ROW_ROWS} rows in {duration:.2f}s, "
+            f"{NR_PER_ROW_ROWS / duration:.0f} rows/s, "
+            f"{NR_PER_ROW_ROWS * 2} file opens"
+        )
+
+        builder = EmailBuilder(
+            rundir=rundir, mode=utils.MODE_SHACL, config=get_config()
+        )
+        start = time.perf_counter()
+        builder._build_mails()
+        duration = time.perf_counter() - start
+        nr_mails = len(list(mailpath.iterdir()))
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+        print(
+            f"email builder: {NR_ROWS} rows in {duration:.2f}s, "
+            f"{NR_ROWS / duration:.0f} rows/s, {nr_mails} file opens, "
+            f"max rss {max_rss} MB"
+        )
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark of the shacl validation with the full and the pruned ontology graph
+
+pyshacl mixes the ontology graph into the graph of each dataset that is
+validated. The benchmark validates a synthetic dataset with the shapes and
+vocabularies of the repository, once with the full ontology graph and once
+with the ontology graph reduced to the predicates that the shapes reach.
+
+Run from the repository root: python -m benchmarks.bench_ontology_pruning
+"""
+import time
+
+from rdflib import Graph
+
+from ckan_pkg_checker.utils import rdf_utils
+
+NR_VALIDATIONS = 20
+SHACL_FILE = "ogdch.shacl.ttl"
+ONT_FILES = [
+    "frequency-eu.ttl",
+    "theme-eu.ttl",
+    "licenses-dcat-ap-ch.ttl",
+    "formats-eu.ttl",
+    "mime-types.ttl",
+    "language-eu.ttl",
+]
+DATASET = """
+@prefix dcat: <http://www.w3.org/ns/dcat#> .
+@prefix dct: <http://purl.org/dc/terms/> .
+@prefix vcard: <http://www.w3.org/2006/vcard/ns#> .
+
+<https://example.org/dataset/1> a dcat:Dataset ;
+    dct:identifier "dataset-1@org" ;
+    dct:title "Datensatz"@de ;
+    dct:description "Beschreibung"@de ;
+    dct:issued "2021-01-01T00:00:00"^^<http://www.w3.org/2001/XMLSchema#dateTime> ;
+    dct:accrualPeriodicity <http://publications.europa.eu/resource/authority/frequency/DAILY> ;
+    dct:language "de" ;
+    dcat:theme <http://publications.europa.eu/resource/authority/data-theme/GOVE> ;
+    dcat:contactPoint [ a vcard:Organization ; vcard:hasEmail <mailto:info@example.org> ] ;
+    dcat:distribution <https://example.org/distribution/1>, <https://example.org/distribution/2> .
+
+<https://example.org/distribution/1> a dcat:Distribution ;
+    dct:title "CSV"@de ;
+    dct:format <http://publications.europa.eu/resource/authority/file-type/CSV> ;
+    dct:license <http://dcat-ap.ch/vocabulary/licenses/terms_by> ;
+    dcat:accessURL <https://example.org/data.csv> .
+
+<https://example.org/distribution/2> a dcat:Distribution ;
+    dct:title "Unbekannt"@de ;
+    dct:format <http://example.org/unknown-format> ;
+    dcat:accessURL <https://example.org/data.unknown> .
+"""
+
+
+def validate(dataset_graph, shacl_graph, ont_graph):
+    start = time.perf_counter()
+    for _ in range(NR_VALIDATIONS):
+        results = rdf_utils.get_shacl_results(dataset_graph, shacl_graph, ont_graph)
+    return time.perf_counter() - start, set(results)
+
+
+def main():
+    shacl_graph, ont_graph = rdf_utils.load_shacl_graphs(SHACL_FILE, ONT_FILES)
+    pruned_graph = rdf_utils.prune_ontology_graph(ont_graph, shacl_graph)
+    dataset_graph = Graph().parse(data=DATASET, format="turtle")
+
+    full_duration, full_results = validate(dataset_graph, shacl_graph, ont_graph)
+    print(
+        f"full ontology graph:   {len(ont_graph)} triples, "
+        f"{full_duration / NR_VALIDATIONS:.3f}s per dataset"
+    )
+    pruned_duration, pruned_results = validate(dataset_graph, shacl_graph, pruned_graph)
+    print(
+        f"pruned ontology graph: {len(pruned_graph)} triples, "
+        f"{pruned_duration / NR_VALIDATIONS:.3f}s per dataset"
+    )
+    print(
+        f"same results: {full_results == pruned_results} "
+        f"({len(full_results)} violations)"
+    )
+
+
+if __name__ == "__main__":
+    main()
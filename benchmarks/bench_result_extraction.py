@@ -0,0 +1,92 @@
+"""
+Benchmark of the extraction of the shacl results from the results graph
+
+A synthetic results graph with many violations is built, as pyshacl
+returns it for a dataset with a bad language tag on every distribution.
+The results are extracted with a query per property and result, as
+rdf_utils did before, and with the single pass of rdf_utils.
+
+Run from the repository root: python -m benchmarks.bench_result_extraction
+"""
+import time
+
+from rdflib import BNode, Graph, Literal, URIRef
+
+from ckan_pkg_checker.utils import rdf_utils
+from ckan_pkg_checker.utils.rdf_utils import DCT, RDF, SHACL, VCARD
+
+NR_VIOLATIONS = 10000
+
+
+def get_graphs():
+    dataset_graph = Graph()
+    results_graph = Graph()
+    rdf_utils._bind_namespaces(dataset_graph)
+    rdf_utils._bind_namespaces(results_graph)
+    for index in range(NR_VIOLATIONS):
+        node = URIRef(f"https://example.org/distribution/{index}")
+        result = BNode()
+        results_graph.add((result, RDF.type, SHACL.ValidationResult))
+        results_graph.add((result, SHACL.focusNode, node))
+        results_graph.add((result, SHACL.resultSeverity, SHACL.Violation))
+        results_graph.add((result, SHACL.resultMessage, Literal("bad language")))
+        if index % 2:
+            results_graph.add((result, SHACL.resultPath, DCT.language))
+            results_graph.add((result, SHACL.value, Literal("xx")))
+        else:
+            # the value is a blank node that is taken from the dataset
+            contact = BNode()
+            dataset_graph.add((node, DCT.publisher, contact))
+            dataset_graph.add((contact, VCARD.hasEmail, Literal("info@example.org")))
+            results_graph.add((result, SHACL.resultPath, DCT.publisher))
+    return results_graph, dataset_graph
+
+
+def get_results_per_query(results_graph, dataset_graph):
+    """The extraction as it was done before the single pass"""
+    get_object = rdf_utils.get_object_from_graph
+    checker_results = []
+    for item in results_graph.subjects(RDF.type, SHACL.ValidationResult):
+        property_ref = get_object(results_graph, item, SHACL.resultPath)
+        if not property_ref:
+            continue
+        node = get_object(results_graph, item, SHACL.focusNode)
+        value = get_object(results_graph, item, SHACL.value) or get_object(
+            dataset_graph, node, property_ref
+        )
+        if type(value) == BNode:
+            for p, o in dataset_graph.predicate_objects(subject=value):
+                p_qname = dataset_graph.compute_qname(p)
+                value = f"{p_qname[0]}:{p_qname[2]} {o}"
+        severity = get_object(results_graph, item, SHACL.resultSeverity)
+        msg = get_object(results_graph, item, SHACL.resultMessage)
+        checker_results.append(
+            rdf_utils.ShaclResult(
+                node=node,
+                property=property_ref.n3(results_graph.namespace_manager),
+                value=value,
+                msg=msg.toPython(),
+                severity=results_graph.compute_qname(severity)[2],
+            )
+        )
+    return checker_results
+
+
+def main():
+    results_graph, dataset_graph = get_graphs()
+
+    start = time.perf_counter()
+    query_results = get_results_per_query(results_graph, dataset_graph)
+    duration = time.perf_counter() - start
+    print(f"query per property: {NR_VIOLATIONS} violations in {duration:.2f}s")
+
+    start = time.perf_counter()
+    results = rdf_utils._get_results_from_graph(results_graph, dataset_graph)
+    duration = time.perf_counter() - start
+    print(f"single pass:        {NR_VIOLATIONS} violations in {duration:.2f}s")
+
+    print(f"same results: {set(query_results) == set(results)}")
+
+
+if __name__ == "__main__":
+    main()
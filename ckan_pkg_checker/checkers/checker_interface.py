@@ -26,6 +26,10 @@ class CheckerInterface(metaclass=ABCMeta):
         """Check one data package"""
         raise NotImplementedError
 
+    def prefetch(self, pkg):
+        """Start loading what a data package needs, before it is checked"""
+        pass
+
     @abstractmethod
     def write_result(self, *args, **kwargs):
         """Write one result"""
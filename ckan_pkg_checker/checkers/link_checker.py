@@ -1,19 +1,32 @@
 import csv
 import json
 import logging
-from collections import namedtuple
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 import pandas as pd
 import requests
 
+import ckan_pkg_checker.utils.async_request_utils as async_request_utils
 import ckan_pkg_checker.utils.request_utils as request_utils
 from ckan_pkg_checker.checkers.checker_interface import CheckerInterface
 from ckan_pkg_checker.utils import utils
+from ckan_pkg_checker.utils.link_metrics import LinkMetrics
+from ckan_pkg_checker.utils.single_flight import SingleFlight
+from ckan_pkg_checker.utils.url_cache import UrlResultCache
+from ckan_pkg_checker.utils.url_inventory import UrlInventory
 
 log = logging.getLogger(__name__)
 
 CheckResult = namedtuple("CheckResult", ["resource_id", "item", "msg", "test_title"])
+LinkTest = namedtuple("LinkTest", ["url", "test_title", "resource_id"])
+# number of packages that may wait for their url checks in concurrent mode
+MAX_PENDING_PACKAGES = 100
+BACKEND_REQUESTS = "requests"
+BACKEND_AIOHTTP = "aiohttp"
 TEST_ACCESS_URL = "dcat:accessURL"
 TEST_RELATION_URL = "dct:relation"
 TEST_QUALIFIED_RELATION_URL = "dcat:qualifiedRelation"
@@ -39,9 +52,22 @@ link_checks = [
 
 
 class LinkChecker(CheckerInterface):
-    def __init__(self, rundir, config, siteurl):
+    def __init__(
+        self,
+        rundir,
+        config,
+        siteurl,
+        use_cache=True,
+        clear_cache=False,
+        incremental=False,
+    ):
         """Initialize the link checker"""
         self.url_result_cache = {}
+        self.url_futures = {}
+        self.url_flights = SingleFlight()
+        self.pending_packages = deque()
+        # guards the pending packages when packages are checked in parallel
+        self.pending_lock = threading.Lock()
         self.siteurl = siteurl
         runpath = utils.get_csvdir(rundir)
         self.csvfilepath = runpath / utils.get_config(
@@ -53,8 +79,127 @@ class LinkChecker(CheckerInterface):
         self.contactsstats_filename = runpath / utils.get_config(
             config, "contacts", "statsfile", required=True
         )
+        # timings of the requests and url checks, written next to the statistics
+        self.metrics = None
+        if utils.get_config_bool(config, "linkchecker", "metrics", fallback=False):
+            self.metrics = LinkMetrics()
+            self.metrics_csvfilepath = runpath / utils.get_config(
+                config, "linkchecker", "metrics_csvfile", fallback="linkmetrics.csv"
+            )
+            self.metrics_jsonfilepath = runpath / utils.get_config(
+                config, "linkchecker", "metrics_jsonfile", fallback="linkmetrics.json"
+            )
+        self.url_cache = None
+        if use_cache or clear_cache:
+            self.url_cache = self._get_url_cache(config, rundir)
+            if clear_cache:
+                self.url_cache.clear()
+            if not use_cache:
+                self.url_cache.close()
+                self.url_cache = None
+        self.session = request_utils.get_session(
+            pool_connections=utils.get_config_int(
+                config, "linkchecker", "pool_connections", fallback=10
+            ),
+            pool_maxsize=utils.get_config_int(
+                config, "linkchecker", "pool_maxsize", fallback=10
+            ),
+        )
+        # after circuit_breaker_failures connection errors or timeouts in a row
+        # the urls of a host are not requested anymore: 0 turns this off
+        self.circuit_breaker = None
+        circuit_breaker_failures = utils.get_config_int(
+            config, "linkchecker", "circuit_breaker_failures", fallback=5
+        )
+        if circuit_breaker_failures > 0:
+            self.circuit_breaker = request_utils.HostCircuitBreaker(
+                max_failures=circuit_breaker_failures,
+                reset_timeout=utils.get_config_int(
+                    config, "linkchecker", "circuit_breaker_reset_s", fallback=60
+                ),
+            )
+        # learns during the run which hosts are checked with GET right away
+        self.host_strategy = request_utils.HostStrategy(
+            connect_timeout=utils.get_config_int(
+                config,
+                "linkchecker",
+                "connect_timeout",
+                fallback=request_utils.CONNECT_TIMEOUT,
+            ),
+            read_timeout=utils.get_config_int(
+                config,
+                "linkchecker",
+                "read_timeout",
+                fallback=request_utils.READ_TIMEOUT,
+            ),
+            circuit_breaker=self.circuit_breaker,
+        )
+        self.host_limiter = None
+        self.executor = None
+        self.async_checker = None
+        host_connections = utils.get_config_int(
+            config, "linkchecker", "host_connections", fallback=2
+        )
+        host_interval = (
+            utils.get_config_int(config, "linkchecker", "host_interval_ms", fallback=0)
+            / 1000
+        )
+        backend = utils.get_config(
+            config, "linkchecker", "backend", fallback=BACKEND_REQUESTS
+        )
+        if backend == BACKEND_AIOHTTP:
+            self.async_checker = async_request_utils.AsyncUrlChecker(
+                max_connections=utils.get_config_int(
+                    config, "linkchecker", "max_connections", fallback=100
+                ),
+                host_limiter=async_request_utils.AsyncHostLimiter(
+                    max_connections=host_connections, min_interval=host_interval
+                ),
+                strategy=self.host_strategy,
+                metrics=self.metrics,
+            )
+        elif backend != BACKEND_REQUESTS:
+            raise click.UsageError(
+                f"Invalid value '{backend}' for option 'backend' in section "
+                f"'linkchecker': use '{BACKEND_REQUESTS}' or '{BACKEND_AIOHTTP}'"
+            )
+        else:
+            max_workers = utils.get_config_int(
+                config, "linkchecker", "max_workers", fallback=1
+            )
+            if max_workers > 1:
+                self.host_limiter = request_utils.HostLimiter(
+                    max_connections=host_connections, min_interval=host_interval
+                )
+                self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # the urls are checked concurrently by a thread pool or by the event loop
+        self.concurrent = bool(self.executor or self.async_checker)
+        self.inventory = None
+        if incremental:
+            # the inventory is kept in the tmp directory, so that it outlives the run
+            inventory_file = utils.get_config(
+                config, "linkchecker", "inventory_file", fallback="linkinventory.sqlite"
+            )
+            self.inventory = UrlInventory(rundir.parent / inventory_file)
         self._prepare_csv_file()
 
+    def _get_url_cache(self, config, rundir):
+        # the cache is kept in the tmp directory, so that it outlives the run
+        cache_file = utils.get_config(
+            config, "linkchecker", "cache_file", fallback="linkcache.sqlite"
+        )
+        return UrlResultCache(
+            path=rundir.parent / cache_file,
+            success_ttl=utils.get_config_int(
+                config, "linkchecker", "cache_success_ttl_hours", fallback=24
+            )
+            * 3600,
+            failure_ttl=utils.get_config_int(
+                config, "linkchecker", "cache_failure_ttl_hours", fallback=168
+            )
+            * 3600,
+        )
+
     def _prepare_csv_file(self):
         self.csv_fieldnames = [
             "contact_email",
@@ -71,21 +216,59 @@ class LinkChecker(CheckerInterface):
             "template",
         ]
         self.csvfile = open(self.csvfilepath, "w")
-        self.csvwriter = csv.DictWriter(self.csvfile, fieldnames=self.csv_fieldnames)
+        self.csvwriter = utils.QueuedCsvWriter(
+            self.csvfile, fieldnames=self.csv_fieldnames
+        )
         self.csvwriter.writeheader()
 
     def check_package(self, pkg):
         """Check one data package"""
+        link_tests = self._get_link_tests(pkg)
+        if self.inventory:
+            # the urls are checked from the inventory, see check_inventory
+            self.inventory.put_package(pkg, link_tests)
+        elif self.concurrent:
+            with self.pending_lock:
+                self._submit_package(pkg, link_tests)
+        else:
+            self._write_package_results(pkg, link_tests)
+
+    def get_last_modified(self):
+        """Get the newest metadata_modified of the packages in the inventory"""
+        if self.inventory:
+            return self.inventory.get_last_modified()
+        return None
+
+    def check_inventory(self, pkg_names, enrich_package):
+        """Check the urls of the inventory and write the results of all packages
+
+        Packages that are not in pkg_names anymore are removed from the
+        inventory. Each url is checked once, however many packages reference
+        it. The packages are enriched again with enrich_package, before
+        their results are written in the order of their names.
+        """
+        if pkg_names:
+            self.inventory.remove_packages_except(pkg_names)
+        if self.concurrent:
+            for url in self.inventory.get_urls():
+                self._submit_probe(url)
+        for pkg, references in self.inventory.iter_packages():
+            enrich_package(pkg)
+            self._write_package_results(
+                pkg, [LinkTest(*reference) for reference in references]
+            )
+
+    def _get_link_tests(self, pkg):
+        """Collect the urls of a package"""
         # Check URLs of the package
-        pkg_type = pkg.get("pkg_type", utils.DCAT)
-        check_results = []
+        link_tests = []
 
         # Check landing page URL
         landing_page_url = pkg.get("url")
         self._check_url(
             url=landing_page_url,
             test_title=TEST_LANDING_PAGE_URL,
-            results=check_results,
+            tests=link_tests,
         )
 
         # Check publisher URL - mandatory field
@@ -101,7 +284,7 @@ class LinkChecker(CheckerInterface):
 
         publisher_url = pkg["publisher"].get("url")
         self._check_url(
-            url=publisher_url, test_title=TEST_PUBLISHER_URL, results=check_results
+            url=publisher_url, test_title=TEST_PUBLISHER_URL, tests=link_tests
         )
 
         # Check relations URL
@@ -111,7 +294,7 @@ class LinkChecker(CheckerInterface):
                 self._check_url(
                     url=relation_url,
                     test_title=TEST_RELATION_URL,
-                    results=check_results,
+                    tests=link_tests,
                 )
 
         # Check qualified relations URL
@@ -121,7 +304,7 @@ class LinkChecker(CheckerInterface):
                 self._check_url(
                     url=qualified_relation_url,
                     test_title=TEST_QUALIFIED_RELATION_URL,
-                    results=check_results,
+                    tests=link_tests,
                 )
 
         # Check conforms to URLs
@@ -130,7 +313,7 @@ class LinkChecker(CheckerInterface):
                 self._check_url(
                     url=conforms_to_url,
                     test_title=TEST_CONFORMS_TO_URL,
-                    results=check_results,
+                    tests=link_tests,
                 )
 
         # Check documentation URLs
@@ -139,7 +322,7 @@ class LinkChecker(CheckerInterface):
                 self._check_url(
                     url=documentation_url,
                     test_title=TEST_DOCUMENTATION_URL,
-                    results=check_results,
+                    tests=link_tests,
                 )
 
         # Check URLs of the resources
@@ -147,9 +330,60 @@ class LinkChecker(CheckerInterface):
             log.info(
                 f"LINKCHECKER: checking RESOURCE: {utils.get_field_in_one_language(resource['display_name'], '')}"
             )
-            resource_results = self._check_resource(pkg, resource)
-            if resource_results:
-                check_results.extend(resource_results)
+            link_tests.extend(self._check_resource(pkg, resource))
+        return link_tests
+
+    def _submit_package(self, pkg, link_tests):
+        """Start the url checks of a package in the thread pool or event loop
+
+        The results are written in the order the packages came in, so that
+        the csv file is the same as in sequential mode.
+        """
+        for link_test in link_tests:
+            self._submit_probe(link_test.url)
+        self.pending_packages.append((pkg, link_tests))
+        self._write_finished_packages()
+
+    def _submit_probe(self, url):
+        """Start the check of an url, unless it is already checked or started"""
+        if url in self.url_result_cache or url in self.url_futures:
+            return
+        if self.async_checker:
+            self.url_futures[url] = self.async_checker.submit(
+                self._probe_url_async(url)
+            )
+        else:
+            self.url_futures[url] = self.executor.submit(self._probe_url, url)
+
+    def _write_finished_packages(self, drain=False):
+        """Write the results of the packages whose url checks are done
+
+        If too many packages are pending or if all packages should be
+        written, the url checks are waited for.
+        """
+        while self.pending_packages:
+            pkg, link_tests = self.pending_packages[0]
+            wait = drain or len(self.pending_packages) > MAX_PENDING_PACKAGES
+            if not wait and not all(
+                self.url_futures[link_test.url].done()
+                for link_test in link_tests
+                if link_test.url in self.url_futures
+            ):
+                return
+            self.pending_packages.popleft()
+            self._write_package_results(pkg, link_tests)
+
+    def _write_package_results(self, pkg, link_tests):
+        pkg_type = pkg.get("pkg_type", utils.DCAT)
+        check_results = []
+        for link_test in link_tests:
+            if self.metrics:
+                self.metrics.record_reference(link_test.test_title, link_test.url)
+            check_result = self._check_url_status(
+                link_test.test_title, link_test.url, link_test.resource_id
+            )
+            if check_result:
+                check_results.append(check_result)
         if not check_results:
             return
         contacts = utils.get_pkg_metadata_contacts(
@@ -163,29 +397,48 @@ class LinkChecker(CheckerInterface):
             self.write_result(pkg, pkg_type, check_result, contacts)
 
     def finish(self):
+        if self.concurrent:
+            with self.pending_lock:
+                self._write_finished_packages(drain=True)
+        if self.executor:
+            self.executor.shutdown()
+        if self.async_checker:
+            self.async_checker.close()
+        self.session.close()
+        if self.url_cache:
+            self.url_cache.close()
+        if self.inventory:
+            self.inventory.close()
+        self.csvwriter.close()
         self.csvfile.close()
         self._statistics()
+        if self.circuit_breaker:
+            # the short-circuited urls are counted with their test titles too,
+            # so they are not added to the statistics
+            utils.log_and_echo_msg(
+                f"{self.circuit_breaker.short_circuited} urls of unreachable "
+                "hosts were not requested"
+            )
+        if self.metrics:
+            if self.circuit_breaker:
+                self.metrics.short_circuited_urls = self.circuit_breaker.short_circuited
+            self._write_metrics()
         utils.contacts_statistics(
             checker_result_path=self.csvfilepath,
             contactsstats_filename=self.contactsstats_filename,
             checker_error_fieldname="error_message",
         )
 
-    def _check_url(self, url, test_title, results, resource_id=None):
-        """Verify a single URL"""
+    def _check_url(self, url, test_title, tests, resource_id=None):
+        """Register a single URL for verification"""
         if url:
-            if not resource_id:
-                # Verify Dataset URL
-                check_result = self._check_url_status(test_title, url)
-            else:
-                # Verify Resource URL
-                check_result = self._check_url_status(test_title, url, resource_id)
-            if check_result:
-                results.append(check_result)
+            tests.append(
+                LinkTest(url=url, test_title=test_title, resource_id=resource_id)
+            )
 
     def _check_resource(self, pkg, resource):
         """Check one resource"""
-        resource_results = []
+        resource_tests = []
         access_url = resource["url"]
         try:
             download_url = resource["download_url"]
@@ -199,7 +452,7 @@ class LinkChecker(CheckerInterface):
                 url=access_url,
                 test_title=TEST_ACCESS_URL,
                 resource_id=resource["id"],
-                results=resource_results,
+                tests=resource_tests,
             )
 
         # Check download URL for the resources
@@ -208,7 +461,7 @@ class LinkChecker(CheckerInterface):
                 url=download_url,
                 test_title=TEST_DOWNLOAD_URL,
                 resource_id=resource["id"],
-                results=resource_results,
+                tests=resource_tests,
             )
 
         # Check documentation URLs for the resources
@@ -218,7 +471,7 @@ class LinkChecker(CheckerInterface):
                     url=documentation_url,
                     test_title=TEST_RESOURCE_DOCUMENTATION_URL,
                     resource_id=resource["id"],
-                    results=resource_results,
+                    tests=resource_tests,
                 )
 
         # Check documentation URLs for the resources
@@ -228,23 +481,14 @@ class LinkChecker(CheckerInterface):
                     url=access_services_url,
                     test_title=TEST_ACCESS_SERVICES_URL,
                     resource_id=resource["id"],
-                    results=resource_results,
+                    tests=resource_tests,
                 )
 
-        return resource_results
+        return resource_tests
 
     def _check_url_status(self, test_title, test_url, resource_id=None):
         """Check one url"""
-        if test_url in self.url_result_cache:
-            test_result = self.url_result_cache[test_url]
-        else:
-            # check first as 'HEAD', then as 'GET'
-            test_result = request_utils.check_url_status(test_url)
-            if test_result:
-                test_result = request_utils.check_url_status(
-                    test_url, http_method="GET"
-                )
-            self.url_result_cache[test_url] = test_result
+        test_result = self._get_url_result(test_url)
         if test_result:
             check_result = CheckResult(
                 msg=test_result,
@@ -260,6 +504,109 @@ class LinkChecker(CheckerInterface):
             )
             return check_result
 
+    def _get_url_result(self, test_url):
+        if test_url in self.url_result_cache:
+            return self.url_result_cache[test_url]
+        # packages that are checked in parallel may ask for the same url at
+        # the same time: it is checked only once for all of them
+        return self.url_flights.do(test_url, self._load_url_result, test_url)
+
+    def _load_url_result(self, test_url):
+        if test_url in self.url_result_cache:
+            return self.url_result_cache[test_url]
+        future = self.url_futures.pop(test_url, None)
+        if future:
+            test_result = future.result()
+        else:
+            test_result = self._probe_url(test_url)
+        self.url_result_cache[test_url] = test_result
+        return test_result
+
+    def _probe_url(self, test_url):
+        """Check one url against the server or take it from the url cache
+
+        Urls that were ok are taken from the cache while they are fresh and
+        otherwise revalidated with a conditional request if possible.
+        Failed urls are always checked again.
+        """
+        start = time.perf_counter()
+        cached_url = self._get_cached_url(test_url)
+        if cached_url:
+            if self._is_fresh(test_url, cached_url):
+                return None
+            if (
+                cached_url.etag or cached_url.last_modified
+            ) and request_utils.revalidate_url(
+                test_url,
+                etag=cached_url.etag,
+                last_modified=cached_url.last_modified,
+                host_limiter=self.host_limiter,
+                session=self.session,
+                strategy=self.host_strategy,
+                metrics=self.metrics,
+            ):
+                return self._set_revalidated(test_url, start)
+        url_check = request_utils.check_url_with_validators(
+            test_url,
+            host_limiter=self.host_limiter,
+            session=self.session,
+            strategy=self.host_strategy,
+            metrics=self.metrics,
+        )
+        return self._put_url_check(test_url, url_check, start)
+
+    async def _probe_url_async(self, test_url):
+        """The same as _probe_url, with the requests sent by the event loop"""
+        start = time.perf_counter()
+        cached_url = self._get_cached_url(test_url)
+        if cached_url:
+            if self._is_fresh(test_url, cached_url):
+                return None
+            if (
+                cached_url.etag or cached_url.last_modified
+            ) and await self.async_checker.revalidate_url(
+                test_url,
+                etag=cached_url.etag,
+                last_modified=cached_url.last_modified,
+            ):
+                return self._set_revalidated(test_url, start)
+        url_check = await self.async_checker.check_url_with_validators(test_url)
+        return self._put_url_check(test_url, url_check, start)
+
+    def _get_cached_url(self, test_url):
+        """Get the cache entry of an url that was ok"""
+        cached_url = self.url_cache.get(test_url) if self.url_cache else None
+        if cached_url and not cached_url.error:
+            return cached_url
+        return None
+
+    def _is_fresh(self, test_url, cached_url):
+        if self.url_cache.is_fresh(cached_url):
+            log.debug(f"URL {test_url} taken from url cache")
+            if self.metrics:
+                self.metrics.record_url(test_url)
+            return True
+        return False
+
+    def _set_revalidated(self, test_url, start):
+        log.debug(f"URL {test_url} revalidated")
+        self.url_cache.touch(test_url)
+        if self.metrics:
+            self.metrics.record_url(test_url, time.perf_counter() - start)
+        return None
+
+    def _put_url_check(self, test_url, url_check, start):
+        if self.metrics:
+            self.metrics.record_url(test_url, time.perf_counter() - start)
+        if self.url_cache:
+            self.url_cache.put(
+                test_url,
+                error=url_check.error,
+                etag=url_check.etag,
+                last_modified=url_check.last_modified,
+            )
+        return url_check.error
+
     def write_result(self, pkg, pkg_type, check_result, contacts):
         title = utils.get_field_in_one_language(pkg["title"], pkg["name"])
         dataset_url = utils.get_ckan_dataset_url(self.siteurl, pkg["name"])
@@ -269,23 +616,34 @@ class LinkChecker(CheckerInterface):
             resource_url = utils.get_ckan_resource_url(
                 self.siteurl, pkg["name"], check_result.resource_id
             )
-        for contact in contacts:
-            self.csvwriter.writerow(
-                {
-                    "contact_email": contact.email,
-                    "contact_name": contact.name,
-                    "organization_name": organization,
-                    "test_url": check_result.item,
-                    "error_message": check_result.msg,
-                    "dataset_title": title,
-                    "dataset_url": dataset_url,
-                    "resource_url": resource_url,
-                    "test_title": check_result.test_title,
-                    "pkg_type": pkg_type,
-                    "checker_type": utils.MODE_LINK,
-                    "template": "linkchecker_error.html",
-                }
-            )
+        self.csvwriter.writerows(
+            {
+                "contact_email": contact.email,
+                "contact_name": contact.name,
+                "organization_name": organization,
+                "test_url": check_result.item,
+                "error_message": check_result.msg,
+                "dataset_title": title,
+                "dataset_url": dataset_url,
+                "resource_url": resource_url,
+                "test_title": check_result.test_title,
+                "pkg_type": pkg_type,
+                "checker_type": utils.MODE_LINK,
+                "template": "linkchecker_error.html",
+            }
+            for contact in contacts
+        )
+
+    def _write_metrics(self):
+        summary = self.metrics.write(
+            self.metrics_csvfilepath, self.metrics_jsonfilepath
+        )
+        utils.log_and_echo_msg(
+            f"{summary['urls']} urls checked with {summary['requests']['count']} "
+            f"requests in {summary['elapsed_s']:.0f}s: "
+            f"{summary['urls_per_second']:.1f} urls per second, "
+            f"{summary['requests']['timeouts']} timeouts"
+        )
 
     def _statistics(self):
         df = pd.read_csv(self.csvfilepath)
@@ -299,12 +657,12 @@ class LinkChecker(CheckerInterface):
         )
         dg = dg.set_index("message")
         msg_dict = dg.to_dict().get("count")
-        statfile = open(self.statfilepath, "w")
-        statwriter = csv.DictWriter(statfile, fieldnames=["message", "count"])
-        statwriter.writeheader()
-        for check in link_checks:
-            count = msg_dict.get(check, 0)
-            statwriter.writerow({"message": check, "count": count})
+        with open(self.statfilepath, "w") as statfile:
+            statwriter = csv.DictWriter(statfile, fieldnames=["message", "count"])
+            statwriter.writeheader()
+            for check in link_checks:
+                count = msg_dict.get(check, 0)
+                statwriter.writerow({"message": check, "count": count})
 
     def __repr__(self):
         return "Link Checker"
@@ -1,20 +1,26 @@
 import csv
 import logging
-from collections import namedtuple
+import multiprocessing
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
 import pandas as pd
-from rdflib import Graph
 
 from ckan_pkg_checker.checkers.checker_interface import CheckerInterface
-from ckan_pkg_checker.utils import rdf_utils, utils
+from ckan_pkg_checker.utils import rdf_utils, source_fetcher, utils
+from ckan_pkg_checker.utils.validation_store import ValidationResultStore
 
 log = logging.getLogger(__name__)
 
 ShaclResult = namedtuple("ShaclResult", ["property", "value", "msg", "node"])
+# number of datasets per worker that may wait for their validation
+MAX_PENDING_PER_WORKER = 10
 
 
 class ShaclChecker(CheckerInterface):
-    def __init__(self, rundir, config, siteurl):
+    def __init__(self, rundir, config, siteurl, workers=1, incremental=False):
         """Initialize the validation checker"""
         self.siteurl = siteurl
         runpath = utils.get_csvdir(rundir)
@@ -48,30 +54,107 @@ class ShaclChecker(CheckerInterface):
         language_file = utils.get_config(
             config, "shaclchecker", "language_file", required=True
         )
+        self.source_cache = rdf_utils.HarvestSourceCache(
+            maxsize=utils.get_config_int(
+                config, "shaclchecker", "source_cache_size", fallback=10
+            ),
+            stream=utils.get_config_bool(
+                config, "shaclchecker", "stream_sources", fallback=False
+            ),
+            fetcher=self._get_source_fetcher(config, rundir),
+        )
+        # the harvest sources of the upcoming datasets are loaded in the
+        # background, at most prefetch_sources of them ahead of the checks
+        self.prefetch_sources = min(
+            utils.get_config_int(
+                config, "shaclchecker", "prefetch_sources", fallback=2
+            ),
+            self.source_cache.maxsize,
+        )
+        self.prefetch_executor = None
+        # harvest sources that are prefetched but not yet used by a check
+        self.prefetched_sources = set()
+        self.prefetch_condition = threading.Condition()
+        if self.prefetch_sources > 0:
+            self.prefetch_executor = ThreadPoolExecutor(
+                max_workers=self.prefetch_sources, thread_name_prefix="prefetch"
+            )
         self._prepare_csv_file()
-        self.shacl_graph = rdf_utils.parse_rdf_graph_from_url(file=shaclfile, bind=True)
-
-        # Load and merge ontology graphs into a single RDF graph
-        frequency_graph = rdf_utils.parse_rdf_graph_from_url(file=frequency_file)
-        theme_graph = rdf_utils.parse_rdf_graph_from_url(file=theme_file)
-        licenses_graph = rdf_utils.parse_rdf_graph_from_url(file=licenses_file)
-        formats_graph = rdf_utils.parse_rdf_graph_from_url(file=formats_file)
-        mime_types_graph = rdf_utils.parse_rdf_graph_from_url(file=mime_types_file)
-        language_graph = rdf_utils.parse_rdf_graph_from_url(file=language_file)
-
-        self.ont_graph = Graph()
-        ont_graphs_list = [
-            frequency_graph,
-            theme_graph,
-            licenses_graph,
-            formats_graph,
-            mime_types_graph,
-            language_graph,
+        ont_files = [
+            frequency_file,
+            theme_file,
+            licenses_file,
+            formats_file,
+            mime_types_file,
+            language_file,
         ]
-        triples_to_add = [triple for graph in ont_graphs_list for triple in graph]
+        # the compiled graphs are kept in the tmp directory across runs
+        graph_cache_dir = utils.get_config(
+            config, "shaclchecker", "graph_cache_dir", fallback=str(rundir.parent)
+        )
+        prune_ontology = utils.get_config_bool(
+            config, "shaclchecker", "prune_ontology", fallback=True
+        )
+        self.shacl_graph, self.ont_graph = rdf_utils.load_shacl_graphs(
+            shaclfile, ont_files, cache_dir=graph_cache_dir, prune=prune_ontology
+        )
+        self.validation_count = 0
+        self.validation_time = 0
+        self.result_store = None
+        self.stored_count = 0
+        if incremental:
+            # the results are kept in the tmp directory, so that they outlive the run
+            store_file = utils.get_config(
+                config,
+                "shaclchecker",
+                "results_store_file",
+                fallback="shaclresults.sqlite",
+            )
+            self.result_store = ValidationResultStore(rundir.parent / store_file)
+            self.shapes_hash = rdf_utils.get_shapes_hash(
+                shaclfile, ont_files, prune=prune_ontology
+            )
+        # datasets of one harvest source can be validated together
+        self.batch_size = utils.get_config_int(
+            config, "shaclchecker", "batch_size", fallback=0
+        )
+        self.batches = {}
+        self.executor = None
+        self.pending_packages = deque()
+        self.pending_lock = threading.Lock()
+        self.max_pending = workers * MAX_PENDING_PER_WORKER * max(self.batch_size, 1)
+        if workers > 1:
+            # the workers load the compiled graphs themselves at their start
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=rdf_utils.init_shacl_worker,
+                initargs=(shaclfile, ont_files, graph_cache_dir, prune_ontology),
+            )
 
-        for triple in triples_to_add:
-            self.ont_graph.add(triple)
+    def _get_source_fetcher(self, config, rundir):
+        # the harvest sources are kept in the tmp directory across runs
+        source_cache_dir = utils.get_config(
+            config,
+            "shaclchecker",
+            "source_cache_dir",
+            fallback=str(rundir.parent / "harvest_sources"),
+        )
+        return source_fetcher.HarvestSourceFetcher(
+            source_cache_dir,
+            connect_timeout=utils.get_config_int(
+                config,
+                "shaclchecker",
+                "source_connect_timeout",
+                fallback=source_fetcher.CONNECT_TIMEOUT,
+            ),
+            read_timeout=utils.get_config_int(
+                config,
+                "shaclchecker",
+                "source_read_timeout",
+                fallback=source_fetcher.READ_TIMEOUT,
+            ),
+        )
 
     def _prepare_csv_file(self):
         self.csv_fieldnames = [
@@ -90,17 +173,48 @@ class ShaclChecker(CheckerInterface):
             "template",
         ]
         self.csvfile = open(self.csvfilename, "w")
-        self.csvwriter = csv.DictWriter(self.csvfile, fieldnames=self.csv_fieldnames)
+        self.csvwriter = utils.QueuedCsvWriter(
+            self.csvfile, fieldnames=self.csv_fieldnames
+        )
         self.csvwriter.writeheader()
 
+    def prefetch(self, pkg):
+        """Load the harvest source of a data package in the background
+
+        Waits while prefetch_sources harvest sources are prefetched that no
+        check has used yet, so that the prefetch runs ahead of the checks
+        only as far as the cache can keep the sources. A check that needs a
+        source while it is prefetched waits for it in the source cache.
+        """
+        source_url = pkg.get("source_url")
+        if not self.prefetch_executor or not source_url:
+            return
+        with self.prefetch_condition:
+            if source_url in self.prefetched_sources or source_url in self.source_cache:
+                return
+            self.prefetch_condition.wait_for(
+                lambda: len(self.prefetched_sources) < self.prefetch_sources
+            )
+            self.prefetched_sources.add(source_url)
+        self.prefetch_executor.submit(self.source_cache.get, source_url)
+
+    def _release_prefetched_source(self, source_url):
+        """Let the prefetch load another source once a check used this one"""
+        with self.prefetch_condition:
+            if source_url in self.prefetched_sources:
+                self.prefetched_sources.remove(source_url)
+                self.prefetch_condition.notify()
+
     def check_package(self, pkg):
         """Check one data package"""
-        pkg_type = pkg.get("pkg_type", utils.DCAT)
         dataset_graph = None
         if pkg.get("source_url"):
-            dataset_graph = rdf_utils.get_dataset_graph_from_source(
-                pkg["source_url"], pkg["identifier"]
-            )
+            try:
+                dataset_graph = rdf_utils.get_dataset_graph_from_source(
+                    pkg["source_url"], pkg["identifier"], cache=self.source_cache
+                )
+            finally:
+                self._release_prefetched_source(pkg["source_url"])
             utils.log_and_echo_msg(
                 f"--> rdf graph for Dataset{pkg.get('name')} taken from harvest source."
             )
@@ -123,9 +237,146 @@ class ShaclChecker(CheckerInterface):
             )
             return
 
+        graph_hash = None
+        if self.result_store:
+            graph_hash = rdf_utils.get_graph_hash(dataset_graph)
+            checker_results = self.result_store.get(
+                pkg["name"], graph_hash, self.shapes_hash
+            )
+            if checker_results is not None:
+                self._write_stored_results(pkg, checker_results)
+                return
+        if self.batch_size > 1:
+            with self.pending_lock:
+                self._add_to_batch(pkg, dataset_graph, graph_hash)
+            return
+        if self.executor:
+            with self.pending_lock:
+                self._submit_package(pkg, dataset_graph, graph_hash)
+            return
+        start = time.perf_counter()
         checker_results = rdf_utils.get_shacl_results(
             dataset_graph, self.shacl_graph, self.ont_graph
         )
+        self.validation_time += time.perf_counter() - start
+        self.validation_count += 1
+        self._write_package_results(pkg, checker_results, graph_hash)
+
+    def _write_stored_results(self, pkg, checker_results):
+        """Write the results of a previous run for an unchanged dataset"""
+        utils.log_and_echo_msg(
+            f"--> Dataset {pkg.get('name')} is unchanged since its last validation"
+        )
+        with self.pending_lock:
+            self.stored_count += 1
+            if not self.pending_packages:
+                self._write_package_results(pkg, checker_results)
+                return
+            future = Future()
+            future.set_result(checker_results)
+            self.pending_packages.append((pkg, future, None))
+            self._write_finished_packages()
+
+    def _submit_package(self, pkg, dataset_graph, graph_hash=None):
+        """Validate the dataset graph in the process pool
+
+        The graph is handed over to the worker as N-Triples. The results
+        are written in the order the packages came in.
+        """
+        future = self.executor.submit(
+            rdf_utils.validate_serialized_dataset,
+            dataset_graph.serialize(format="nt"),
+        )
+        self.pending_packages.append((pkg, future, graph_hash))
+        self._write_finished_packages()
+
+    def _add_to_batch(self, pkg, dataset_graph, graph_hash=None):
+        """Collect the dataset graphs of a harvest source for validation
+
+        A batch is validated as soon as it is full or when one of its
+        packages needs to be written.
+        """
+        future = Future()
+        batch = self.batches.setdefault(pkg["source_url"], [])
+        batch.append((dataset_graph, future))
+        self.pending_packages.append((pkg, future, graph_hash))
+        if len(batch) >= self.batch_size:
+            self._validate_batch(self.batches.pop(pkg["source_url"]))
+        self._write_finished_packages()
+
+    def _validate_batch(self, batch):
+        dataset_graphs = [dataset_graph for dataset_graph, _ in batch]
+        if self.executor:
+            batch_future = self.executor.submit(
+                rdf_utils.validate_serialized_batch,
+                [
+                    dataset_graph.serialize(format="nt")
+                    for dataset_graph in dataset_graphs
+                ],
+            )
+            batch_future.add_done_callback(
+                lambda batch_future: self._set_batch_results(batch, batch_future)
+            )
+            return
+        batch_future = Future()
+        start = time.perf_counter()
+        try:
+            batch_future.set_result(
+                rdf_utils.get_batch_shacl_results(
+                    dataset_graphs, self.shacl_graph, self.ont_graph
+                )
+            )
+        except Exception as e:
+            batch_future.set_exception(e)
+        self.validation_time += time.perf_counter() - start
+        self.validation_count += len(batch)
+        self._set_batch_results(batch, batch_future)
+
+    def _set_batch_results(self, batch, batch_future):
+        try:
+            batch_results = batch_future.result()
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), checker_results in zip(batch, batch_results):
+            future.set_result(checker_results)
+
+    def _validate_open_batch(self, pkg, future):
+        batch = self.batches.get(pkg.get("source_url"), [])
+        if any(batch_future is future for _, batch_future in batch):
+            self._validate_batch(self.batches.pop(pkg["source_url"]))
+
+    def _write_finished_packages(self, drain=False):
+        while self.pending_packages:
+            pkg, future, graph_hash = self.pending_packages[0]
+            wait = drain or len(self.pending_packages) > self.max_pending
+            if not wait and not future.done():
+                return
+            if not future.done():
+                self._validate_open_batch(pkg, future)
+            self.pending_packages.popleft()
+            try:
+                checker_results = future.result()
+            except Exception as e:
+                utils.log_and_echo_msg(
+                    f"Exception {e} of type {type(e).__name__} occured "
+                    f"at the validation of dataset {pkg.get('name')}",
+                    error=True,
+                )
+                continue
+            self._write_package_results(pkg, checker_results, graph_hash)
+
+    def _write_package_results(self, pkg, checker_results, graph_hash=None):
+        if graph_hash:
+            self.result_store.put(
+                pkg["name"],
+                pkg.get("metadata_modified"),
+                graph_hash,
+                self.shapes_hash,
+                checker_results,
+            )
+        pkg_type = pkg.get("pkg_type", utils.DCAT)
         if not checker_results:
             utils.log_and_echo_msg(f"--> Dataset {pkg.get('name')} conforms")
         else:
@@ -147,27 +398,47 @@ class ShaclChecker(CheckerInterface):
         title = utils.get_field_in_one_language(pkg["title"], pkg["name"])
         dataset_url = utils.get_ckan_dataset_url(self.siteurl, pkg["name"])
         organization = pkg.get("organization").get("name")
-        for contact in contacts:
-            self.csvwriter.writerow(
-                {
-                    "contact_email": contact.email,
-                    "contact_name": contact.name,
-                    "organization_name": organization,
-                    "dataset_title": title,
-                    "dataset_url": dataset_url,
-                    "node": shacl_result.node,
-                    "property": shacl_result.property,
-                    "value": shacl_result.value,
-                    "severity": shacl_result.severity,
-                    "error_msg": shacl_result.msg,
-                    "pkg_type": pkg_type,
-                    "checker_type": utils.MODE_SHACL,
-                    "template": "shaclchecker_error.html",
-                }
-            )
+        self.csvwriter.writerows(
+            {
+                "contact_email": contact.email,
+                "contact_name": contact.name,
+                "organization_name": organization,
+                "dataset_title": title,
+                "dataset_url": dataset_url,
+                "node": shacl_result.node,
+                "property": shacl_result.property,
+                "value": shacl_result.value,
+                "severity": shacl_result.severity,
+                "error_msg": shacl_result.msg,
+                "pkg_type": pkg_type,
+                "checker_type": utils.MODE_SHACL,
+                "template": "shaclchecker_error.html",
+            }
+            for contact in contacts
+        )
 
     def finish(self):
         """Close the file"""
+        with self.pending_lock:
+            for source_url in list(self.batches):
+                self._validate_batch(self.batches.pop(source_url))
+            self._write_finished_packages(drain=True)
+        if self.executor:
+            self.executor.shutdown()
+        if self.prefetch_executor:
+            self.prefetch_executor.shutdown()
+        self.source_cache.close()
+        if self.result_store:
+            self.result_store.close()
+            utils.log_and_echo_msg(
+                f"{self.stored_count} unchanged datasets taken from previous runs"
+            )
+        if self.validation_count:
+            utils.log_and_echo_msg(
+                f"{self.validation_count} datasets validated in "
+                f"{self.validation_time / self.validation_count:.3f}s on average"
+            )
+        self.csvwriter.close()
         self.csvfile.close()
         self._statistics()
         utils.contacts_statistics(
@@ -1,13 +1,29 @@
 import csv
+import heapq
+import itertools
 import logging
 import os
+import pickle
+import tempfile
+from collections import namedtuple
 
+import click
 import pandas as pd
 
 from ckan_pkg_checker.utils import utils
 
 log = logging.getLogger(__name__)
 
+# the message of one result row for one mailbox: the parts sort by mailbox
+# and then in the order of the rows
+MailPart = namedtuple(
+    "MailPart", ["pkg_type", "email", "seq", "name", "checker_type", "msg"]
+)
+# number of mail parts that are sorted in memory before they are written to
+# a temporary file and merged
+SORT_BUFFER_SIZE = 100000
+WRITE_BUFFER_SIZE = 1024 * 1024
+
 
 class EmailBuilder:
     def __init__(self, rundir, mode, config):
@@ -39,40 +55,96 @@ class EmailBuilder:
                 config, "emailbuilder", "default_email", required=True
             ),
         )
+        self.sort_buffer_size = utils.get_config_int(
+            config, "emailbuilder", "sort_buffer_size", fallback=SORT_BUFFER_SIZE
+        )
+        if self.sort_buffer_size < 1:
+            raise click.UsageError(
+                "Configuration value for '[emailbuilder] sort_buffer_size' must "
+                "be at least 1."
+            )
 
     def build(self):
         utils.log_and_echo_msg("building emails")
-        with open(self.csvpath, "r") as readfile:
-            reader = csv.DictReader(readfile)
-            for row in reader:
-                self._process_line(row)
+        self._build_mails()
         if self.statpath:
             self._build_statistics()
         if self.contactsstats_path:
             self._build_contacts_statistics()
 
-    def _process_line(self, row):
-        contacts = [utils.Contact(email=row["contact_email"], name=row["contact_name"])]
-        if self.default_contact.email not in [contact.email for contact in contacts]:
-            contacts.append(self.default_contact)
-        for contact in contacts:
-            pkg_type = row["pkg_type"]
-            mailfile = os.path.join(
-                self.mailpath, pkg_type + "#" + contact.email + ".html"
+    def _build_mails(self):
+        """Write the mail of each mailbox at once
+
+        The result rows are read as a stream and each row is rendered once
+        for its contact and the default contact. The rendered parts are
+        sorted by mailbox, so that each mail file is opened only once and
+        gets its header and then the messages of its rows in their order.
+        """
+        with open(self.csvpath, "r") as readfile:
+            mail_parts = self._sort_mail_parts(
+                self._iter_mail_parts(csv.DictReader(readfile))
             )
-            msg = ""
-            if not os.path.isfile(mailfile):
-                utils.log_and_echo_msg(
-                    f"email for {row['pkg_type']}#{row['contact_email']}"
-                )
-                msg += utils.build_msg_per_contact(
-                    receiver_name=contact.name,
-                    checker_type=row["checker_type"],
+            for (pkg_type, email), parts in itertools.groupby(
+                mail_parts, key=lambda part: (part.pkg_type, part.email)
+            ):
+                self._write_mail(pkg_type, email, parts)
+
+    def _iter_mail_parts(self, reader):
+        for seq, row in enumerate(reader):
+            msg = utils.build_msg_per_error(row)
+            contacts = [
+                utils.Contact(email=row["contact_email"], name=row["contact_name"])
+            ]
+            if self.default_contact.email != row["contact_email"]:
+                contacts.append(self.default_contact)
+            for contact in contacts:
+                yield MailPart(
                     pkg_type=row["pkg_type"],
+                    email=contact.email,
+                    seq=seq,
+                    name=contact.name,
+                    checker_type=row["checker_type"],
+                    msg=msg,
                 )
-            msg += utils.build_msg_per_error(row)
-            with open(mailfile, "a") as writemail:
-                writemail.write(msg)
+
+    def _sort_mail_parts(self, mail_parts):
+        """Sort the mail parts in chunks of sort_buffer_size
+
+        A single chunk is sorted in memory. Otherwise each sorted chunk is
+        written to a temporary file and the chunks are merged.
+        """
+        chunks = _iter_chunks(mail_parts, self.sort_buffer_size)
+        chunk = next(chunks, [])
+        if len(chunk) < self.sort_buffer_size:
+            chunk.sort()
+            yield from chunk
+            return
+        with tempfile.TemporaryDirectory(prefix="mail-parts-") as tmpdir:
+            chunk_paths = []
+            for index, chunk in enumerate(itertools.chain([chunk], chunks)):
+                chunk.sort()
+                chunk_paths.append(os.path.join(tmpdir, f"{index}.pickle"))
+                _write_chunk(chunk_paths[-1], chunk)
+            del chunk
+            yield from heapq.merge(*(_read_chunk(path) for path in chunk_paths))
+
+    def _write_mail(self, pkg_type, email, parts):
+        mailfile = os.path.join(self.mailpath, pkg_type + "#" + email + ".html")
+        first_part = next(parts)
+        is_new = not os.path.isfile(mailfile)
+        with open(mailfile, "a", buffering=WRITE_BUFFER_SIZE) as writemail:
+            if is_new:
+                utils.log_and_echo_msg(f"email for {pkg_type}#{email}")
+                writemail.write(
+                    utils.build_msg_per_contact(
+                        receiver_name=first_part.name,
+                        checker_type=first_part.checker_type,
+                        pkg_type=pkg_type,
+                    )
+                )
+            writemail.write(first_part.msg)
+            for part in parts:
+                writemail.write(part.msg)
 
     def _build_statistics(self):
         filename = utils.STATISTICS + "#" + self.default_contact.email
@@ -101,3 +173,29 @@ class EmailBuilder:
                 df_statistics=df,
             )
             writemail.write(msg)
+
+
+def _iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _write_chunk(chunk_path, chunk):
+    # each part is pickled on its own: a pickler or unpickler that is reused
+    # would keep all parts of the chunk in its memo
+    with open(chunk_path, "wb") as chunk_file:
+        for part in chunk:
+            pickle.dump(tuple(part), chunk_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_chunk(chunk_path):
+    with open(chunk_path, "rb") as chunk_file:
+        while True:
+            try:
+                yield MailPart(*pickle.load(chunk_file))
+            except EOFError:
+                return
@@ -1,68 +1,184 @@
 import logging
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import ckanapi
 import click
+import requests
 
 from ckan_pkg_checker.checkers.link_checker import LinkChecker
 from ckan_pkg_checker.checkers.shacl_checker import ShaclChecker
 from ckan_pkg_checker.utils import utils
+from ckan_pkg_checker.utils.harvest_sources import HarvestSources, get_harvest_source_fq
+from ckan_pkg_checker.utils.metadata_cache import MetadataCache
 
 log = logging.getLogger(__name__)
-DCAT_HARVESTER_TYPES = {"dcat_ch_rdf", "dcat_ch_i14y_rdf"}
+SEARCH_ROWS = 500
 
 
 class PackageCheck:
     def __init__(
-        self, config, siteurl, apikey, rundir, mode, limit, pkg, org, harvester_type
+        self,
+        config,
+        siteurl,
+        apikey,
+        rundir,
+        mode,
+        limit,
+        pkg,
+        org,
+        harvester_type,
+        link_cache=True,
+        clear_link_cache=False,
+        workers=1,
+        incremental=False,
+        refresh_metadata=False,
     ):
         self.siteurl = siteurl
-        self.ogdremote = ckanapi.RemoteCKAN(self.siteurl, apikey=apikey)
-        self.dcat_harvesters = self._get_dcat_harvester_dict()
+        # the session is shared by the threads that request ckan in parallel
+        self.ogdremote = ckanapi.RemoteCKAN(
+            self.siteurl, apikey=apikey, session=requests.Session()
+        )
+        self.metadata_cache = self._get_metadata_cache(config, rundir, refresh_metadata)
+        self.harvest_sources = HarvestSources(self.ogdremote, self.metadata_cache)
         self.harvester_type = harvester_type
-        self.pkgs = self._get_packages(limit=limit, pkg=pkg, org=org)
-        self.pkgs_count = len(self.pkgs)
-        self.geocat_pkg_ids = self._get_geocat_package_ids()
-        self.contact_dict = utils.set_up_contact_mapping(config, self.ogdremote)
+        self.fetch_workers = utils.get_config_int(
+            config, "pipeline", "fetch_workers", fallback=4
+        )
+        self.check_workers = utils.get_config_int(
+            config, "pipeline", "check_workers", fallback=1
+        )
+        self.queue_size = utils.get_config_int(
+            config, "pipeline", "queue_size", fallback=50
+        )
         self.active_checkers = []
         checker_classes = []
         kwargs = {"rundir": rundir, "config": config, "siteurl": siteurl}
         if mode == utils.MODE_SHACL:
             checker_classes.append(ShaclChecker)
+            kwargs.update(workers=workers, incremental=incremental)
         elif mode == utils.MODE_LINK:
             checker_classes.append(LinkChecker)
+            kwargs.update(
+                use_cache=link_cache,
+                clear_cache=clear_link_cache,
+                incremental=incremental,
+            )
         for checker_class in checker_classes:
             checker = checker_class(**kwargs)
             self.active_checkers.append(checker)
+        # in incremental link mode only the datasets that were modified since
+        # the last run are requested, the others are taken from the url inventory
+        self.incremental_links = incremental and mode == utils.MODE_LINK
+        modified_since = None
+        if self.incremental_links:
+            modified_since = self.active_checkers[0].get_last_modified()
+        self.pkgs_count, self.pkgs = self._get_packages(
+            limit=limit, pkg=pkg, org=org, modified_since=modified_since
+        )
+        self.contact_dict = utils.set_up_contact_mapping(
+            config,
+            self.ogdremote,
+            metadata_cache=self.metadata_cache,
+            workers=utils.get_config_int(config, "metadata", "workers", fallback=8),
+        )
+        self.metadata_cache.save()
         utils.log_and_echo_msg(f"--> {self.pkgs_count} datasets to process")
 
     def run(self):
-        for idx, id in enumerate(self.pkgs):
-            utils.log_and_echo_msg(f"({idx + 1}/{self.pkgs_count}) DATASET {id}")
-            try:
-                result = self.ogdremote.action.package_search(
-                    fq=f"name:({id})", include_private=True
-                )
-                if not result.get("results"):
-                    utils.log_and_echo_msg(f"No dataset found for id: {id}")
-                    continue
-                pkg = result.get("results")[0]
-                self._enrich_package(pkg)
-                if pkg["type"] == "dataset":
-                    for checker in self.active_checkers:
-                        checker.check_package(pkg)
-            except ckanapi.errors.NotFound:
-                utils.log_and_echo_msg(f"No dataset found for id: {id}")
-            except ckanapi.errors.CKANAPIError:
-                utils.log_and_echo_msg(f"CKAN Api Error for Dataset: {id}")
+        """Check the datasets in a pipeline
+
+        A producer thread fetches and enriches the datasets and puts them
+        into a bounded queue. Each dataset is handed to the prefetch of the
+        checkers before it is queued, so that the checkers can load what the
+        upcoming datasets need while the datasets before them are checked.
+        check_workers threads take the datasets from
+        the queue and check them. The checkers write their results in a
+        single writer thread per csv file.
+        """
+        pkg_queue = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            threading.Thread(
+                target=self._produce_packages, args=(pkg_queue,), daemon=True
+            )
+        ]
+        threads.extend(
+            threading.Thread(
+                target=self._check_packages, args=(pkg_queue,), daemon=True
+            )
+            for _ in range(self.check_workers)
+        )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.incremental_links:
+            pkg_names = self._get_package_names()
+            for checker in self.active_checkers:
+                checker.check_inventory(pkg_names, self._enrich_package)
         for checker in self.active_checkers:
             checker.finish()
+        # the harvest sources are requested when the first dataset needs them
+        self.metadata_cache.save()
+
+    def _produce_packages(self, pkg_queue):
+        try:
+            for idx, pkg in enumerate(self.pkgs):
+                utils.log_and_echo_msg(
+                    f"({idx + 1}/{self.pkgs_count}) DATASET {pkg['name']}"
+                )
+                try:
+                    self._enrich_package(pkg)
+                    if pkg["type"] == "dataset":
+                        self._prefetch_package(pkg)
+                        pkg_queue.put(pkg)
+                except Exception as e:
+                    log.exception(e)
+                    utils.log_and_echo_msg(
+                        f"Exception {e} of type {type(e).__name__} occured "
+                        f"at preparing dataset {pkg['name']}",
+                        error=True,
+                    )
+        except Exception as e:
+            log.exception(f"getting packages failed: {e}")
+        finally:
+            # one stop signal per worker
+            for _ in range(self.check_workers):
+                pkg_queue.put(None)
+
+    def _prefetch_package(self, pkg):
+        for checker in self.active_checkers:
+            try:
+                checker.prefetch(pkg)
+            except Exception as e:
+                log.exception(e)
+                utils.log_and_echo_msg(
+                    f"Exception {e} of type {type(e).__name__} occured "
+                    f"at prefetching dataset {pkg['name']} in {checker}",
+                    error=True,
+                )
+
+    def _check_packages(self, pkg_queue):
+        while True:
+            pkg = pkg_queue.get()
+            if pkg is None:
+                return
+            for checker in self.active_checkers:
+                try:
+                    checker.check_package(pkg)
+                except Exception as e:
+                    log.exception(e)
+                    utils.log_and_echo_msg(
+                        f"Exception {e} of type {type(e).__name__} occured "
+                        f"for dataset {pkg['name']} in {checker}",
+                        error=True,
+                    )
 
     def _enrich_package(self, pkg):
-        if pkg["name"] in self.geocat_pkg_ids:
-            pkg["pkg_type"] = utils.GEOCAT
-        else:
-            pkg["pkg_type"] = utils.DCAT
-        pkg["source_url"] = utils.get_harvest_source_url(pkg, self.dcat_harvesters)
+        pkg["pkg_type"] = self.harvest_sources.get_pkg_type(pkg)
+        pkg["source_url"] = self.harvest_sources.get_source_url(pkg)
         if pkg.get("organization"):
             org_slug = pkg["organization"].get("name")  # this is the slug in CKAN
             contact_key = utils.ContactKey(
@@ -75,103 +191,125 @@ class PackageCheck:
                 f"Using org_slug: {org_slug}, pkg_type: {pkg['pkg_type']}"
             )
 
-    def _get_packages(self, limit=None, pkg=None, org=None):
+    def _get_packages(self, limit=None, pkg=None, org=None, modified_since=None):
         """
-        Collect dataset IDs based on filters:
+        Collect datasets based on filters:
            - Single pkg
            - Organization
            - Harvester type (geocat / dcat)
            - Limit
+           - Modified since a metadata_modified timestamp
+        Returns the number of datasets and an iterator over the datasets
         """
         if pkg:
-            return [pkg]
+            count, pkgs = self._search_packages(
+                fq=f"name:({pkg})", limit=1, include_private=True
+            )
+            if not count:
+                utils.log_and_echo_msg(f"No dataset found for id: {pkg}")
+            return count, pkgs
 
         if org:
-            return self._get_organization_package_ids(org=org)
+            return self._search_packages(fq=f"organization:{org}")
 
         if self.harvester_type == "geocat":
-            return (
-                self._get_geocat_package_ids()[:limit]
-                if limit
-                else self._get_geocat_package_ids()
+            return self._search_packages(
+                fq=get_harvest_source_fq(self.harvest_sources.geocat_harvester_ids),
+                limit=limit,
             )
 
         if self.harvester_type == "dcat":
-            return self._get_dcat_package_ids(limit=limit)
+            return self._search_packages(
+                fq=get_harvest_source_fq(self.harvest_sources.dcat_harvester_ids),
+                limit=limit,
+            )
 
-        return self._get_all_package_ids(limit)
+        if modified_since:
+            utils.log_and_echo_msg(f"Datasets modified since {modified_since}")
+            return self._search_packages(
+                fq="dataset_type:dataset AND metadata_modified:"
+                f"[{_get_solr_date(modified_since)} TO *]",
+                limit=limit,
+            )
 
-    def _get_dcat_harvester_dict(self):
-        try:
-            harvesters = self.ogdremote.action.harvest_source_list()
-            harvester_dict = {}
-            for harvester in harvesters:
-                if harvester.get("type") in DCAT_HARVESTER_TYPES:
-                    harvester_dict[harvester["id"]] = harvester.get("url")
-            return harvester_dict
-        except Exception as e:
-            log.exception(f"getting harvesters failed: {e}")
+        return self._search_packages(fq="dataset_type:dataset", limit=limit)
 
-    def _get_all_package_ids(self, limit=None):
-        pkg_ids = []
+    def _get_package_names(self):
         try:
-            pkg_ids = self.ogdremote.action.package_list()
-        except Exception as e:
-            log.exception(f"getting packages failed: {e}")
-        public_packages = [id for id in pkg_ids if not id.startswith("__")]
-        if limit:
-            return public_packages[:limit]
-        return public_packages
-
-    def _get_organization_package_ids(self, org):
-        fq_organization = f"organization:{org}"
-        organization_pkg_ids = self._get_pkg_ids_from_package_search(fq_organization)
-        return organization_pkg_ids
-
-    def _get_geocat_package_ids(self):
-        fq_geocat_harvesters = "dataset_type:harvest AND source_type:geocat_harvester"
-        geocat_harvester_ids = self._get_pkg_ids_from_package_search(
-            fq=fq_geocat_harvesters, target="id"
+            return set(self.ogdremote.action.package_list())
+        except ckanapi.errors.CKANAPIError:
+            utils.log_and_echo_msg(
+                "CKAN Api Error for package list: no packages are removed from the "
+                "url inventory",
+                error=True,
+            )
+        return set()
+
+    def _get_metadata_cache(self, config, rundir, refresh_metadata):
+        # the cache is kept in the tmp directory, so that it outlives the run
+        cache_file = utils.get_config(
+            config, "metadata", "cache_file", fallback="metadata.json"
+        )
+        return MetadataCache(
+            path=rundir.parent / cache_file,
+            ttl=utils.get_config_int(config, "metadata", "cache_ttl_hours", fallback=24)
+            * 3600,
+            refresh=refresh_metadata,
         )
-        fq_geocat_pkgs = "harvest_source_id:(" + " OR ".join(geocat_harvester_ids) + ")"
-        geocat_pkg_ids = self._get_pkg_ids_from_package_search(fq_geocat_pkgs)
-        return geocat_pkg_ids
 
-    def _get_dcat_package_ids(self, limit=None):
+    def _search_packages(self, fq, limit=None, **params):
         """
-        Filter only datasets coming from DCAT harvesters.
+        Search full datasets page by page: the first page is requested
+        to get the number of datasets, the other pages are requested
+        concurrently with at most fetch_workers pages in flight.
+        Returns the number of datasets and an iterator over the datasets.
         """
-        fq_dcat_harvesters = (
-            "dataset_type:harvest AND source_type:("
-            + " OR ".join(DCAT_HARVESTER_TYPES)
-            + ")"
-        )
-        dcat_pkg_ids = self._get_pkg_ids_from_package_search(
-            fq=fq_dcat_harvesters, target="id"
-        )
-        fq_dcat_pkgs = "harvest_source_id:(" + " OR ".join(dcat_pkg_ids) + ")"
-        pkg_ids = self._get_pkg_ids_from_package_search(fq=fq_dcat_pkgs)
+        first_page = self._get_search_page(fq, start=0, **params)
+        if not first_page:
+            return 0, iter([])
+        count = first_page["count"]
         if limit:
-            return pkg_ids[:limit]
-        return pkg_ids
-
-    def _get_pkg_ids_from_package_search(self, fq, target="name"):
-        rows = 500
-        page = 0
-        pkg_ids = []
-        result_count = 0
-        while page == 0 or len(pkg_ids) < result_count:
-            try:
-                page = page + 1
-                start = (page - 1) * rows
-                result = self.ogdremote.action.package_search(
-                    fq=fq, rows=rows, start=start
-                )
-                if not result_count:
-                    result_count = result["count"]
-                pkg_ids.extend([pkg[target] for pkg in result["results"]])
-            except ckanapi.errors.NotFound:
-                utils.log_and_echo_msg(f"No datasets found for search with fq: {fq}")
-            except ckanapi.errors.CKANAPIError:
-                utils.log_and_echo_msg(f"CKAN Api Error for Dataset Search: {fq}")
-        return pkg_ids
+            count = min(count, limit)
+        return count, self._iter_search_pages(fq, first_page, count, **params)
+
+    def _iter_search_pages(self, fq, first_page, count, **params):
+        yielded = 0
+        starts = deque(range(SEARCH_ROWS, count, SEARCH_ROWS))
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+            pages = deque()
+            page = first_page
+            while page is not None:
+                while starts and len(pages) < self.fetch_workers:
+                    pages.append(
+                        executor.submit(
+                            self._get_search_page, fq, starts.popleft(), **params
+                        )
+                    )
+                for pkg in page.get("results", []):
+                    if yielded >= count:
+                        return
+                    if pkg["name"].startswith("__"):
+                        continue
+                    yielded += 1
+                    yield pkg
+                page = pages.popleft().result() if pages else None
+
+    def _get_search_page(self, fq, start, **params):
+        try:
+            return self.ogdremote.action.package_search(
+                fq=fq, rows=SEARCH_ROWS, start=start, sort="name asc", **params
+            )
+        except ckanapi.errors.NotFound:
+            utils.log_and_echo_msg(f"No datasets found for search with fq: {fq}")
+        except ckanapi.errors.CKANAPIError:
+            utils.log_and_echo_msg(f"CKAN Api Error for Dataset Search: {fq}")
+        return {}
+
+
+def _get_solr_date(metadata_modified):
+    """Format a metadata_modified timestamp of ckan for a solr range query
+
+    The fractional seconds are cut off, so that the range includes the
+    datasets that were modified in the same second.
+    """
+    return f"{metadata_modified[:19]}Z"
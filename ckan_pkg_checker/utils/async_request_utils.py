@@ -0,0 +1,391 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from ckan_pkg_checker.utils.request_utils import (
+    SHORT_CIRCUITED,
+    TIMED_OUT,
+    UNREACHABLE,
+    USER_AGENTS,
+    HostStrategy,
+    UrlCheck,
+    _get_host,
+)
+
+log = logging.getLogger(__name__)
+
+# the error types of the http error messages, worded as requests does
+HTTP_ERROR_TYPES = {4: "Client Error", 5: "Server Error"}
+
+
+class AsyncHostLimiter:
+    """Limits the open connections and the request rate per host
+
+    The asyncio counterpart of request_utils.HostLimiter: the requests to a
+    host wait on a semaphore instead of blocking a thread.
+    """
+
+    def __init__(self, max_connections=2, min_interval=0):
+        self.max_connections = max_connections
+        self.min_interval = min_interval
+        self._semaphores = {}
+        self._next_request = defaultdict(float)
+
+    @asynccontextmanager
+    async def limit(self, url):
+        host = _get_host(url)
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.BoundedSemaphore(self.max_connections)
+        async with self._semaphores[host]:
+            if self.min_interval:
+                now = time.monotonic()
+                start = max(now, self._next_request[host])
+                self._next_request[host] = start + self.min_interval
+                if start > now:
+                    await asyncio.sleep(start - now)
+            yield
+
+
+@asynccontextmanager
+async def _no_limit():
+    # contextlib.nullcontext is an async context manager from Python 3.10 on
+    yield
+
+
+class AsyncUrlChecker:
+    """Checks urls with aiohttp on an event loop in a background thread
+
+    The url checks are coroutines, so thousands of them can wait for their
+    servers at the same time, while max_connections limits the open
+    sockets. The checks are submitted from the calling thread and return
+    concurrent futures, just like the checks in a thread pool. The timeouts
+    and the methods per host are taken from the strategy. With metrics the
+    requests are recorded together with their DNS lookup and connect times.
+    """
+
+    def __init__(
+        self, max_connections=100, host_limiter=None, strategy=None, metrics=None
+    ):
+        self.max_connections = max_connections
+        self.host_limiter = host_limiter
+        self.strategy = strategy or HostStrategy()
+        self.metrics = metrics
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self.session = self.submit(self._create_session()).result()
+
+    async def _create_session(self):
+        # the session needs to be created on the loop it is used on
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.max_connections,
+                ssl=False,  # SSL certificate will not be verified
+            ),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=self.strategy.connect_timeout,
+                sock_read=self.strategy.read_timeout,
+            ),
+            trace_configs=[_get_timing_trace_config()] if self.metrics else None,
+        )
+
+    def submit(self, coro):
+        """Run a coroutine on the loop and return a concurrent future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def check_url_with_validators(self, test_url):
+        return await check_url_with_validators(
+            test_url,
+            self.session,
+            host_limiter=self.host_limiter,
+            strategy=self.strategy,
+            metrics=self.metrics,
+        )
+
+    async def revalidate_url(self, test_url, etag, last_modified):
+        return await revalidate_url(
+            test_url,
+            etag,
+            last_modified,
+            self.session,
+            host_limiter=self.host_limiter,
+            strategy=self.strategy,
+            metrics=self.metrics,
+        )
+
+    def close(self):
+        self.submit(self.session.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+def _get_timing_trace_config():
+    """Measures the DNS lookup and the connect time of a request
+
+    The times are set in the dict that is passed to the request as
+    trace_request_ctx. The connect time does not include the DNS lookup.
+    """
+
+    async def on_dns_resolvehost_start(session, context, params):
+        context.dns_start = time.perf_counter()
+
+    async def on_dns_resolvehost_end(session, context, params):
+        context.trace_request_ctx["dns"] = time.perf_counter() - context.dns_start
+
+    async def on_connection_create_start(session, context, params):
+        context.connect_start = time.perf_counter()
+
+    async def on_connection_create_end(session, context, params):
+        timings = context.trace_request_ctx
+        timings["connect"] = (
+            time.perf_counter() - context.connect_start - timings.get("dns", 0)
+        )
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
+
+
+async def _check_with_user_agent(
+    test_url,
+    http_method,
+    user_agent,
+    session,
+    host_limiter=None,
+    circuit_breaker=None,
+    metrics=None,
+    headers=None,
+):
+    """Send one request, unless the circuit of the host is open
+
+    Returns the error message, the response and the failure if no response
+    came, the same as request_utils. The request is recorded in the link
+    metrics, if they are collected.
+    """
+    limit = host_limiter.limit(test_url) if host_limiter else _no_limit()
+    async with limit:
+        # the circuit is looked at once the host may be requested, as other
+        # requests to the host may have opened it in the meantime
+        error = circuit_breaker.get_error(test_url) if circuit_breaker else None
+        if error:
+            return error, None, SHORT_CIRCUITED
+        timings = {}
+        start = time.perf_counter()
+        error_result, resp, failure = await _send_with_user_agent(
+            test_url, http_method, user_agent, session, headers=headers, timings=timings
+        )
+        duration = time.perf_counter() - start
+    if circuit_breaker:
+        circuit_breaker.record(test_url, error_result, failure)
+    if metrics:
+        metrics.record_request(
+            test_url,
+            http_method,
+            user_agent,
+            status=resp.status if resp is not None else None,
+            failure=failure,
+            duration=duration,
+            dns=timings.get("dns"),
+            connect=timings.get("connect"),
+            # the body is not read, so the size is taken from Content-Length
+            size=resp.content_length if resp is not None else None,
+        )
+    return error_result, resp, failure
+
+
+async def _send_with_user_agent(
+    test_url, http_method, user_agent, session, headers=None, timings=None
+):
+    """Send one request and return the error message, the response and the failure"""
+    log.debug(f"URL {test_url} ({http_method}), User-Agent: {user_agent}")
+    headers = {**(headers or {}), "User-Agent": user_agent}
+    if http_method == "GET":
+        headers = {"Range": "bytes=0-10", **headers}  # Request the first 10 bytes
+    try:
+        # the body is not read: the status and the headers are enough
+        async with session.request(
+            http_method,
+            test_url,
+            headers=headers,
+            allow_redirects=http_method == "GET",
+            trace_request_ctx=timings,
+        ) as resp:
+            pass
+    except (ValueError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log.debug(
+            "REQUEST EXCEPTION OCCURRED for URL %s (%s): %r"
+            % (test_url, http_method, e)
+        )
+        failure = _get_failure(e)
+        if isinstance(e, asyncio.TimeoutError):
+            # the timeouts of asyncio come without a message
+            return (
+                f"{str(e) or 'Request timed out'} for url: {test_url}",
+                None,
+                failure,
+            )
+        return str(e), None, failure
+    if resp.status < 400:
+        log.info("Sent response %s" % resp.status)
+        return None, resp, None  # Success, no error
+    log.debug(
+        "HTTP EXCEPTION OCCURRED for URL %s (%s): %s"
+        % (test_url, http_method, resp.status)
+    )
+    # ignore 405 Method Not Allowed errors
+    if 405 == resp.status:
+        return None, resp, None
+    if 404 == resp.status:
+        return (
+            "Failed to load resource: the server responded with a status of 404 (Not Found)",
+            resp,
+            None,
+        )
+    error_type = HTTP_ERROR_TYPES.get(resp.status // 100)
+    if not error_type:
+        return None, resp, None
+    return (
+        f"{resp.status} {error_type}: {resp.reason} for url: {resp.url}",
+        resp,
+        None,
+    )
+
+
+def _get_failure(e):
+    if isinstance(e, (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)):
+        return UNREACHABLE
+    if isinstance(e, asyncio.TimeoutError):
+        return TIMED_OUT
+    return None
+
+
+async def check_url_status(test_url, session, http_method="HEAD", host_limiter=None):
+    url_check, _ = await _check_url_status(
+        test_url, session, http_method=http_method, host_limiter=host_limiter
+    )
+    return url_check.error
+
+
+async def _check_url_status(
+    test_url,
+    session,
+    http_method="HEAD",
+    host_limiter=None,
+    circuit_breaker=None,
+    metrics=None,
+):
+    """Check an url with each user agent until it succeeds
+
+    Returns the url check and the failure of the last request.
+    """
+    log.debug("URL %s (%s)" % (test_url, http_method))
+    for user_agent in USER_AGENTS:
+        error_result, resp, failure = await _check_with_user_agent(
+            test_url,
+            http_method,
+            user_agent,
+            session,
+            host_limiter=host_limiter,
+            circuit_breaker=circuit_breaker,
+            metrics=metrics,
+        )
+        if not error_result:
+            return _get_url_check(None, resp), None  # Success, no error
+        elif failure in (UNREACHABLE, SHORT_CIRCUITED):
+            break
+        else:
+            log.debug(
+                "Retrying with a different User-Agent for URL %s (%s)"
+                % (test_url, http_method)
+            )
+    return _get_url_check(error_result, resp), failure  # If all attempts fail
+
+
+def _get_url_check(error_result, resp):
+    if error_result or resp is None or resp.status >= 400:
+        return UrlCheck(error=error_result, etag=None, last_modified=None)
+    return UrlCheck(
+        error=None,
+        etag=resp.headers.get("ETag"),
+        last_modified=resp.headers.get("Last-Modified"),
+    )
+
+
+async def check_url(test_url, session, host_limiter=None, strategy=None):
+    """Check one url: first as 'HEAD', then as 'GET'"""
+    return (
+        await check_url_with_validators(
+            test_url, session, host_limiter=host_limiter, strategy=strategy
+        )
+    ).error
+
+
+async def check_url_with_validators(
+    test_url, session, host_limiter=None, strategy=None, metrics=None
+):
+    """Check one url and return the validators of a successful response
+
+    The methods are chosen as in request_utils.check_url_with_validators,
+    the timeouts are the ones of the session.
+    """
+    kwargs = dict(
+        host_limiter=host_limiter,
+        circuit_breaker=strategy.circuit_breaker if strategy else None,
+        metrics=metrics,
+    )
+    if strategy and strategy.rejects_head(test_url):
+        url_check, failure = await _check_url_status(
+            test_url, session, http_method="GET", **kwargs
+        )
+    else:
+        url_check, failure = await _check_url_status(test_url, session, **kwargs)
+        if url_check.error and failure not in (UNREACHABLE, SHORT_CIRCUITED):
+            url_check, failure = await _check_url_status(
+                test_url, session, http_method="GET", **kwargs
+            )
+            if strategy and not url_check.error:
+                strategy.set_rejects_head(test_url)
+    return url_check
+
+
+async def revalidate_url(
+    test_url,
+    etag,
+    last_modified,
+    session,
+    host_limiter=None,
+    strategy=None,
+    metrics=None,
+):
+    """Revalidate an url that was ok with a conditional 'HEAD' request
+
+    Returns True if the server confirms the url: with '304 Not Modified'
+    or with a successful response.
+    """
+    if strategy and strategy.circuit_breaker:
+        if strategy.circuit_breaker.is_open(test_url):
+            return False
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    error_result, resp, _ = await _check_with_user_agent(
+        test_url,
+        "HEAD",
+        USER_AGENTS[0],
+        session,
+        host_limiter=host_limiter,
+        metrics=metrics,
+        headers=headers,
+    )
+    return resp is not None and (resp.status == 304 or resp.status < 400)
@@ -0,0 +1,75 @@
+import logging
+from functools import cached_property
+
+from ckan_pkg_checker.utils import utils
+
+log = logging.getLogger(__name__)
+
+DCAT_HARVESTER_TYPES = {"dcat_ch_rdf", "dcat_ch_i14y_rdf"}
+GEOCAT_HARVESTER_TYPE = "geocat_harvester"
+
+
+class HarvestSources:
+    """Classifies packages by their harvest source
+
+    The harvest sources are requested once with harvest_source_list, when
+    they are first needed, and kept for the run: a package is classified by
+    the type of the harvester in its harvest_source_id with a dict lookup.
+    """
+
+    def __init__(self, ogdremote, metadata_cache=None):
+        self.ogdremote = ogdremote
+        self.metadata_cache = metadata_cache
+
+    @cached_property
+    def harvesters(self):
+        """Types and urls of the harvest sources by harvester id"""
+        harvesters = utils.get_cached_metadata(
+            self.metadata_cache, "harvest_source_list", self._get_harvest_source_list
+        )
+        return {
+            harvester["id"]: (harvester.get("type"), harvester.get("url"))
+            for harvester in harvesters or []
+        }
+
+    @cached_property
+    def dcat_harvesters(self):
+        """Urls of the dcat harvest sources by harvester id"""
+        return {
+            harvester_id: url
+            for harvester_id, (harvester_type, url) in self.harvesters.items()
+            if harvester_type in DCAT_HARVESTER_TYPES
+        }
+
+    @cached_property
+    def geocat_harvester_ids(self):
+        return [
+            harvester_id
+            for harvester_id, (harvester_type, _) in self.harvesters.items()
+            if harvester_type == GEOCAT_HARVESTER_TYPE
+        ]
+
+    @cached_property
+    def dcat_harvester_ids(self):
+        return list(self.dcat_harvesters)
+
+    def get_pkg_type(self, pkg):
+        harvester_type, _ = self.harvesters.get(
+            utils.get_harvest_source_id(pkg), (None, None)
+        )
+        if harvester_type == GEOCAT_HARVESTER_TYPE:
+            return utils.GEOCAT
+        return utils.DCAT
+
+    def get_source_url(self, pkg):
+        return utils.get_harvest_source_url(pkg, self.dcat_harvesters)
+
+    def _get_harvest_source_list(self):
+        try:
+            return self.ogdremote.action.harvest_source_list()
+        except Exception as e:
+            log.exception(f"getting harvesters failed: {e}")
+
+
+def get_harvest_source_fq(harvester_ids):
+    return "harvest_source_id:(" + " OR ".join(harvester_ids) + ")"
@@ -0,0 +1,184 @@
+import csv
+import json
+import math
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+from urllib.parse import urlparse
+
+from ckan_pkg_checker.utils.request_utils import TIMED_OUT, UNREACHABLE
+
+RequestMetric = namedtuple(
+    "RequestMetric",
+    ["method", "user_agent", "status", "failure", "duration", "dns", "connect", "size"],
+)
+PERCENTILES = [50, 95, 99]
+# number of hosts that are listed as slowest hosts
+NR_SLOWEST_HOSTS = 10
+CSV_FIELDNAMES = [
+    "scope",
+    "name",
+    "count",
+    "timeouts",
+    "unreachable",
+    "p50_s",
+    "p95_s",
+    "p99_s",
+    "max_s",
+    "total_s",
+    "bytes",
+]
+
+
+def get_percentile(sorted_values, percent):
+    """Nearest rank percentile of a sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class LinkMetrics:
+    """Collects the timings of the link checks of a run
+
+    Each request is recorded with its method, user agent, status, failure,
+    duration, the time for the DNS lookup and the connection, if it was
+    measured, and the bytes of the response body. Each url check is recorded
+    with its duration, which includes all requests of the check, and each
+    reference of an url with its test title. At the end of the run the
+    metrics are aggregated per host and per test title.
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._host_requests = defaultdict(list)
+        self._url_durations = {}
+        self._test_urls = defaultdict(list)
+        self.cached_urls = 0
+        self.short_circuited_urls = 0
+
+    def record_request(
+        self,
+        url,
+        method,
+        user_agent,
+        status,
+        failure,
+        duration,
+        dns=None,
+        connect=None,
+        size=None,
+    ):
+        metric = RequestMetric(
+            method, user_agent, status, failure, duration, dns, connect, size
+        )
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            self._host_requests[host].append(metric)
+
+    def record_url(self, url, duration=None):
+        """Record an url check: without duration if it was taken from the cache"""
+        with self._lock:
+            if duration is None:
+                self.cached_urls += 1
+            else:
+                self._url_durations[url] = duration
+
+    def record_reference(self, test_title, url):
+        with self._lock:
+            self._test_urls[test_title].append(url)
+
+    def get_summary(self):
+        with self._lock:
+            host_requests = {
+                host: list(metrics) for host, metrics in self._host_requests.items()
+            }
+            url_durations = dict(self._url_durations)
+            test_urls = {
+                test_title: list(urls) for test_title, urls in self._test_urls.items()
+            }
+            cached_urls = self.cached_urls
+            short_circuited_urls = self.short_circuited_urls
+        elapsed = time.monotonic() - self.started_at
+        requests = [metric for metrics in host_requests.values() for metric in metrics]
+        hosts = {
+            host: _get_request_summary(metrics)
+            for host, metrics in sorted(host_requests.items())
+        }
+        # the hosts are ranked by the p95 latency of their requests
+        slowest_hosts = sorted(
+            hosts, key=lambda host: hosts[host]["p95_s"] or 0, reverse=True
+        )[:NR_SLOWEST_HOSTS]
+        nr_urls = len(url_durations) + cached_urls
+        return {
+            "elapsed_s": elapsed,
+            "urls": nr_urls,
+            "cached_urls": cached_urls,
+            "short_circuited_urls": short_circuited_urls,
+            "urls_per_second": nr_urls / elapsed if elapsed else None,
+            "requests": _get_request_summary(requests),
+            "methods": dict(Counter(metric.method for metric in requests)),
+            "user_agents": dict(Counter(metric.user_agent for metric in requests)),
+            "statuses": {
+                str(status): count
+                for status, count in Counter(
+                    metric.status for metric in requests
+                ).items()
+            },
+            "dns_s": _get_percentiles(
+                [metric.dns for metric in requests if metric.dns is not None]
+            ),
+            "connect_s": _get_percentiles(
+                [metric.connect for metric in requests if metric.connect is not None]
+            ),
+            "slowest_hosts": [{"host": host, **hosts[host]} for host in slowest_hosts],
+            "hosts": hosts,
+            "test_titles": {
+                test_title: _get_duration_summary(
+                    [url_durations[url] for url in urls if url in url_durations],
+                    count=len(urls),
+                )
+                for test_title, urls in sorted(test_urls.items())
+            },
+        }
+
+    def write(self, csvfilepath, jsonfilepath):
+        summary = self.get_summary()
+        with open(jsonfilepath, "w") as jsonfile:
+            json.dump(summary, jsonfile, indent=2)
+        with open(csvfilepath, "w", newline="") as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=CSV_FIELDNAMES)
+            writer.writeheader()
+            writer.writerow({"scope": "run", "name": "all", **summary["requests"]})
+            for host, host_summary in summary["hosts"].items():
+                writer.writerow({"scope": "host", "name": host, **host_summary})
+            for test_title, test_summary in summary["test_titles"].items():
+                writer.writerow(
+                    {"scope": "test_title", "name": test_title, **test_summary}
+                )
+        return summary
+
+
+def _get_request_summary(metrics):
+    return {
+        **_get_duration_summary([metric.duration for metric in metrics], len(metrics)),
+        "timeouts": sum(1 for metric in metrics if metric.failure == TIMED_OUT),
+        "unreachable": sum(1 for metric in metrics if metric.failure == UNREACHABLE),
+        "bytes": sum(metric.size or 0 for metric in metrics),
+    }
+
+
+def _get_duration_summary(durations, count):
+    durations = sorted(durations)
+    return {
+        "count": count,
+        **_get_percentiles(durations),
+        "max_s": durations[-1] if durations else None,
+        "total_s": sum(durations),
+    }
+
+
+def _get_percentiles(values):
+    values = sorted(values)
+    return {f"p{percent}_s": get_percentile(values, percent) for percent in PERCENTILES}
@@ -0,0 +1,69 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class MetadataCache:
+    """Keeps the results of ckan metadata lookups across runs in a json file
+
+    The harvest sources, the organization tree and the organization admins
+    change rarely, so they are taken from the cache for ttl seconds. With
+    refresh all lookups are requested again. Lookups that failed return
+    None and are not cached.
+    """
+
+    def __init__(self, path, ttl, refresh=False):
+        self.path = str(path)
+        self.ttl = ttl
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._changed = False
+        if refresh:
+            return
+        try:
+            with open(self.path) as cachefile:
+                self._entries = json.load(cachefile)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.error(
+                f"Exception {e} of type {type(e).__name__} occured "
+                f"at loading {self.path}: the metadata is requested again"
+            )
+
+    def get(self, key, fetch):
+        """Get a cached value or fetch it with the function fetch"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and time.time() - entry["fetched_at"] < self.ttl:
+            return entry["value"]
+        value = fetch()
+        if value is not None:
+            with self._lock:
+                self._entries[key] = {"fetched_at": time.time(), "value": value}
+                self._changed = True
+        return value
+
+    def save(self):
+        with self._lock:
+            if not self._changed:
+                return
+            entries = {
+                key: entry
+                for key, entry in self._entries.items()
+                if time.time() - entry["fetched_at"] < self.ttl
+            }
+            self._changed = False
+        # write to a temporary file first, so that no half written cache is read
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.path) or None, suffix=".tmp"
+        )
+        with os.fdopen(fd, "w") as cachefile:
+            json.dump(entries, cachefile)
+        os.replace(tmp_path, self.path)
@@ -1,12 +1,27 @@
-from collections import namedtuple
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+import threading
+from collections import OrderedDict, defaultdict, namedtuple
+from functools import lru_cache
 from string import Template
 from urllib.error import HTTPError, URLError
 
+import rdflib
 from pyshacl import validate
-from rdflib import BNode, Graph, Literal
+from rdflib import BNode, Graph, Literal, URIRef
+from rdflib.collection import Collection
+from rdflib.compare import to_isomorphic
 from rdflib.namespace import DCTERMS as DCT
-from rdflib.namespace import RDF, SKOS, Namespace, NamespaceManager
+from rdflib.namespace import RDF, RDFS, SKOS, Namespace, NamespaceManager
 
+from ckan_pkg_checker.utils.single_flight import SingleFlight
+from ckan_pkg_checker.utils.streamed_source import (
+    StreamedHarvestSource,
+    stream_harvest_source,
+)
 from ckan_pkg_checker.utils.utils import log_and_echo_msg
 
 SHACL = Namespace("http://www.w3.org/ns/shacl#")
@@ -44,15 +59,12 @@ namespaces = {
 ShaclResult = namedtuple(
     "ShaclResult", ["property", "value", "msg", "node", "severity"]
 )
+HarvestSource = namedtuple("HarvestSource", ["graph", "datasets"])
+SHACL_BUNDLE_PREFIX = "shacl-graphs-"
 
 
 def get_object_from_graph(graph, subject, predicate):
-    objects = []
-    for item in graph.objects(subject=subject, predicate=predicate):
-        objects.append(item)
-    if objects:
-        return objects[0]
-    return None
+    return next(graph.objects(subject=subject, predicate=predicate), None)
 
 
 def parse_rdf_graph_from_url(url=None, file=None, bind=False):
@@ -82,6 +94,173 @@ def parse_rdf_graph_from_url(url=None, file=None, bind=False):
     return graph
 
 
+def load_shacl_graphs(shacl_file, ont_files, cache_dir=None, prune=False):
+    """Load the shacl graph and merge the ontology files into one graph
+
+    If a cache_dir is given, the parsed graphs are kept there as a pickled
+    bundle. The bundle is named after a hash of the contents of all files,
+    so it is rebuilt as soon as one of the files changes.
+    With prune the ontology graph is reduced to the triples that the shapes
+    can reach, see prune_ontology_graph.
+    """
+    if not cache_dir:
+        return _parse_shacl_graphs(shacl_file, ont_files, prune)
+    files_hash = _get_files_hash([shacl_file] + ont_files, prune)
+    bundle_path = os.path.join(cache_dir, f"{SHACL_BUNDLE_PREFIX}{files_hash}.pickle")
+    try:
+        with open(bundle_path, "rb") as bundle:
+            return pickle.load(bundle)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log_and_echo_msg(
+            f"Exception {e} of type {type(e).__name__} occured "
+            f"at loading {bundle_path}: the graphs are parsed again"
+        )
+    graphs = _parse_shacl_graphs(shacl_file, ont_files, prune)
+    _write_shacl_bundle(cache_dir, bundle_path, graphs)
+    return graphs
+
+
+def _parse_shacl_graphs(shacl_file, ont_files, prune=False):
+    shacl_graph = parse_rdf_graph_from_url(file=shacl_file, bind=True)
+    ont_graph = Graph()
+    for ont_file in ont_files:
+        ont_graph += parse_rdf_graph_from_url(file=ont_file)
+    if prune:
+        ont_graph = prune_ontology_graph(ont_graph, shacl_graph)
+    return shacl_graph, ont_graph
+
+
+def get_shape_predicates(shacl_graph):
+    """Get the predicates that the shapes can follow in the data graph
+
+    These are the predicates in property paths and targets, the predicates
+    in SPARQL constraints and rdf:type and rdfs:subClassOf, which are needed
+    for sh:class and sh:targetClass.
+    """
+    predicates = {RDF.type, RDFS.subClassOf}
+    for path in shacl_graph.objects(predicate=SHACL.path):
+        predicates.update(_get_path_predicates(shacl_graph, path))
+    for target in [SHACL.targetSubjectsOf, SHACL.targetObjectsOf]:
+        predicates.update(shacl_graph.objects(predicate=target))
+    for query in shacl_graph.objects(predicate=SHACL.select):
+        predicates.update(_get_query_iris(shacl_graph, str(query)))
+    return predicates
+
+
+def _get_path_predicates(shacl_graph, path):
+    if isinstance(path, URIRef):
+        return {path}
+    predicates = set()
+    if (path, RDF.first, None) in shacl_graph:
+        # sequence path
+        for item in Collection(shacl_graph, path):
+            predicates.update(_get_path_predicates(shacl_graph, item))
+    for _, item in shacl_graph.predicate_objects(subject=path):
+        # inverse, alternative, zero-or-more, ... paths
+        if isinstance(item, (BNode, URIRef)) and item != path:
+            predicates.update(_get_path_predicates(shacl_graph, item))
+    return predicates
+
+
+def _get_query_iris(shacl_graph, query):
+    iris = {URIRef(iri) for iri in re.findall(r"<([^<>\s]+)>", query)}
+    namespaces = dict(shacl_graph.namespaces())
+    for prefix, name in re.findall(r"\b([A-Za-z][\w-]*):([A-Za-z_][\w-]*)", query):
+        if prefix in namespaces:
+            iris.add(URIRef(namespaces[prefix] + name))
+    return iris
+
+
+def prune_ontology_graph(ont_graph, shacl_graph):
+    """Keep only the ontology triples that the shapes can reach
+
+    pyshacl mixes the ontology graph into the data graph of each
+    validation: triples with predicates that no shape follows can not
+    change the validation results, but make each validation slower.
+    """
+    predicates = get_shape_predicates(shacl_graph)
+    pruned_graph = Graph()
+    for predicate in predicates:
+        pruned_graph += ont_graph.triples((None, predicate, None))
+    log_and_echo_msg(
+        f"ontology graph pruned from {len(ont_graph)} to {len(pruned_graph)} triples"
+    )
+    return pruned_graph
+
+
+def get_shapes_hash(shacl_file, ont_files, prune=False):
+    """Get a hash that changes with the shapes and ontology files"""
+    return _get_files_hash([shacl_file] + ont_files, prune)
+
+
+def get_graph_hash(graph):
+    """Get a hash of a graph that does not depend on its blank node ids"""
+    return format(to_isomorphic(graph).graph_digest(), "x")
+
+
+def _get_files_hash(files, prune=False):
+    files_hash = hashlib.sha256(rdflib.__version__.encode())
+    if prune:
+        files_hash.update(b"pruned")
+    for file in files:
+        with open(file, "rb") as content:
+            files_hash.update(hashlib.sha256(content.read()).digest())
+    return files_hash.hexdigest()
+
+
+def _write_shacl_bundle(cache_dir, bundle_path, graphs):
+    # write to a temporary file first, so that no half written bundle is read
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as bundle:
+        pickle.dump(graphs, bundle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, bundle_path)
+    for filename in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, filename)
+        if filename.startswith(SHACL_BUNDLE_PREFIX) and path != bundle_path:
+            os.remove(path)
+    log_and_echo_msg(f"shacl and ontology graphs compiled to {bundle_path}")
+
+
+# graphs of a validation worker process, see init_shacl_worker
+_worker_graphs = {}
+
+
+def init_shacl_worker(shacl_file, ont_files, cache_dir=None, prune=False):
+    """Load the shacl and ontology graphs once per worker process"""
+    shacl_graph, ont_graph = load_shacl_graphs(
+        shacl_file, ont_files, cache_dir=cache_dir, prune=prune
+    )
+    _worker_graphs["shacl_graph"] = shacl_graph
+    _worker_graphs["ont_graph"] = ont_graph
+
+
+def _parse_serialized_dataset(dataset_nt):
+    dataset_graph = Graph()
+    _bind_namespaces(dataset_graph)
+    dataset_graph.parse(data=dataset_nt, format="nt")
+    return dataset_graph
+
+
+def validate_serialized_dataset(dataset_nt):
+    """Validate a dataset graph serialized as N-Triples in a worker process"""
+    return get_shacl_results(
+        _parse_serialized_dataset(dataset_nt),
+        _worker_graphs["shacl_graph"],
+        _worker_graphs["ont_graph"],
+    )
+
+
+def validate_serialized_batch(datasets_nt):
+    """Validate dataset graphs serialized as N-Triples in one batch"""
+    return get_batch_shacl_results(
+        [_parse_serialized_dataset(dataset_nt) for dataset_nt in datasets_nt],
+        _worker_graphs["shacl_graph"],
+        _worker_graphs["ont_graph"],
+    )
+
+
 def get_shacl_results(dataset_graph, shacl_graph, ont_graph):
     validation_results = validate(
         dataset_graph, shacl_graph=shacl_graph, ont_graph=ont_graph
@@ -89,82 +268,235 @@ def get_shacl_results(dataset_graph, shacl_graph, ont_graph):
     conforms, results_graph, results_text = validation_results
     if conforms:
         return []
+    return _get_results_from_graph(results_graph, dataset_graph)
+
+
+def get_batch_shacl_results(dataset_graphs, shacl_graph, ont_graph):
+    """Validate the graphs of several datasets with one call of validate
+
+    The dataset graphs are merged and the results are split again by the
+    datasets that contain their focus node, so that each dataset gets the
+    same results as with get_shacl_results. A dataset is validated on its
+    own if one of the nodes it only references is described by another
+    dataset of the batch: in the merged graph that node would have triples
+    that the dataset does not have.
+    Returns a list of results for each of the dataset graphs.
+    """
+    subjects = [set(dataset_graph.subjects()) for dataset_graph in dataset_graphs]
+    described = defaultdict(set)
+    for index, dataset_subjects in enumerate(subjects):
+        for subject in dataset_subjects:
+            described[subject].add(index)
+    batch = set()
+    batch_results = [[] for _ in dataset_graphs]
+    for index, dataset_graph in enumerate(dataset_graphs):
+        if any(
+            node in described
+            for node in dataset_graph.objects()
+            if not isinstance(node, Literal) and node not in subjects[index]
+        ):
+            batch_results[index] = get_shacl_results(
+                dataset_graph, shacl_graph, ont_graph
+            )
+        else:
+            batch.add(index)
+    if not batch:
+        return batch_results
+    merged_graph = Graph()
+    _bind_namespaces(merged_graph)
+    for index in sorted(batch):
+        merged_graph += dataset_graphs[index]
+    for shacl_result in get_shacl_results(merged_graph, shacl_graph, ont_graph):
+        # focus nodes that no dataset describes come from the ontology graph
+        # and are part of the results of every dataset
+        for index in described.get(shacl_result.node, batch) & batch:
+            batch_results[index].append(shacl_result)
+    return batch_results
+
+
+# properties of a sh:ValidationResult that are part of a ShaclResult
+RESULT_PATH = SHACL.resultPath
+FOCUS_NODE = SHACL.focusNode
+VALUE = SHACL.value
+RESULT_SEVERITY = SHACL.resultSeverity
+RESULT_MESSAGE = SHACL.resultMessage
+RESULT_PROPERTIES = {RESULT_PATH, FOCUS_NODE, VALUE, RESULT_SEVERITY, RESULT_MESSAGE}
+
+
+def _get_results_from_graph(results_graph, dataset_graph):
+    """Get the validation results with a single pass over the results graph
+
+    The properties of all validation results are indexed first, so that
+    each result is looked up in a dict instead of with a query per property.
+    As before, the first object of a property is taken.
+    """
+    result_properties = defaultdict(dict)
+    for subject, predicate, obj in results_graph:
+        if predicate in RESULT_PROPERTIES:
+            result_properties[subject].setdefault(predicate, obj)
+    # the names are computed once per term
+    get_property = lru_cache(maxsize=None)(
+        lambda ref: ref.n3(results_graph.namespace_manager)
+    )
+    get_severity = lru_cache(maxsize=None)(
+        lambda ref: results_graph.compute_qname(ref)[2]
+    )
+    get_qname = lru_cache(maxsize=None)(
+        lambda ref: "{0}:{2}".format(*dataset_graph.compute_qname(ref))
+    )
     checker_results = []
     for validation_item in results_graph.subjects(
         predicate=RDF.type, object=SHACL.ValidationResult
     ):
-        property_ref = get_object_from_graph(
-            graph=results_graph,
-            subject=validation_item,
-            predicate=SHACL.resultPath,
+        properties = result_properties[validation_item]
+        property_ref = properties.get(RESULT_PATH)
+        if not property_ref:
+            continue
+        property = get_property(property_ref)
+        node = properties.get(FOCUS_NODE)
+        value = properties.get(VALUE) or next(
+            dataset_graph.objects(subject=node, predicate=property_ref), None
         )
-        if property_ref:
-            property = property_ref.n3(results_graph.namespace_manager)
-            node = get_object_from_graph(
-                graph=results_graph,
-                subject=validation_item,
-                predicate=SHACL.focusNode,
-            )
-            value = get_object_from_graph(
-                graph=results_graph, subject=validation_item, predicate=SHACL.value
-            ) or get_object_from_graph(
-                graph=dataset_graph, subject=node, predicate=property_ref
-            )
-            if type(value) == BNode:
-                try:
-                    for p, o in dataset_graph.predicate_objects(subject=value):
-                        p_qname = dataset_graph.compute_qname(p)
-                        value = f"{p_qname[0]}:{p_qname[2]} {o}"
-                except Exception as e:
-                    log_and_echo_msg(
-                        f"""Exception {e} of type {type(e).__name__} 
-                        BNode value could not be determined for {property}"""
-                    )
-                    pass
-            severity = get_object_from_graph(
-                graph=results_graph,
-                subject=validation_item,
-                predicate=SHACL.resultSeverity,
-            )
-            severity = results_graph.compute_qname(severity)[2]
-            msg = get_object_from_graph(
-                graph=results_graph,
-                subject=validation_item,
-                predicate=SHACL.resultMessage,
-            )
-            if msg:
-                msg = msg.toPython()
-            shacl_result = ShaclResult(
-                node=node,
-                property=property,
-                value=value,
-                msg=msg,
-                severity=severity,
-            )
-            checker_results.append(shacl_result)
+        if type(value) == BNode:
+            try:
+                for p, o in dataset_graph.predicate_objects(subject=value):
+                    value = f"{get_qname(p)} {o}"
+            except Exception as e:
+                log_and_echo_msg(
+                    f"""Exception {e} of type {type(e).__name__} 
+                    BNode value could not be determined for {property}"""
+                )
+                pass
+        severity = get_severity(properties.get(RESULT_SEVERITY))
+        msg = properties.get(RESULT_MESSAGE)
+        if msg:
+            msg = msg.toPython()
+        shacl_result = ShaclResult(
+            node=node,
+            property=property,
+            value=value,
+            msg=msg,
+            severity=severity,
+        )
+        checker_results.append(shacl_result)
     return checker_results
 
 
-def get_dataset_graph_from_source(source_url, identifier):
+def _bind_namespaces(graph):
+    for k, v in namespaces.items():
+        graph.bind(k, v)
+    graph.namespace_manager = NamespaceManager(graph)
+
+
+def parse_harvest_source(source_url, fetcher=None):
+    """Parse a harvest source and index its datasets by dct:identifier
+
+    With a fetcher the source is parsed from its cached copy.
+    """
     try:
-        source = Graph().parse(source_url, format="application/rdf+xml")
+        if fetcher:
+            source = Graph().parse(
+                fetcher.fetch(source_url),
+                format="application/rdf+xml",
+                publicID=source_url,
+            )
+        else:
+            source = Graph().parse(source_url, format="application/rdf+xml")
     except Exception as e:
-        log_and_echo_msg(
-            f"Exception {e} happened for source_url {source_url} and {identifier}"
-        )
+        log_and_echo_msg(f"Exception {e} happened for source_url {source_url}")
         return None
-    for k, v in namespaces.items():
-        source.bind(k, v)
-    source.namespace_manager = NamespaceManager(source)
+    _bind_namespaces(source)
+    datasets = defaultdict(list)
+    for dataset_ref, identifier in source.subject_objects(predicate=DCT.identifier):
+        datasets[identifier].append(dataset_ref)
+    return HarvestSource(graph=source, datasets=datasets)
+
+
+def extract_dataset_graph(harvest_source, identifier):
+    """Get the subgraph of one dataset from a parsed or streamed harvest source"""
     dataset = Graph()
-    for k, v in namespaces.items():
-        dataset.bind(k, v)
-    dataset.namespace_manager = NamespaceManager(dataset)
-    for dataset_ref in source.subjects(
-        predicate=DCT.identifier, object=Literal(identifier)
-    ):
+    _bind_namespaces(dataset)
+    if isinstance(harvest_source, StreamedHarvestSource):
+        harvest_source.add_dataset_triples(dataset, identifier)
+        return dataset
+    source = harvest_source.graph
+    for dataset_ref in harvest_source.datasets.get(Literal(identifier), []):
         for pred, obj in source.predicate_objects(subject=dataset_ref):
             dataset.add((dataset_ref, pred, obj))
             for subpred, subobj in source.predicate_objects(subject=obj):
                 dataset.add((obj, subpred, subobj))
     return dataset
+
+
+class HarvestSourceCache:
+    """Keeps the most recently used harvest sources of a run parsed
+
+    Each harvest source is downloaded and parsed only once, as long as it
+    is not evicted: when more than maxsize sources are cached, the least
+    recently used one is dropped. Failed sources are cached as well, so
+    that a broken source is not requested again for each of its datasets.
+    Callers that ask for a source while it is loaded wait for it.
+
+    With stream the sources are split into their datasets on disk instead
+    of being parsed into one graph, which keeps large catalogs out of
+    memory. With a fetcher the sources are downloaded into its cache
+    directory and only revalidated once they are cached.
+    """
+
+    def __init__(self, maxsize=10, stream=False, fetcher=None):
+        self.maxsize = maxsize
+        self.stream = stream
+        self.fetcher = fetcher
+        self._sources = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+
+    def __contains__(self, source_url):
+        with self._lock:
+            return source_url in self._sources
+
+    def get(self, source_url):
+        with self._lock:
+            if source_url in self._sources:
+                self._sources.move_to_end(source_url)
+                return self._sources[source_url]
+        # the datasets of a harvest source may be checked in parallel: the
+        # source is loaded once for all of them
+        return self._flights.do(source_url, self._load, source_url)
+
+    def _load(self, source_url):
+        with self._lock:
+            if source_url in self._sources:
+                return self._sources[source_url]
+        if self.stream:
+            harvest_source = stream_harvest_source(source_url, fetcher=self.fetcher)
+        else:
+            harvest_source = parse_harvest_source(source_url, fetcher=self.fetcher)
+        with self._lock:
+            self._sources[source_url] = harvest_source
+            if len(self._sources) > self.maxsize:
+                self._sources.popitem(last=False)
+        return harvest_source
+
+    def close(self):
+        """Remove the streamed sources from disk and close the fetcher"""
+        if self.fetcher:
+            self.fetcher.close()
+        with self._lock:
+            for harvest_source in self._sources.values():
+                if isinstance(harvest_source, StreamedHarvestSource):
+                    harvest_source.close()
+            self._sources.clear()
+
+
+def get_dataset_graph_from_source(source_url, identifier, cache=None):
+    if cache is not None:
+        harvest_source = cache.get(source_url)
+    else:
+        harvest_source = parse_harvest_source(source_url)
+    if not harvest_source:
+        log_and_echo_msg(
+            f"Harvest source {source_url} not available for dataset {identifier}"
+        )
+        return None
+    return extract_dataset_graph(harvest_source, identifier)
@@ -1,43 +1,259 @@
 import logging
+import threading
+import time
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlparse
 
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.exceptions import (
+    ConnectTimeoutError,
     InsecurePlatformWarning,
     InsecureRequestWarning,
 )
-from requests.packages.urllib3.util.retry import Retry
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 requests.packages.urllib3.disable_warnings(InsecurePlatformWarning)
 
 log = logging.getLogger(__name__)
 
+UrlCheck = namedtuple("UrlCheck", ["error", "etag", "last_modified"])
+USER_AGENTS = [
+    (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_1) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/58.0.3029.110 Safari/537.3 "
+        "Safari/537.36"
+    ),
+    "Custom",
+]
+# seconds to wait for a connection and for the response on an open connection
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+# failures of requests that did not get a response
+UNREACHABLE = "unreachable"  # DNS errors, refused connections and connect timeouts
+TIMED_OUT = "timed out"
+SHORT_CIRCUITED = "short-circuited"  # not sent, as the circuit of the host is open
 
-def _check_with_user_agent(test_url, http_method, user_agent):
+
+class HostLimiter:
+    """Limits the open connections and the request rate per host
+
+    At most max_connections requests are sent to the same host at a time
+    and consecutive requests to a host are started at least min_interval
+    seconds apart.
+    """
+
+    def __init__(self, max_connections=2, min_interval=0):
+        self.max_connections = max_connections
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_request = defaultdict(float)
+
+    @contextmanager
+    def limit(self, url):
+        host = _get_host(url)
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(
+                    self.max_connections
+                )
+            semaphore = self._semaphores[host]
+        with semaphore:
+            if self.min_interval:
+                with self._lock:
+                    now = time.monotonic()
+                    start = max(now, self._next_request[host])
+                    self._next_request[host] = start + self.min_interval
+                if start > now:
+                    time.sleep(start - now)
+            yield
+
+
+class HostStrategy:
+    """Learns during a run how the urls of a host are best checked
+
+    Hosts that answered a HEAD request with an error, but a GET request
+    without, are checked with GET right away from then on. The strategy
+    also holds the timeouts: a short one to connect, so that unreachable
+    hosts fail fast, and a longer one to wait for the response, and an
+    optional circuit breaker for the hosts that are down.
+    """
+
+    def __init__(
+        self,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        circuit_breaker=None,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.circuit_breaker = circuit_breaker
+        self._lock = threading.Lock()
+        self._head_rejecting_hosts = set()
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def rejects_head(self, url):
+        with self._lock:
+            return _get_host(url) in self._head_rejecting_hosts
+
+    def set_rejects_head(self, url):
+        host = _get_host(url)
+        with self._lock:
+            if host not in self._head_rejecting_hosts:
+                log.debug(f"host {host} is checked with GET from now on")
+                self._head_rejecting_hosts.add(host)
+
+
+class HostCircuitBreaker:
+    """Stops requesting the urls of hosts that are down
+
+    After max_failures connection errors or timeouts in a row the circuit
+    of a host is opened: its urls get an error about the host without a
+    request. The error does not repeat the message of the last failure, as
+    that message names the url of the failed request. After reset_timeout
+    seconds one url is let through as a probe: if the host answers, the
+    circuit is closed again, otherwise it stays open for another
+    reset_timeout seconds.
+    """
+
+    def __init__(self, max_failures=5, reset_timeout=60):
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.short_circuited = 0
+        self._lock = threading.Lock()
+        self._failures = defaultdict(int)
+        self._open_circuits = {}
+        self._probing_hosts = set()
+
+    def is_open(self, url):
+        with self._lock:
+            return _get_host(url) in self._open_circuits
+
+    def get_error(self, url):
+        """Get the error for an url of an open circuit
+
+        None is returned if the url may be requested: the circuit is closed
+        or the url is the probe of the host.
+        """
+        host = _get_host(url)
+        with self._lock:
+            if host not in self._open_circuits:
+                return None
+            opened_at, failure = self._open_circuits[host]
+            if (
+                host not in self._probing_hosts
+                and time.monotonic() - opened_at >= self.reset_timeout
+            ):
+                log.info(f"probing host {host} with url {url}")
+                self._probing_hosts.add(host)
+                return None
+            self.short_circuited += 1
+            return (
+                f"Host {host} {failure}: url not requested after "
+                f"{self.max_failures} failed requests to the host"
+            )
+
+    def record(self, url, error, failure):
+        """Record the result of a request: failure is UNREACHABLE, TIMED_OUT or None"""
+        host = _get_host(url)
+        with self._lock:
+            self._probing_hosts.discard(host)
+            if not failure:
+                self._failures.pop(host, None)
+                if self._open_circuits.pop(host, None):
+                    log.info(f"circuit of host {host} closed")
+                return
+            self._failures[host] += 1
+            if self._failures[host] >= self.max_failures:
+                if host not in self._open_circuits:
+                    log.info(f"circuit of host {host} opened: {error}")
+                self._open_circuits[host] = (time.monotonic(), failure)
+
+
+def _get_host(url):
+    return urlparse(url).netloc.lower()
+
+
+def get_session(pool_connections=10, pool_maxsize=10):
+    """Session that keeps the connections to the checked hosts open
+
+    pool_connections is the number of hosts for which connections are kept
+    and pool_maxsize the number of connections that are kept per host.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _check_with_user_agent(
+    test_url,
+    http_method,
+    user_agent,
+    host_limiter=None,
+    circuit_breaker=None,
+    metrics=None,
+    **kwargs,
+):
+    """Send one request, unless the circuit of the host is open
+
+    Returns the error message, the response and the failure if no response
+    came: UNREACHABLE, TIMED_OUT or SHORT_CIRCUITED. The request is recorded
+    in the link metrics, if they are collected.
+    """
+    limit = host_limiter.limit(test_url) if host_limiter else nullcontext()
+    with limit:
+        # the circuit is looked at once the host may be requested, as other
+        # requests to the host may have opened it in the meantime
+        error = circuit_breaker.get_error(test_url) if circuit_breaker else None
+        if error:
+            return error, None, SHORT_CIRCUITED
+        start = time.perf_counter()
+        error_result, req, failure = _send_with_user_agent(
+            test_url, http_method, user_agent, **kwargs
+        )
+        duration = time.perf_counter() - start
+    if circuit_breaker:
+        circuit_breaker.record(test_url, error_result, failure)
+    if metrics:
+        metrics.record_request(
+            test_url,
+            http_method,
+            user_agent,
+            status=req.status_code if req is not None else None,
+            failure=failure,
+            duration=duration,
+            size=len(req.content) if req is not None else None,
+        )
+    return error_result, req, failure
+
+
+def _send_with_user_agent(
+    test_url,
+    http_method,
+    user_agent,
+    session=None,
+    headers=None,
+    timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+):
+    """Send one request and return the error message, the response and the failure"""
     log.debug(f"URL {test_url} ({http_method}), User-Agent: {user_agent}")
+    req = None
     try:
-        headers = {"User-Agent": user_agent}
-        if http_method == "HEAD":
-            req = requests.head(
-                test_url,
-                verify=False,  # SSL certificate will not be verified
-                timeout=30,
-                headers=headers,
-            )
-        elif http_method == "GET":
-            req = requests.get(
-                test_url,
-                verify=False,  # SSL certificate will not be verified
-                timeout=30,
-                headers={
-                    "Range": "bytes=0-10",  # Request the first 10 bytes
-                    "User-Agent": user_agent,
-                },
-            )
+        headers = {**(headers or {}), "User-Agent": user_agent}
+        req = _send_request(
+            test_url, http_method, headers, session=session, timeout=timeout
+        )
         req.raise_for_status()
         log.info("Sent response %s" % req.status_code)
-        return None  # Success, no error
+        return None, req, None  # Success, no error
     except requests.exceptions.HTTPError as e:
         log.debug(
             "HTTP EXCEPTION OCCURRED for URL %s (%s): %r" % (test_url, http_method, e)
@@ -45,51 +261,197 @@ def _check_with_user_agent(test_url, http_method, user_agent):
         # ignore 405 Method Not Allowed errors
         if 405 != e.response.status_code:
             if 404 == e.response.status_code:
-                return "Failed to load resource: the server responded with a status of 404 (Not Found)"
+                return (
+                    "Failed to load resource: the server responded with a status of 404 (Not Found)",
+                    req,
+                    None,
+                )
             else:
-                return str(e)  # Return the error message
+                return str(e), req, None  # Return the error message
+        return None, req, None
     except (ValueError, requests.exceptions.RequestException) as e:
         log.debug(
             "REQUEST EXCEPTION OCCURRED for URL %s (%s): %r"
             % (test_url, http_method, e)
         )
         if hasattr(e, "message") and hasattr(e.message, "reason"):
-            return str(e.message.reason)
+            return str(e.message.reason), req, _get_failure(e)
         else:
-            return str(e)
+            return str(e), req, _get_failure(e)
 
 
-def check_url_status(test_url, http_method="HEAD"):
+def _get_failure(e):
+    if _is_connection_error(e):
+        return UNREACHABLE
+    if isinstance(e, requests.exceptions.Timeout):
+        return TIMED_OUT
+    return None
+
+
+def _is_connection_error(e):
+    """DNS errors, refused connections and connect timeouts"""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(e, requests.exceptions.ConnectionError) or not e.args:
+        return False
+    # the reason of urllib3's MaxRetryError, NewConnectionError is a ConnectTimeoutError
+    return isinstance(getattr(e.args[0], "reason", None), ConnectTimeoutError)
+
+
+def _send_request(
+    test_url,
+    http_method,
+    headers,
+    session=None,
+    timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+):
+    # without a session every request opens a new connection
+    requester = session or requests
+    if http_method == "HEAD":
+        return requester.head(
+            test_url,
+            verify=False,  # SSL certificate will not be verified
+            timeout=timeout,
+            headers=headers,
+        )
+    elif http_method == "GET":
+        return requester.get(
+            test_url,
+            verify=False,  # SSL certificate will not be verified
+            timeout=timeout,
+            headers={
+                "Range": "bytes=0-10",  # Request the first 10 bytes
+                **headers,
+            },
+        )
+
+
+def check_url_status(
+    test_url, http_method="HEAD", host_limiter=None, session=None, strategy=None
+):
+    url_check, _ = _check_url_status(
+        test_url,
+        http_method=http_method,
+        host_limiter=host_limiter,
+        session=session,
+        strategy=strategy,
+    )
+    return url_check.error
+
+
+def _check_url_status(
+    test_url,
+    http_method="HEAD",
+    host_limiter=None,
+    session=None,
+    strategy=None,
+    metrics=None,
+):
+    """Check an url with each user agent until it succeeds
+
+    Returns the url check and the failure of the last request. If the server
+    could not be reached, the other user agents are not tried, as they
+    cannot help.
+    """
     log.debug("URL %s (%s)" % (test_url, http_method))
-    user_agents = [
-        (
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_1) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/58.0.3029.110 Safari/537.3 "
-            "Safari/537.36"
-        ),
-        "Custom",
-    ]
-    for user_agent in user_agents:
-        error_result = _check_with_user_agent(test_url, http_method, user_agent)
+    timeout = strategy.timeout if strategy else (CONNECT_TIMEOUT, READ_TIMEOUT)
+    for user_agent in USER_AGENTS:
+        error_result, req, failure = _check_with_user_agent(
+            test_url,
+            http_method,
+            user_agent,
+            host_limiter=host_limiter,
+            circuit_breaker=strategy.circuit_breaker if strategy else None,
+            metrics=metrics,
+            session=session,
+            timeout=timeout,
+        )
         if not error_result:
-            return None  # Success, no error
+            return _get_url_check(None, req), None  # Success, no error
+        elif failure in (UNREACHABLE, SHORT_CIRCUITED):
+            break
         else:
             log.debug(
                 "Retrying with a different User-Agent for URL %s (%s)"
                 % (test_url, http_method)
             )
-    return error_result  # If all attempts fail
+    return _get_url_check(error_result, req), failure  # If all attempts fail
 
 
-class RetryAdapter(HTTPAdapter):
-    def __init__(self, *args, **kwargs):
-        super(RetryAdapter, self).__init__(*args, **kwargs)
-        self.max_retries = Retry(
-            total=3, backoff_factor=5, status_forcelist=[500, 502, 503, 504]
-        )
+def _get_url_check(error_result, req):
+    if error_result or req is None or not req.ok:
+        return UrlCheck(error=error_result, etag=None, last_modified=None)
+    return UrlCheck(
+        error=None,
+        etag=req.headers.get("ETag"),
+        last_modified=req.headers.get("Last-Modified"),
+    )
+
+
+def check_url(test_url, host_limiter=None, session=None, strategy=None):
+    """Check one url: first as 'HEAD', then as 'GET'"""
+    return check_url_with_validators(
+        test_url, host_limiter=host_limiter, session=session, strategy=strategy
+    ).error
+
+
+def check_url_with_validators(
+    test_url, host_limiter=None, session=None, strategy=None, metrics=None
+):
+    """Check one url and return the validators of a successful response
+
+    The ETag and Last-Modified headers can be used to revalidate the url
+    later on with a conditional request. With a strategy, the urls of hosts
+    that are known to reject 'HEAD' are checked with 'GET' right away.
+    'GET' is not tried if the server could not be reached with 'HEAD'.
+    If the circuit of the host is open, the url is not requested at all.
+    """
+    kwargs = dict(
+        host_limiter=host_limiter, session=session, strategy=strategy, metrics=metrics
+    )
+    if strategy and strategy.rejects_head(test_url):
+        url_check, failure = _check_url_status(test_url, http_method="GET", **kwargs)
+    else:
+        url_check, failure = _check_url_status(test_url, **kwargs)
+        if url_check.error and failure not in (UNREACHABLE, SHORT_CIRCUITED):
+            url_check, failure = _check_url_status(
+                test_url, http_method="GET", **kwargs
+            )
+            if strategy and not url_check.error:
+                strategy.set_rejects_head(test_url)
+    return url_check
+
 
+def revalidate_url(
+    test_url,
+    etag,
+    last_modified,
+    host_limiter=None,
+    session=None,
+    strategy=None,
+    metrics=None,
+):
+    """Revalidate an url that was ok with a conditional 'HEAD' request
 
-session = requests.Session()
-session.mount("http://", RetryAdapter())
-session.mount("https://", RetryAdapter())
+    Returns True if the server confirms the url: with '304 Not Modified'
+    or with a successful response.
+    """
+    if strategy and strategy.circuit_breaker:
+        if strategy.circuit_breaker.is_open(test_url):
+            return False
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    error_result, req, _ = _check_with_user_agent(
+        test_url,
+        "HEAD",
+        USER_AGENTS[0],
+        host_limiter=host_limiter,
+        metrics=metrics,
+        session=session,
+        headers=headers,
+        timeout=strategy.timeout if strategy else (CONNECT_TIMEOUT, READ_TIMEOUT),
+    )
+    return req is not None and (req.status_code == 304 or req.ok)
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ckan_pkg_checker.utils.streamed_source import RDF_XML_ACCEPT
+from ckan_pkg_checker.utils.utils import log_and_echo_msg
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# number of connections that are kept open per host
+POOL_SIZE = 10
+# the files of a cached source and of a download that was interrupted
+CACHE_SUFFIXES = [".rdf", ".json", ".part"]
+
+
+class HarvestSourceFetcher:
+    """Downloads harvest sources into a cache directory that outlives the run
+
+    Each source is stored in a file named after the hash of its url, next
+    to the ETag and Last-Modified of the response. A source that is cached
+    already is revalidated with If-None-Match and If-Modified-Since, so an
+    unchanged catalog costs one '304 Not Modified' round trip. The requests
+    share one session with a connection pool, ask for gzip and time out
+    after connect_timeout and read_timeout seconds, so that a hung harvest
+    endpoint fails instead of stalling the run.
+
+    Urls without http or https scheme are local files: they are returned
+    as they are. On close the cached sources that were not fetched in the
+    run are removed, so that the sources of removed harvesters do not pile
+    up in the cache directory.
+    """
+
+    def __init__(
+        self, cache_dir, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept"] = RDF_XML_ACCEPT
+        self.session.headers["Accept-Encoding"] = "gzip"
+        self.revalidated_count = 0
+        self.downloaded_count = 0
+        self._fetched_names = set()
+        self._lock = threading.Lock()
+
+    def fetch(self, source_url):
+        """Return the path of the local copy of a harvest source"""
+        if urlparse(source_url).scheme not in ["http", "https"]:
+            return source_url
+        path, validators_path = self._get_paths(source_url)
+        with self._lock:
+            self._fetched_names.add(path.stem)
+        validators = _read_validators(validators_path) if path.exists() else {}
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        with self.session.get(
+            source_url, headers=headers, stream=True, timeout=self.timeout
+        ) as response:
+            if response.status_code == 304:
+                if not path.exists():
+                    raise requests.HTTPError(
+                        f"304 Not Modified without a cached copy for url: "
+                        f"{source_url}",
+                        response=response,
+                    )
+                with self._lock:
+                    self.revalidated_count += 1
+                return str(path)
+            response.raise_for_status()
+            self._write_source(response, path)
+            _write_validators(
+                validators_path,
+                {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                },
+            )
+        with self._lock:
+            self.downloaded_count += 1
+        return str(path)
+
+    def _get_paths(self, source_url):
+        name = hashlib.sha256(source_url.encode("utf-8")).hexdigest()
+        return (
+            self.cache_dir / f"{name}.rdf",
+            self.cache_dir / f"{name}.json",
+        )
+
+    def _write_source(self, response, path):
+        # the source is written to a temporary file first, so that a failed
+        # download or a concurrent fetch never leaves a truncated source
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as source_file:
+                # iter_content decodes the gzip content encoding
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    source_file.write(chunk)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def _prune(self):
+        """Remove the cached sources that were not fetched in this run"""
+        pruned_count = 0
+        for path in self.cache_dir.iterdir():
+            if path.suffix in CACHE_SUFFIXES and path.stem not in self._fetched_names:
+                path.unlink()
+                if path.suffix == ".rdf":
+                    pruned_count += 1
+        return pruned_count
+
+    def close(self):
+        self.session.close()
+        if not self._fetched_names:
+            # nothing was fetched, for instance in a run that failed early
+            return
+        pruned_count = self._prune()
+        log_and_echo_msg(
+            f"{self.downloaded_count} harvest sources downloaded, "
+            f"{self.revalidated_count} unchanged harvest sources taken from "
+            f"{self.cache_dir}, {pruned_count} harvest sources removed from it"
+        )
+
+
+def _read_validators(validators_path):
+    try:
+        with open(validators_path) as validators_file:
+            return json.load(validators_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_validators(validators_path, validators):
+    fd, tmp_path = tempfile.mkstemp(dir=validators_path.parent, suffix=".part")
+    with os.fdopen(fd, "w") as validators_file:
+        json.dump(validators, validators_file)
+    os.replace(tmp_path, validators_path)
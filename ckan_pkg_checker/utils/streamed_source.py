@@ -0,0 +1,276 @@
+import itertools
+import os
+import sqlite3
+import tempfile
+import threading
+import weakref
+import xml.etree.ElementTree as ET
+from urllib.parse import urlparse
+
+import requests
+from rdflib import Graph, URIRef
+
+from ckan_pkg_checker.utils.utils import log_and_echo_msg
+
+RDF_NS = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+RDF_TAG = f"{{{RDF_NS}}}RDF"
+RDF_DESCRIPTION_TAG = f"{{{RDF_NS}}}Description"
+RDF_TYPE_TAG = f"{{{RDF_NS}}}type"
+RDF_RESOURCE_ATTRIBUTE = f"{{{RDF_NS}}}resource"
+XML_BASE_ATTRIBUTE = "{http://www.w3.org/XML/1998/namespace}base"
+XML_LANG_ATTRIBUTE = "{http://www.w3.org/XML/1998/namespace}lang"
+DCAT_DATASET = "http://www.w3.org/ns/dcat#Dataset"
+DCAT_DATASET_TAG = "{http://www.w3.org/ns/dcat#}Dataset"
+DCT_IDENTIFIER = URIRef("http://purl.org/dc/terms/identifier")
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# seconds to wait for a connection and for the next chunk of the catalog
+DOWNLOAD_TIMEOUT = (5, 60)
+# the Accept header that rdflib sends for RDF/XML, for harvest endpoints that
+# negotiate the format
+RDF_XML_ACCEPT = "application/rdf+xml, */*;q=0.1"
+
+
+class StreamedHarvestSource:
+    """The datasets of a harvest source, split into a sqlite file on disk
+
+    Each dataset is stored as N-Triples with its dct:identifier, together
+    with the descriptions that are nested in its dcat:Dataset element. The
+    descriptions of all resources with an URI, in the dataset elements and
+    in the other top level elements of the catalog, are stored by their
+    subject as well, so that the objects of a dataset that are described
+    elsewhere in the catalog can be added to its graph. The rows keep the
+    number of the element they were parsed from, so that the descriptions
+    of a dataset element are not added to its own datasets twice.
+
+    Blank nodes can only be resolved within the element they are nested in:
+    a dataset that refers to a blank node described elsewhere in the
+    catalog with rdf:nodeID gets the reference, but not its description.
+
+    The sqlite file is removed on close or once the source is no longer
+    referenced, so that a source that is evicted from a cache is not removed
+    while its datasets are still read.
+    """
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix="harvest-source-", suffix=".sqlite")
+        os.close(fd)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._finalizer = weakref.finalize(
+            self, _remove_database, self._connection, self.path
+        )
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE datasets "
+                "(identifier TEXT, dataset_ref TEXT, triples TEXT, element INTEGER)"
+            )
+            self._connection.execute(
+                "CREATE TABLE descriptions "
+                "(subject TEXT, triples TEXT, element INTEGER)"
+            )
+
+    def put_dataset(self, identifier, dataset_ref, triples, element):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO datasets (identifier, dataset_ref, triples, element) "
+                "VALUES (?, ?, ?, ?)",
+                (identifier, dataset_ref, triples, element),
+            )
+
+    def put_description(self, subject, triples, element):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO descriptions (subject, triples, element) "
+                "VALUES (?, ?, ?)",
+                (subject, triples, element),
+            )
+
+    def create_indexes(self):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE INDEX datasets_identifier ON datasets (identifier)"
+            )
+            self._connection.execute(
+                "CREATE INDEX descriptions_subject ON descriptions (subject)"
+            )
+
+    def add_dataset_triples(self, graph, identifier):
+        """Add the triples of a dataset to the graph
+
+        As for a parsed harvest source these are the triples of the dataset
+        and the triples of its objects.
+        """
+        with self._lock:
+            datasets = self._connection.execute(
+                "SELECT dataset_ref, triples, element FROM datasets "
+                "WHERE identifier = ?",
+                (identifier,),
+            ).fetchall()
+        for dataset_ref, triples, element in datasets:
+            dataset = Graph().parse(data=triples, format="nt")
+            _add_subgraph(graph, dataset, URIRef(dataset_ref))
+            for obj in set(dataset.objects(subject=URIRef(dataset_ref))):
+                if isinstance(obj, URIRef):
+                    for description in self._get_descriptions(obj, element):
+                        graph.parse(data=description, format="nt")
+
+    def _get_descriptions(self, subject, element):
+        """The descriptions of the subject outside of the element"""
+        with self._lock:
+            return [
+                triples
+                for (triples,) in self._connection.execute(
+                    "SELECT triples FROM descriptions "
+                    "WHERE subject = ? AND element != ?",
+                    (str(subject), element),
+                )
+            ]
+
+    def close(self):
+        with self._lock:
+            self._finalizer()
+
+
+def _remove_database(connection, path):
+    connection.close()
+    os.remove(path)
+
+
+def stream_harvest_source(source_url, fetcher=None):
+    """Download a harvest source and split it into its datasets
+
+    The catalog is written to a temporary file, or taken from the cache of
+    the fetcher, and walked element by element, so that neither the catalog
+    nor its graph is held in memory.
+    """
+    source_path = source_url
+    downloaded = False
+    harvest_source = None
+    try:
+        if fetcher:
+            source_path = fetcher.fetch(source_url)
+        elif urlparse(source_url).scheme in ["http", "https"]:
+            source_path = _download_source(source_url)
+            downloaded = True
+        harvest_source = StreamedHarvestSource()
+        _split_catalog(source_path, source_url, harvest_source)
+        harvest_source.create_indexes()
+        return harvest_source
+    except Exception as e:
+        log_and_echo_msg(
+            f"Exception {e} of type {type(e).__name__} occured "
+            f"at streaming harvest source {source_url}",
+            error=True,
+        )
+        if harvest_source:
+            harvest_source.close()
+        return None
+    finally:
+        if downloaded:
+            os.remove(source_path)
+
+
+def _download_source(source_url):
+    fd, path = tempfile.mkstemp(prefix="harvest-source-", suffix=".rdf")
+    try:
+        with os.fdopen(fd, "wb") as source_file, requests.get(
+            source_url,
+            headers={"Accept": RDF_XML_ACCEPT},
+            stream=True,
+            timeout=DOWNLOAD_TIMEOUT,
+        ) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                source_file.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def _split_catalog(source_path, source_url, harvest_source):
+    """Store the dataset elements and the other top level elements
+
+    The elements are removed from the tree once they are stored, so that
+    only the element that is parsed at the moment is kept in memory.
+    """
+    elements = []
+    base = source_url
+    stored_elements = itertools.count()
+    for event, element in ET.iterparse(source_path, events=("start", "end")):
+        if event == "start":
+            if not elements:
+                base = element.get(XML_BASE_ATTRIBUTE, source_url)
+            elements.append(element)
+            continue
+        elements.pop()
+        if len(elements) < 1:
+            continue
+        parent = elements[-1]
+        if _is_dataset_element(element):
+            graph = _parse_element(element, base, _get_lang(elements))
+            _store_dataset(graph, next(stored_elements), harvest_source)
+            parent.remove(element)
+        elif parent.tag == RDF_TAG:
+            graph = _parse_element(element, base, _get_lang(elements))
+            _store_descriptions(graph, next(stored_elements), harvest_source)
+            parent.remove(element)
+
+
+def _get_lang(ancestors):
+    """The xml:lang that an element inherits from its ancestors"""
+    for ancestor in reversed(ancestors):
+        lang = ancestor.get(XML_LANG_ATTRIBUTE)
+        if lang is not None:
+            return lang
+    return None
+
+
+def _is_dataset_element(element):
+    if element.tag == DCAT_DATASET_TAG:
+        return True
+    return element.tag == RDF_DESCRIPTION_TAG and any(
+        child.tag == RDF_TYPE_TAG and child.get(RDF_RESOURCE_ATTRIBUTE) == DCAT_DATASET
+        for child in element
+    )
+
+
+def _parse_element(element, base, lang):
+    """Parse one node element as an RDF/XML document of its own"""
+    document = ET.Element(RDF_TAG)
+    if lang is not None:
+        document.set(XML_LANG_ATTRIBUTE, lang)
+    document.append(element)
+    return Graph().parse(data=ET.tostring(document), format="xml", publicID=base)
+
+
+def _store_dataset(graph, element, harvest_source):
+    for dataset_ref, identifier in graph.subject_objects(predicate=DCT_IDENTIFIER):
+        dataset = Graph()
+        _add_subgraph(dataset, graph, dataset_ref)
+        harvest_source.put_dataset(
+            str(identifier), str(dataset_ref), dataset.serialize(format="nt"), element
+        )
+    # the resources that are described in the dataset element can be the
+    # objects of other datasets
+    _store_descriptions(graph, element, harvest_source)
+
+
+def _store_descriptions(graph, element, harvest_source):
+    for subject in set(graph.subjects()):
+        # blank nodes can not be referred to from outside of the element
+        if isinstance(subject, URIRef):
+            description = Graph()
+            for triple in graph.triples((subject, None, None)):
+                description.add(triple)
+            harvest_source.put_description(
+                str(subject), description.serialize(format="nt"), element
+            )
+
+
+def _add_subgraph(graph, source, subject):
+    """Add the triples of the subject and the triples of its objects"""
+    for pred, obj in source.predicate_objects(subject=subject):
+        graph.add((subject, pred, obj))
+        for subpred, subobj in source.predicate_objects(subject=obj):
+            graph.add((obj, subpred, subobj))
@@ -0,0 +1,83 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+CachedUrl = namedtuple(
+    "CachedUrl", ["status", "error", "checked_at", "etag", "last_modified"]
+)
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+
+
+class UrlResultCache:
+    """Stores the url check results across runs in a sqlite database
+
+    Successful checks are valid for success_ttl seconds: afterwards the url
+    needs to be checked again, or revalidated with a conditional request in
+    case the server sent an ETag or Last-Modified header. Failed checks are
+    never taken from the cache, they are kept for failure_ttl seconds.
+    """
+
+    def __init__(self, path, success_ttl, failure_ttl):
+        self.success_ttl = success_ttl
+        self.failure_ttl = failure_ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS url_results ("
+                "url TEXT PRIMARY KEY, status TEXT, error TEXT, "
+                "checked_at REAL, etag TEXT, last_modified TEXT)"
+            )
+            self._connection.execute(
+                "DELETE FROM url_results WHERE status = ? AND checked_at < ?",
+                (STATUS_FAILED, time.time() - self.failure_ttl),
+            )
+
+    def get(self, url):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status, error, checked_at, etag, last_modified "
+                "FROM url_results WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row:
+            return CachedUrl(*row)
+        return None
+
+    def is_fresh(self, cached_url):
+        return (
+            cached_url.status == STATUS_OK
+            and time.time() - cached_url.checked_at < self.success_ttl
+        )
+
+    def put(self, url, error, etag=None, last_modified=None):
+        status = STATUS_FAILED if error else STATUS_OK
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO url_results "
+                "(url, status, error, checked_at, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, status, error, time.time(), etag, last_modified),
+            )
+
+    def touch(self, url):
+        """Mark a revalidated url as checked now"""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE url_results SET checked_at = ? WHERE url = ?",
+                (time.time(), url),
+            )
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM url_results")
+        log.info("url result cache cleared")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,119 @@
+import json
+import logging
+import sqlite3
+import threading
+
+log = logging.getLogger(__name__)
+
+# fields that are set when a package is enriched, they are set again for each run
+ENRICHED_FIELDS = ["pkg_type", "source_url", "send_to"]
+
+
+class UrlInventory:
+    """Stores the urls of all packages across runs in a sqlite database
+
+    For each package the urls it references are kept together with the
+    test title and resource id of the reference, and the package itself
+    without its resources, so that the results of the link checks can be
+    reported without requesting the package again.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS packages ("
+                "name TEXT PRIMARY KEY, metadata_modified TEXT, package TEXT)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS url_references ("
+                "name TEXT, position INTEGER, url TEXT, test_title TEXT, "
+                "resource_id TEXT)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS url_references_name "
+                "ON url_references (name)"
+            )
+
+    def get_last_modified(self):
+        """Get the newest metadata_modified of the packages in the inventory"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT MAX(metadata_modified) FROM packages"
+            ).fetchone()
+        return row[0]
+
+    def put_package(self, pkg, link_tests):
+        package = {
+            key: value
+            for key, value in pkg.items()
+            if key != "resources" and key not in ENRICHED_FIELDS
+        }
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO packages (name, metadata_modified, package) "
+                "VALUES (?, ?, ?)",
+                (pkg["name"], pkg.get("metadata_modified"), json.dumps(package)),
+            )
+            self._connection.execute(
+                "DELETE FROM url_references WHERE name = ?", (pkg["name"],)
+            )
+            self._connection.executemany(
+                "INSERT INTO url_references "
+                "(name, position, url, test_title, resource_id) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (pkg["name"], position, *link_test)
+                    for position, link_test in enumerate(link_tests)
+                ],
+            )
+
+    def remove_packages_except(self, names):
+        """Remove the packages that are no longer in ckan"""
+        with self._lock, self._connection:
+            removed = [
+                (name,)
+                for (name,) in self._connection.execute("SELECT name FROM packages")
+                if name not in names
+            ]
+            self._connection.executemany("DELETE FROM packages WHERE name = ?", removed)
+            self._connection.executemany(
+                "DELETE FROM url_references WHERE name = ?", removed
+            )
+        log.info(f"{len(removed)} packages removed from the url inventory")
+        return len(removed)
+
+    def get_urls(self):
+        with self._lock:
+            return [
+                url
+                for (url,) in self._connection.execute(
+                    "SELECT DISTINCT url FROM url_references ORDER BY url"
+                )
+            ]
+
+    def iter_packages(self):
+        """Iterate over the packages and their references ordered by name"""
+        with self._lock:
+            names = [
+                name
+                for (name,) in self._connection.execute(
+                    "SELECT name FROM packages ORDER BY name"
+                )
+            ]
+        for name in names:
+            with self._lock:
+                (package,) = self._connection.execute(
+                    "SELECT package FROM packages WHERE name = ?", (name,)
+                ).fetchone()
+                references = self._connection.execute(
+                    "SELECT url, test_title, resource_id FROM url_references "
+                    "WHERE name = ? ORDER BY position",
+                    (name,),
+                ).fetchall()
+            yield json.loads(package), references
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -2,8 +2,11 @@ import configparser
 import csv
 import logging
 import os
+import queue
 import sys
+import threading
 from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from configparser import NoOptionError, NoSectionError
 from datetime import datetime
 from pathlib import Path
@@ -18,6 +21,9 @@ from jinja2 import Environment, PackageLoader, select_autoescape
 env = Environment(
     loader=PackageLoader("ckan_pkg_checker", "email_templates"),
     autoescape=select_autoescape(["html", "xml"]),
+    # the templates are part of the package: they are not checked for changes
+    # each time a message is rendered
+    auto_reload=False,
 )
 
 log = logging.getLogger(__name__)
@@ -40,6 +46,11 @@ RunParms = namedtuple(
         "send",
         "test",
         "harvester_type",
+        "link_cache",
+        "clear_link_cache",
+        "workers",
+        "incremental",
+        "refresh_metadata",
     ],
 )
 FieldNamesMsgFile = ["contact_email", "contact_name", "pkg_type", "checker_type", "msg"]
@@ -230,17 +241,55 @@ def get_config(config, section, option, required=False, fallback=None):
     return value
 
 
-def _get_organizations_with_parents(ogdremote):
+def get_config_int(config, section, option, fallback=None):
+    value = get_config(config, section, option)
+    if not value:
+        return fallback
+    try:
+        return int(value)
+    except ValueError:
+        raise click.UsageError(
+            f"Configuration value for '[{section}] {option}' must be an integer."
+        )
+
+
+def get_config_bool(config, section, option, fallback=False):
+    value = get_config(config, section, option)
+    if not value:
+        return fallback
+    if value.lower() in ["1", "yes", "true", "on"]:
+        return True
+    if value.lower() in ["0", "no", "false", "off"]:
+        return False
+    raise click.UsageError(
+        f"Configuration value for '[{section}] {option}' must be a boolean."
+    )
+
+
+def get_cached_metadata(metadata_cache, key, fetch):
+    if metadata_cache is None:
+        return fetch()
+    return metadata_cache.get(key, fetch)
+
+
+def _get_organizations_with_parents(ogdremote, metadata_cache=None):
+    organization_tree = get_cached_metadata(
+        metadata_cache, "group_tree", lambda: _get_organization_tree(ogdremote)
+    )
+    if organization_tree is None:
+        return {}
+    return _get_organization_dict_with_parents(organization_tree)
+
+
+def _get_organization_tree(ogdremote):
     try:
-        organization_tree = ogdremote.action.group_tree(
+        return ogdremote.action.group_tree(
             type="organization",
         )
-        return _get_organization_dict_with_parents(organization_tree)
     except ckanapi.errors.NotFound:
         log_and_echo_msg(f"Organization tree was not found.")
     except ckanapi.errors.CKANAPIError:
         log_and_echo_msg(f"CKAN Api Error at retrival of organization tree")
-    return {}
 
 
 def _get_organization_dict_with_parents(organization_tree):
@@ -256,7 +305,15 @@ def _get_organization_dict_with_parents(organization_tree):
     return organizations_with_parents
 
 
-def _get_organization_admin_userids(ogdremote, organization_name):
+def _get_organization_admin_userids(ogdremote, organization_name, metadata_cache=None):
+    return get_cached_metadata(
+        metadata_cache,
+        f"member_list:{organization_name}",
+        lambda: _request_organization_admin_userids(ogdremote, organization_name),
+    )
+
+
+def _request_organization_admin_userids(ogdremote, organization_name):
     try:
         result = ogdremote.action.member_list(
             id=organization_name, object_type="user", capacity="admin"
@@ -268,25 +325,77 @@ def _get_organization_admin_userids(ogdremote, organization_name):
         log_and_echo_msg(f"CKAN Api Error for Organization: {organization_name}")
 
 
-def _get_organization_admin_emails(ogdremote, userids):
+def _get_organization_admin_emails(ogdremote, userids, metadata_cache=None):
     useremails = []
     for userid in userids:
-        try:
-            result = ogdremote.action.user_show(id=userid)
-            email = result.get("email")
-            if email:
-                useremails.append(email)
-        except ckanapi.errors.NotFound:
-            log_and_echo_msg(f"No organization found for id: {userid}")
-        except ckanapi.errors.CKANAPIError:
-            log_and_echo_msg(f"CKAN Api Error for Organization: {userid}")
+        email = get_cached_metadata(
+            metadata_cache,
+            f"user_show:{userid}",
+            lambda: _request_user_email(ogdremote, userid),
+        )
+        if email:
+            useremails.append(email)
     return useremails
 
 
-def set_up_contact_mapping(config, ogdremote):
-    organization_with_parents = _get_organizations_with_parents(ogdremote)
+def _request_user_email(ogdremote, userid):
+    try:
+        result = ogdremote.action.user_show(id=userid)
+        return result.get("email") or ""
+    except ckanapi.errors.NotFound:
+        log_and_echo_msg(f"No organization found for id: {userid}")
+    except ckanapi.errors.CKANAPIError:
+        log_and_echo_msg(f"CKAN Api Error for Organization: {userid}")
+
+
+def _get_organization_admin_contacts(
+    ogdremote, organization_name, parents, metadata_cache=None
+):
+    """Get the emails of the admins of an organization or of its parent
+
+    Returns None if neither the organization nor its parent has admins.
+    """
+    organization_admin_userids = _get_organization_admin_userids(
+        ogdremote, organization_name, metadata_cache
+    )
+    if not organization_admin_userids and parents:
+        organization_admin_userids = _get_organization_admin_userids(
+            ogdremote, parents[0], metadata_cache
+        )
+    if not organization_admin_userids:
+        return None
+    return _get_organization_admin_emails(
+        ogdremote, organization_admin_userids, metadata_cache
+    )
+
+
+def set_up_contact_mapping(config, ogdremote, metadata_cache=None, workers=1):
+    organization_with_parents = _get_organizations_with_parents(
+        ogdremote, metadata_cache
+    )
     contact_dict = _get_contacts_from_file(config)
     dcat_admin_email = get_config(config, "emailsender", "dcat_admin", required=True)
+    # the admins of the organizations are requested in parallel
+    organization_names = [
+        organization_name
+        for organization_name in organization_with_parents
+        if ContactKey(organization_name, DCAT) not in contact_dict
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        organization_admin_contacts = dict(
+            zip(
+                organization_names,
+                executor.map(
+                    lambda organization_name: _get_organization_admin_contacts(
+                        ogdremote,
+                        organization_name,
+                        organization_with_parents[organization_name],
+                        metadata_cache,
+                    ),
+                    organization_names,
+                ),
+            )
+        )
     for organization_name in organization_with_parents:
         log_and_echo_msg(f"processing {organization_name}")
         dcat_contact_key = ContactKey(organization_name, DCAT)
@@ -294,23 +403,8 @@ def set_up_contact_mapping(config, ogdremote):
         if dcat_contact_key in contact_dict:
             log_and_echo_msg(f"-> was in file {contact_dict[dcat_contact_key]}")
             continue
-        organization_admin_userids = _get_organization_admin_userids(
-            ogdremote,
-            organization_name,
-        )
-        if (
-            not organization_admin_userids
-            and organization_with_parents[organization_name]
-        ):
-            organization_admin_userids = _get_organization_admin_userids(
-                ogdremote,
-                organization_with_parents[organization_name][0],
-            )
-        if organization_admin_userids:
-            organization_admin_emails = _get_organization_admin_emails(
-                ogdremote,
-                organization_admin_userids,
-            )
+        organization_admin_emails = organization_admin_contacts[organization_name]
+        if organization_admin_emails is not None:
             contact_dict[dcat_contact_key] = organization_admin_emails
             log_and_echo_msg(
                 f"-> got contacts {dcat_contact_key} {contact_dict[dcat_contact_key]}"
@@ -369,28 +463,84 @@ def log_and_echo_msg(msg, error=False):
     click.echo(f"{msg}")
 
 
+class QueuedCsvWriter:
+    """csv.DictWriter that writes its rows in one writer thread
+
+    Checker workers can hand over rows from several threads: the rows are
+    written to the csv file in the order they were handed over.
+    """
+
+    def __init__(self, csvfile, fieldnames, queue_size=1000):
+        self._writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._write_rows, daemon=True)
+        self._thread.start()
+
+    def writeheader(self):
+        self._queue.put([dict(zip(self._writer.fieldnames, self._writer.fieldnames))])
+
+    def writerow(self, row):
+        self._queue.put([row])
+
+    def writerows(self, rows):
+        self._queue.put(list(rows))
+
+    def close(self):
+        """Write the remaining rows and stop the writer thread"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_rows(self):
+        while True:
+            rows = self._queue.get()
+            if rows is None:
+                return
+            self._writer.writerows(rows)
+
+
 def get_pkg_dcat_serialization_url(siteurl, name):
     return siteurl + "/dataset/" + name + ".rdf"
 
 
-def get_harvest_source_url(pkg, dcat_harvesters):
-    log_and_echo_msg(f"Extras: {pkg.get('extras')}")
+def get_harvest_source_id(pkg):
     harvester_source_id = [
         item["value"]
         for item in pkg.get("extras", [])
         if item["key"] == "harvest_source_id"
     ]
+    if not harvester_source_id:
+        return None
+    return harvester_source_id[0]
+
+
+def get_harvest_source_url(pkg, dcat_harvesters):
+    log_and_echo_msg(f"Extras: {pkg.get('extras')}")
+    harvester_source_id = get_harvest_source_id(pkg)
     if not harvester_source_id:
         log_and_echo_msg("No harvest_source_id found in package extras.")
         return None
-    harvest_source_url = dcat_harvesters.get(harvester_source_id[0])
+    harvest_source_url = dcat_harvesters.get(harvester_source_id)
     if not harvest_source_url:
         return None
     return harvest_source_url
 
 
 def set_runparms(
-    org, limit, pkg, run, configpath, build, send, mode, test, harvestertype=None
+    org,
+    limit,
+    pkg,
+    run,
+    configpath,
+    build,
+    send,
+    mode,
+    test,
+    harvestertype=None,
+    link_cache=True,
+    clear_link_cache=False,
+    workers=1,
+    incremental=False,
+    refresh_metadata=False,
 ):
     config = configparser.ConfigParser()
     config.read(configpath)
@@ -405,6 +555,12 @@ def set_runparms(
         raise click.UsageError(
             "Only one of the options --org, --limit, " "--pkg can be used."
         )
+    if workers < 1:
+        raise click.UsageError("--workers must be at least 1.")
+    if incremental and mode == MODE_LINK and (nr_scope_options or harvestertype):
+        raise click.UsageError(
+            "--incremental can only be used for all datasets in link mode."
+        )
     check = False
     if run:
         if nr_scope_options or mode:
@@ -450,6 +606,11 @@ def set_runparms(
         send=send,
         test=test,
         harvester_type=harvestertype,
+        link_cache=link_cache,
+        clear_link_cache=clear_link_cache,
+        workers=workers,
+        incremental=incremental,
+        refresh_metadata=refresh_metadata,
     )
     logdir = get_logdir(rundir)
     loglevel = get_config(config, "logging", "level", fallback="INFO")
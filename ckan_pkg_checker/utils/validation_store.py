@@ -0,0 +1,62 @@
+import json
+import sqlite3
+import threading
+import time
+
+from ckan_pkg_checker.utils.rdf_utils import ShaclResult
+
+
+class ValidationResultStore:
+    """Stores the shacl results of each package across runs in a sqlite database
+
+    The results of a package are stored with the hash of its dataset graph
+    and the hash of the shapes and ontology files. They are only returned
+    as long as both hashes are unchanged, otherwise the dataset needs to be
+    validated again.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS validation_results ("
+                "name TEXT PRIMARY KEY, metadata_modified TEXT, "
+                "graph_hash TEXT, shapes_hash TEXT, results TEXT, checked_at REAL)"
+            )
+
+    def get(self, name, graph_hash, shapes_hash):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT results FROM validation_results "
+                "WHERE name = ? AND graph_hash = ? AND shapes_hash = ?",
+                (name, graph_hash, shapes_hash),
+            ).fetchone()
+        if row:
+            return [ShaclResult(*result) for result in json.loads(row[0])]
+        return None
+
+    def put(self, name, metadata_modified, graph_hash, shapes_hash, results):
+        # the results are written to csv as strings, so they are stored as such
+        results = [
+            [None if field is None else str(field) for field in result]
+            for result in results
+        ]
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO validation_results "
+                "(name, metadata_modified, graph_hash, shapes_hash, results, "
+                "checked_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    name,
+                    metadata_modified,
+                    graph_hash,
+                    shapes_hash,
+                    json.dumps(results),
+                    time.time(),
+                ),
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -84,6 +84,46 @@ log = logging.getLogger(__name__)
     "Example: --harvestertype geocat, or --harvestertype dcat."
     "By default both harvester types will be checked.",
 )
+@click.option(
+    "--link-cache/--no-link-cache",
+    default=True,
+    help="Use the url cache of previous link checker runs. "
+    "Example: --no-link-cache."
+    "By default urls that were ok in a previous run are taken from the cache.",
+)
+@click.option(
+    "--clear-link-cache",
+    is_flag=True,
+    default=False,
+    help="Clear the url cache of the link checker before the run. "
+    "Example: --clear-link-cache.",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes that validate datasets in parallel in shacl mode. "
+    "Example: --workers 8."
+    "By default the datasets are validated in the main process.",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Only check what changed since the previous run. "
+    "In shacl mode the results of unchanged datasets are taken from the previous run, "
+    "in link mode only the datasets modified since the previous run are requested. "
+    "Example: --incremental.",
+)
+@click.option(
+    "--refresh-metadata",
+    is_flag=True,
+    default=False,
+    help="Request the harvest sources, organizations and organization admins "
+    "again instead of taking them from the metadata cache. "
+    "Example: --refresh-metadata.",
+)
 def check_packages(
     limit=None,
     pkg=None,
@@ -95,6 +135,11 @@ def check_packages(
     test=False,
     harvestertype=None,
     mode=MODE_SHACL,
+    link_cache=True,
+    clear_link_cache=False,
+    workers=1,
+    incremental=False,
+    refresh_metadata=False,
 ):
     """Checks data packages of a opendata.swiss
     ---------------------------------------
@@ -127,6 +172,11 @@ def check_packages(
         test=test,
         harvestertype=harvestertype,
         mode=mode,
+        link_cache=link_cache,
+        clear_link_cache=clear_link_cache,
+        workers=workers,
+        incremental=incremental,
+        refresh_metadata=refresh_metadata,
     )
 
     if runparms.check:
@@ -140,6 +190,11 @@ def check_packages(
             pkg=runparms.pkg,
             org=runparms.org,
             harvester_type=runparms.harvester_type,
+            link_cache=runparms.link_cache,
+            clear_link_cache=runparms.clear_link_cache,
+            workers=runparms.workers,
+            incremental=runparms.incremental,
+            refresh_metadata=runparms.refresh_metadata,
         )
         check.run()
     if runparms.build:
@@ -0,0 +1,88 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ckan_pkg_checker.utils import utils
+
+CATALOG = """<?xml version="1.0" encoding="utf-8"?>
+<rdf:RDF
+    xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+    xmlns:dcat="http://www.w3.org/ns/dcat#"
+    xmlns:dct="http://purl.org/dc/terms/">
+  <dcat:Catalog rdf:about="https://example.org/catalog">
+    <dcat:dataset>
+      <dcat:Dataset rdf:about="https://example.org/dataset/1">
+        <dct:identifier>dataset-1@org</dct:identifier>
+        <dct:title xml:lang="de">Datensatz 1</dct:title>
+        <dcat:distribution>
+          <dcat:Distribution rdf:about="https://example.org/distribution/1">
+            <dct:title xml:lang="de">Distribution 1</dct:title>
+          </dcat:Distribution>
+        </dcat:distribution>
+      </dcat:Dataset>
+    </dcat:dataset>
+    <dcat:dataset>
+      <dcat:Dataset rdf:about="https://example.org/dataset/2">
+        <dct:identifier>dataset-2@org</dct:identifier>
+        <dct:title xml:lang="de">Datensatz 2</dct:title>
+      </dcat:Dataset>
+    </dcat:dataset>
+  </dcat:Catalog>
+</rdf:RDF>
+"""
+
+NR_CALLERS = 10
+
+
+def call_at_once(fn, nr_callers=NR_CALLERS):
+    """Call fn from nr_callers threads that start at the same moment"""
+    barrier = threading.Barrier(nr_callers)
+
+    def call():
+        barrier.wait()
+        return fn()
+
+    with ThreadPoolExecutor(max_workers=nr_callers) as executor:
+        futures = [executor.submit(call) for _ in range(nr_callers)]
+    return futures
+
+
+DEFAULT_EMAIL = "admin@org.ch"
+FIELDNAMES = [
+    "contact_email",
+    "contact_name",
+    "organization_name",
+    "dataset_title",
+    "dataset_url",
+    "node",
+    "property",
+    "value",
+    "severity",
+    "error_msg",
+    "pkg_type",
+    "checker_type",
+    "template",
+]
+
+
+def build_mails_per_row(rows, mailpath):
+    """The mails as they were built before: one file open per row and contact"""
+    default_contact = utils.Contact(name="Default", email=DEFAULT_EMAIL)
+    for row in rows:
+        contacts = [utils.Contact(email=row["contact_email"], name=row["contact_name"])]
+        if default_contact.email not in [contact.email for contact in contacts]:
+            contacts.append(default_contact)
+        for contact in contacts:
+            mailfile = os.path.join(
+                mailpath, row["pkg_type"] + "#" + contact.email + ".html"
+            )
+            msg = ""
+            if not os.path.isfile(mailfile):
+                msg += utils.build_msg_per_contact(
+                    receiver_name=contact.name,
+                    checker_type=row["checker_type"],
+                    pkg_type=row["pkg_type"],
+                )
+            msg += utils.build_msg_per_error(row)
+            with open(mailfile, "a") as writemail:
+                writemail.write(msg)
@@ -0,0 +1,109 @@
+import gzip
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class LocalRequestHandler(BaseHTTPRequestHandler):
+    """Answers with the status code that is requested by the path
+
+    - /ok: 200
+    - /notfound: 404
+    - /nohead: 405 for HEAD, 200 for GET
+    - /getonly: 404 for HEAD, 200 for GET
+    - /error: 500
+    - /redirect: 302 to /ok
+    - /slow: 200 after half a second
+    - /etag: 200 with an ETag, 304 if the ETag is sent in If-None-Match
+    - /catalog: the catalog of the server as /etag does, gzip compressed if
+      the client accepts it
+    - /notmodified: 304 without a conditional request
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self._respond(body=False)
+
+    def do_GET(self):
+        self._respond(body=True)
+
+    def _respond(self, body):
+        self.server.record(self)
+        path = self.path.split("?")[0]
+        status, headers = 200, {}
+        if path == "/notfound":
+            status = 404
+        elif path == "/nohead" and self.command == "HEAD":
+            status = 405
+        elif path == "/getonly" and self.command == "HEAD":
+            status = 404
+        elif path == "/error":
+            status = 500
+        elif path == "/redirect":
+            status, headers = 302, {"Location": "/ok"}
+        elif path == "/slow":
+            time.sleep(0.5)
+        elif path == "/notmodified":
+            status = 304
+        elif path == "/etag":
+            headers = {"ETag": ETAG}
+            if self.headers.get("If-None-Match") == ETAG:
+                status = 304
+        content = b"0123456789" * 10
+        if path == "/catalog":
+            headers = {"ETag": ETAG, "Last-Modified": LAST_MODIFIED}
+            if self.headers.get("If-None-Match") == ETAG:
+                status = 304
+            content = self.server.catalog
+            if "gzip" in self.headers.get("Accept-Encoding", ""):
+                headers["Content-Encoding"] = "gzip"
+                content = gzip.compress(content)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if body and status != 304:
+            self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer(ThreadingHTTPServer):
+    """Local http server that records the requests it receives"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), LocalRequestHandler)
+        self.requests = []
+        self.accept_headers = []
+        self.connections = set()
+        self.catalog = b""
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+
+    def record(self, handler):
+        with self._lock:
+            self.requests.append((handler.command, handler.path))
+            self.accept_headers.append(handler.headers.get("Accept"))
+            self.connections.add(handler.client_address)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,169 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from ckan_pkg_checker.utils import async_request_utils, request_utils
+from ckan_pkg_checker.utils.link_metrics import LinkMetrics
+from tests.local_server import ETAG, LocalServer
+
+
+class TestAsyncUrlChecker(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalServer().__enter__()
+        self.checker = async_request_utils.AsyncUrlChecker(max_connections=50)
+
+    def tearDown(self):
+        self.checker.close()
+        self.server.__exit__()
+
+    def _check_url(self, path):
+        return (
+            self.checker.submit(
+                self.checker.check_url_with_validators(self.server.url(path))
+            )
+            .result()
+            .error
+        )
+
+    def test_same_errors_as_request_utils(self):
+        for path in ["/ok", "/notfound", "/nohead", "/error", "/redirect", "/slow"]:
+            with self.subTest(path=path):
+                self.assertEqual(
+                    self._check_url(path),
+                    request_utils.check_url(self.server.url(path)),
+                )
+
+    def test_not_found(self):
+        self.assertEqual(
+            self._check_url("/notfound"),
+            "Failed to load resource: the server responded with a status of 404 "
+            "(Not Found)",
+        )
+        # both user agents with HEAD, then both with GET
+        self.assertEqual(
+            [method for method, _ in self.server.requests],
+            ["HEAD", "HEAD", "GET", "GET"],
+        )
+
+    def test_method_not_allowed_is_ignored(self):
+        self.assertIsNone(self._check_url("/nohead"))
+        self.assertEqual(self.server.requests, [("HEAD", "/nohead")])
+
+    def test_server_error(self):
+        url = self.server.url("/error")
+        self.assertEqual(
+            self._check_url("/error"),
+            f"500 Server Error: Internal Server Error for url: {url}",
+        )
+
+    def test_metrics_record_the_content_length(self):
+        metrics = LinkMetrics()
+        checker = async_request_utils.AsyncUrlChecker(metrics=metrics)
+        self.addCleanup(checker.close)
+        checker.submit(
+            checker.check_url_with_validators(self.server.url("/ok"))
+        ).result()
+        [host_requests] = metrics._host_requests.values()
+        self.assertEqual([metric.size for metric in host_requests], [100])
+
+    def test_redirect_is_not_followed_by_head(self):
+        self.assertIsNone(self._check_url("/redirect"))
+        self.assertEqual(self.server.requests, [("HEAD", "/redirect")])
+
+    def test_connection_error(self):
+        self.server.__exit__()
+        self.assertTrue(self._check_url("/ok"))
+
+    def test_hosts_that_reject_head_are_checked_with_get(self):
+        for index in range(3):
+            self.assertIsNone(self._check_url(f"/getonly?{index}"))
+        self.assertEqual(
+            [method for method, _ in self.server.requests],
+            ["HEAD", "HEAD", "GET", "GET", "GET"],
+        )
+
+    def test_unreachable_url_is_requested_once(self):
+        self.server.__exit__()
+        with mock.patch.object(
+            self.checker.session, "request", wraps=self.checker.session.request
+        ) as request:
+            self.assertTrue(self._check_url("/ok"))
+        self.assertEqual(request.call_count, 1)
+
+    def test_timeout(self):
+        self.checker.close()
+        self.checker = async_request_utils.AsyncUrlChecker(
+            strategy=request_utils.HostStrategy(read_timeout=0.1)
+        )
+        self.assertIn("for url", self._check_url("/slow"))
+
+    def test_check_url_with_validators(self):
+        url_check = self.checker.submit(
+            self.checker.check_url_with_validators(self.server.url("/etag"))
+        ).result()
+        self.assertEqual(url_check, request_utils.UrlCheck(None, ETAG, None))
+
+    def test_revalidate_url(self):
+        self.assertTrue(
+            self.checker.submit(
+                self.checker.revalidate_url(
+                    self.server.url("/etag"), etag=ETAG, last_modified=None
+                )
+            ).result()
+        )
+        self.assertFalse(
+            self.checker.submit(
+                self.checker.revalidate_url(
+                    self.server.url("/notfound"), etag=ETAG, last_modified=None
+                )
+            ).result()
+        )
+
+    def test_slow_urls_are_checked_concurrently(self):
+        start = time.monotonic()
+        futures = [
+            self.checker.submit(
+                self.checker.check_url_with_validators(self.server.url(f"/slow?{i}"))
+            )
+            for i in range(20)
+        ]
+        self.assertEqual([future.result().error for future in futures], [None] * 20)
+        # each slow url takes half a second
+        self.assertLess(time.monotonic() - start, 3)
+
+
+class TestAsyncHostLimiter(unittest.TestCase):
+    def test_limits_connections_per_host(self):
+        limiter = async_request_utils.AsyncHostLimiter(max_connections=2)
+        active = {"example.org": 0, "other.org": 0}
+        maximum = {"example.org": 0, "other.org": 0}
+
+        async def request(host):
+            async with limiter.limit(f"https://{host}/path"):
+                active[host] += 1
+                maximum[host] = max(maximum[host], active[host])
+                await asyncio.sleep(0.01)
+                active[host] -= 1
+
+        async def requests():
+            await asyncio.gather(
+                *(request(host) for host in ["example.org", "other.org"] * 5)
+            )
+
+        asyncio.run(requests())
+        self.assertEqual(maximum, {"example.org": 2, "other.org": 2})
+
+    def test_spaces_requests_per_host(self):
+        limiter = async_request_utils.AsyncHostLimiter(
+            max_connections=5, min_interval=0.02
+        )
+
+        async def requests():
+            for _ in range(4):
+                async with limiter.limit("https://example.org/path"):
+                    pass
+
+        start = time.monotonic()
+        asyncio.run(requests())
+        self.assertGreaterEqual(time.monotonic() - start, 0.06)
@@ -0,0 +1,104 @@
+import configparser
+import csv
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import click
+
+from ckan_pkg_checker.email_builder import EmailBuilder
+from ckan_pkg_checker.utils import utils
+from tests.helpers import DEFAULT_EMAIL, FIELDNAMES, build_mails_per_row
+
+
+def get_test_rows():
+    contacts = [
+        ("person-1@org.ch", "Person 1"),
+        ("person-2@org.ch", "Person 2"),
+        (DEFAULT_EMAIL, "Admin"),
+    ]
+    return [
+        {
+            "contact_email": contacts[index % 3][0],
+            "contact_name": contacts[index % 3][1],
+            "organization_name": "org",
+            "dataset_title": f"Datensatz {index}",
+            "dataset_url": f"https://ckan.org/dataset/{index}",
+            "node": "",
+            "property": "dct:description",
+            "value": "",
+            "severity": "Violation",
+            "error_msg": f"description {index} is missing",
+            "pkg_type": utils.GEOCAT if index % 4 == 0 else utils.DCAT,
+            "checker_type": utils.MODE_SHACL,
+            "template": "shaclchecker_error.html",
+        }
+        for index in range(20)
+    ]
+
+
+class TestEmailBuilder(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.rundir = self.tmpdir / "run"
+        self.mailpath = utils.get_maildir(self.rundir)
+        self.mailpath.mkdir(parents=True)
+        utils.get_csvdir(self.rundir).mkdir(parents=True)
+        self.rows = get_test_rows()
+        with open(utils.get_csvdir(self.rundir) / "shaclchecker.csv", "w") as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _get_builder(self, **emailbuilder_options):
+        config = configparser.ConfigParser()
+        config.read_dict(
+            {
+                "shaclchecker": {
+                    "csvfile": "shaclchecker.csv",
+                    "statfile": "shaclstatistics.csv",
+                },
+                "contacts": {"statsfile": "contactstats.csv"},
+                "emailbuilder": {
+                    "default_name": "Default",
+                    "default_email": DEFAULT_EMAIL,
+                    **emailbuilder_options,
+                },
+            }
+        )
+        return EmailBuilder(rundir=self.rundir, mode=utils.MODE_SHACL, config=config)
+
+    def _read_mails(self, mailpath):
+        return {path.name: path.read_text() for path in Path(mailpath).iterdir()}
+
+    def test_mails_are_the_same_as_per_row(self):
+        expected_path = self.tmpdir / "expected"
+        expected_path.mkdir()
+        build_mails_per_row(self.rows, expected_path)
+        expected_mails = self._read_mails(expected_path)
+        self.assertEqual(len(expected_mails), 6)
+        # in memory and with the sorted chunks merged from temporary files
+        for sort_buffer_size in ["1000", "3"]:
+            with self.subTest(sort_buffer_size=sort_buffer_size):
+                self._get_builder(sort_buffer_size=sort_buffer_size)._build_mails()
+                self.assertEqual(self._read_mails(self.mailpath), expected_mails)
+                for path in self.mailpath.iterdir():
+                    path.unlink()
+
+    def test_existing_mail_is_continued_without_header(self):
+        mailfile = self.mailpath / f"{utils.DCAT}#person-1@org.ch.html"
+        mailfile.write_text("previous mail\n")
+        self._get_builder()._build_mails()
+        mail = mailfile.read_text()
+        self.assertTrue(mail.startswith("previous mail\n<p>-----</p>"))
+        self.assertNotIn("Person 1", mail)
+
+    def test_sort_buffer_size_below_one_is_rejected(self):
+        for sort_buffer_size in ["0", "-1"]:
+            with self.subTest(sort_buffer_size=sort_buffer_size):
+                with self.assertRaises(click.UsageError):
+                    self._get_builder(sort_buffer_size=sort_buffer_size)
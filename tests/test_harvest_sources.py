@@ -0,0 +1,47 @@
+import unittest
+from unittest import mock
+
+from ckan_pkg_checker.utils import utils
+from ckan_pkg_checker.utils.harvest_sources import HarvestSources
+
+
+def get_fake_ogdremote():
+    ogdremote = mock.Mock()
+    ogdremote.action.harvest_source_list.return_value = [
+        {"id": "dcat-id", "type": "dcat_ch_rdf", "url": "https://example.org/dcat"},
+        {"id": "geocat-id", "type": "geocat_harvester", "url": "https://geocat.ch"},
+    ]
+    return ogdremote
+
+
+def get_package(name, harvest_source_id):
+    return {
+        "name": name,
+        "extras": [{"key": "harvest_source_id", "value": harvest_source_id}],
+    }
+
+
+class TestHarvestSources(unittest.TestCase):
+    def test_packages_are_classified_with_one_lookup(self):
+        ogdremote = get_fake_ogdremote()
+        harvest_sources = HarvestSources(ogdremote)
+        pkgs = [
+            get_package("geocat-1", "geocat-id"),
+            get_package("geocat-2", "geocat-id"),
+            get_package("dcat-1", "dcat-id"),
+        ] * 10
+        self.assertEqual(
+            [harvest_sources.get_pkg_type(pkg) for pkg in pkgs[:3]],
+            [utils.GEOCAT, utils.GEOCAT, utils.DCAT],
+        )
+        self.assertEqual(
+            [harvest_sources.get_source_url(pkg) for pkg in pkgs[:3]],
+            [None, None, "https://example.org/dcat"],
+        )
+        for pkg in pkgs:
+            harvest_sources.get_pkg_type(pkg)
+            harvest_sources.get_source_url(pkg)
+        self.assertEqual(harvest_sources.geocat_harvester_ids, ["geocat-id"])
+        self.assertEqual(harvest_sources.dcat_harvester_ids, ["dcat-id"])
+        self.assertEqual(ogdremote.action.harvest_source_list.call_count, 1)
+        self.assertEqual(ogdremote.action.package_search.call_count, 0)
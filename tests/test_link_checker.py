@@ -0,0 +1,292 @@
+import configparser
+import csv
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from ckan_pkg_checker.checkers.link_checker import LinkChecker, link_checks
+from ckan_pkg_checker.utils import request_utils, utils
+from tests.helpers import call_at_once
+from tests.local_server import LocalServer
+
+BROKEN_URL_ERROR = (
+    "Failed to load resource: the server responded with a status of 404 (Not Found)"
+)
+
+
+def get_test_config(**linkchecker_options):
+    config = configparser.ConfigParser()
+    config.read_dict(
+        {
+            "linkchecker": {
+                "csvfile": "linkchecker.csv",
+                "statfile": "linkstatistics.csv",
+                **linkchecker_options,
+            },
+            "contacts": {"statsfile": "contactstats.csv"},
+        }
+    )
+    return config
+
+
+def get_test_package(name, urls):
+    return {
+        "name": name,
+        "title": {"de": f"Titel {name}"},
+        "url": urls[0],
+        "publisher": {"url": urls[1], "name": "Publisher"},
+        "organization": {"name": "org"},
+        "contact_points": [{"name": "Person", "email": "person@org.ch"}],
+        "resources": [
+            {
+                "id": f"{name}-{index}",
+                "url": url,
+                "display_name": {"de": url},
+            }
+            for index, url in enumerate(urls[2:])
+        ],
+    }
+
+
+def fake_check_url(test_url, **kwargs):
+    time.sleep(0.001)
+    if "broken" in test_url:
+        return request_utils.UrlCheck(BROKEN_URL_ERROR, None, None)
+    return request_utils.UrlCheck(None, '"etag"', None)
+
+
+class TestLinkChecker(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.rundir = self.tmpdir / "run"
+        utils.get_csvdir(self.rundir).mkdir(parents=True)
+        self.pkgs = [
+            get_test_package(
+                f"pkg-{index}",
+                [
+                    f"https://example.org/{index}/landing",
+                    "https://example.org/publisher",
+                    f"https://example.org/{index}/broken",
+                    f"https://other.org/{index % 3}/broken",
+                ],
+            )
+            for index in range(20)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _run_checker(self, config, **kwargs):
+        checker = LinkChecker(
+            rundir=self.rundir, config=config, siteurl="https://ckan.org", **kwargs
+        )
+        with mock.patch.object(
+            request_utils, "check_url_with_validators", side_effect=fake_check_url
+        ) as check_url:
+            for pkg in self.pkgs:
+                checker.check_package(pkg)
+            checker.finish()
+        with open(checker.csvfilepath) as csvfile:
+            return csvfile.read(), check_url.call_count
+
+    def test_concurrent_mode_writes_same_csv_as_sequential_mode(self):
+        sequential_csv, _ = self._run_checker(get_test_config(), use_cache=False)
+        concurrent_csv, _ = self._run_checker(
+            get_test_config(max_workers="8"), use_cache=False
+        )
+        self.assertEqual(sequential_csv, concurrent_csv)
+        self.assertEqual(sequential_csv.count(BROKEN_URL_ERROR), 40)
+
+    def test_url_cache_skips_urls_that_were_ok(self):
+        first_csv, first_checks = self._run_checker(get_test_config())
+        second_csv, second_checks = self._run_checker(get_test_config())
+        self.assertEqual(first_csv, second_csv)
+        # 20 landing pages, 1 publisher, 20 + 3 broken urls
+        self.assertEqual(first_checks, 44)
+        # only the broken urls are checked again
+        self.assertEqual(second_checks, 23)
+
+    def test_url_cache_revalidates_stale_urls(self):
+        self._run_checker(get_test_config())
+        with mock.patch.object(
+            request_utils, "revalidate_url", return_value=True
+        ) as revalidate_url:
+            _, checks = self._run_checker(get_test_config(cache_success_ttl_hours="-1"))
+        self.assertEqual(revalidate_url.call_count, 21)
+        self.assertEqual(checks, 23)
+
+    def _run_incremental_checker(self, pkgs, pkg_names):
+        checker = LinkChecker(
+            rundir=self.rundir,
+            config=get_test_config(max_workers="4"),
+            siteurl="https://ckan.org",
+            use_cache=False,
+            incremental=True,
+        )
+        with mock.patch.object(
+            request_utils, "check_url_with_validators", side_effect=fake_check_url
+        ) as check_url:
+            for pkg in pkgs:
+                checker.check_package(pkg)
+            checker.check_inventory(pkg_names, enrich_package=mock.Mock())
+            checker.finish()
+        with open(checker.csvfilepath) as csvfile:
+            return csvfile.read(), check_url.call_count
+
+    def test_incremental_mode_writes_results_from_inventory(self):
+        self.pkgs.sort(key=lambda pkg: pkg["name"])
+        pkg_names = {pkg["name"] for pkg in self.pkgs}
+        full_csv, _ = self._run_checker(get_test_config(), use_cache=False)
+        first_csv, first_checks = self._run_incremental_checker(self.pkgs, pkg_names)
+        self.assertEqual(first_csv, full_csv)
+        self.assertEqual(first_checks, 44)
+
+        # pkg-5 is modified and pkg-7 is deleted in ckan
+        self.pkgs[15]["url"] = "https://example.org/5/broken-landing"
+        modified_pkg = self.pkgs[15]
+        del self.pkgs[17]
+        pkg_names = {pkg["name"] for pkg in self.pkgs}
+        full_csv, _ = self._run_checker(get_test_config(), use_cache=False)
+        second_csv, second_checks = self._run_incremental_checker(
+            [modified_pkg], pkg_names
+        )
+        self.assertEqual(second_csv, full_csv)
+        self.assertEqual(second_checks, 42)
+
+    def test_clear_url_cache(self):
+        self._run_checker(get_test_config())
+        _, checks = self._run_checker(get_test_config(), clear_cache=True)
+        self.assertEqual(checks, 44)
+
+
+class TestLinkCheckerBackends(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.rundir = self.tmpdir / "run"
+        utils.get_csvdir(self.rundir).mkdir(parents=True)
+        self.server = LocalServer().__enter__()
+        paths = ["/ok", "/notfound", "/nohead", "/error", "/redirect", "/slow"]
+        self.pkgs = [
+            get_test_package(
+                f"pkg-{index}",
+                [self.server.url(f"{path}?{index}") for path in paths],
+            )
+            for index in range(5)
+        ]
+
+    def tearDown(self):
+        self.server.__exit__()
+        shutil.rmtree(self.tmpdir)
+
+    def _run_checker(self, config):
+        checker = LinkChecker(
+            rundir=self.rundir,
+            config=config,
+            siteurl="https://ckan.org",
+            use_cache=False,
+        )
+        for pkg in self.pkgs:
+            checker.check_package(pkg)
+        checker.finish()
+        with open(checker.csvfilepath) as csvfile:
+            return csvfile.read()
+
+    def test_url_is_checked_once_for_concurrent_packages(self):
+        checker = LinkChecker(
+            rundir=self.rundir,
+            config=get_test_config(),
+            siteurl="https://ckan.org",
+            use_cache=False,
+        )
+        url = self.server.url("/slow")
+        futures = call_at_once(lambda: checker._get_url_result(url))
+        checker.finish()
+        self.assertEqual([future.result() for future in futures], [None] * 10)
+        self.assertEqual(self.server.requests, [("HEAD", "/slow")])
+
+    def test_aiohttp_backend_writes_same_csv_as_requests_backend(self):
+        requests_csv = self._run_checker(get_test_config())
+        aiohttp_csv = self._run_checker(get_test_config(backend="aiohttp"))
+        self.assertEqual(requests_csv, aiohttp_csv)
+        self.assertEqual(requests_csv.count(BROKEN_URL_ERROR), 5)
+        self.assertEqual(requests_csv.count("500 Server Error"), 5)
+
+    def test_urls_of_unreachable_host_are_short_circuited(self):
+        self.server.__exit__()
+        for backend in ["requests", "aiohttp"]:
+            with self.subTest(backend=backend):
+                # one request at a time, so that the circuit is open before
+                # the third request
+                self._run_checker(
+                    get_test_config(
+                        backend=backend,
+                        circuit_breaker_failures="2",
+                        host_connections="1",
+                        metrics="true",
+                    )
+                )
+                with open(self.rundir / "csv" / "linkmetrics.json") as jsonfile:
+                    summary = json.load(jsonfile)
+                # 5 packages with 6 urls, the first 2 are requested
+                self.assertEqual(summary["short_circuited_urls"], 28)
+                with open(self.rundir / "csv" / "linkstatistics.csv") as statfile:
+                    statistics = list(csv.DictReader(statfile))
+                self.assertEqual([row["message"] for row in statistics], link_checks)
+
+    def test_metrics(self):
+        for backend in ["requests", "aiohttp"]:
+            with self.subTest(backend=backend):
+                self._run_checker(get_test_config(backend=backend, metrics="true"))
+                with open(self.rundir / "csv" / "linkmetrics.json") as jsonfile:
+                    summary = json.load(jsonfile)
+                self.assertEqual(summary["urls"], 30)
+                # /notfound and /error are requested with both user agents
+                # and both methods
+                self.assertEqual(summary["methods"], {"HEAD": 40, "GET": 20})
+                host = self.server.url("")[len("http://") :]
+                self.assertEqual(summary["hosts"][host]["count"], 60)
+                self.assertGreaterEqual(summary["requests"]["p99_s"], 0.5)
+                self.assertEqual(
+                    set(summary["test_titles"]),
+                    {"dcat:landingPage", "dct:publisher", "dcat:accessURL"},
+                )
+
+
+class TestHostLimiter(unittest.TestCase):
+    def test_limits_connections_per_host(self):
+        limiter = request_utils.HostLimiter(max_connections=2)
+        active = {"example.org": 0, "other.org": 0}
+        maximum = {"example.org": 0, "other.org": 0}
+        lock = threading.Lock()
+
+        def request(host):
+            with limiter.limit(f"https://{host}/path"):
+                with lock:
+                    active[host] += 1
+                    maximum[host] = max(maximum[host], active[host])
+                time.sleep(0.01)
+                with lock:
+                    active[host] -= 1
+
+        threads = [
+            threading.Thread(target=request, args=(host,))
+            for host in ["example.org", "other.org"] * 5
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(maximum, {"example.org": 2, "other.org": 2})
+
+    def test_spaces_requests_per_host(self):
+        limiter = request_utils.HostLimiter(max_connections=5, min_interval=0.02)
+        start = time.monotonic()
+        for _ in range(4):
+            with limiter.limit("https://example.org/path"):
+                pass
+        self.assertGreaterEqual(time.monotonic() - start, 0.06)
@@ -0,0 +1,88 @@
+import csv
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from ckan_pkg_checker.utils import request_utils
+from ckan_pkg_checker.utils.link_metrics import LinkMetrics, get_percentile
+
+
+class TestLinkMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.metrics = LinkMetrics()
+        for index in range(1, 101):
+            self.metrics.record_request(
+                "https://example.org/path",
+                "HEAD",
+                "Custom",
+                status=200,
+                failure=None,
+                duration=index / 100,
+                size=10,
+            )
+        self.metrics.record_request(
+            "https://slow.org/path",
+            "GET",
+            "Custom",
+            status=None,
+            failure=request_utils.TIMED_OUT,
+            duration=30,
+            dns=0.1,
+            connect=0.2,
+        )
+        self.metrics.record_url("https://example.org/path", 0.5)
+        self.metrics.record_url("https://slow.org/path", 30)
+        self.metrics.record_url("https://cached.org/path")
+        self.metrics.record_reference("dcat:landingPage", "https://example.org/path")
+        self.metrics.record_reference("dcat:accessURL", "https://slow.org/path")
+        self.metrics.record_reference("dcat:accessURL", "https://cached.org/path")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(get_percentile(values, 50), 50)
+        self.assertEqual(get_percentile(values, 99), 99)
+        self.assertEqual(get_percentile([7], 95), 7)
+        self.assertIsNone(get_percentile([], 50))
+
+    def test_summary(self):
+        summary = self.metrics.get_summary()
+        self.assertEqual(summary["urls"], 3)
+        self.assertEqual(summary["cached_urls"], 1)
+        self.assertEqual(summary["requests"]["count"], 101)
+        self.assertEqual(summary["requests"]["timeouts"], 1)
+        self.assertEqual(summary["requests"]["max_s"], 30)
+        self.assertEqual(summary["requests"]["bytes"], 1000)
+        self.assertEqual(summary["methods"], {"HEAD": 100, "GET": 1})
+        self.assertEqual(summary["statuses"], {"200": 100, "None": 1})
+        self.assertEqual(summary["dns_s"]["p50_s"], 0.1)
+        self.assertEqual(summary["hosts"]["example.org"]["p95_s"], 0.95)
+        self.assertEqual(
+            [host["host"] for host in summary["slowest_hosts"]],
+            ["slow.org", "example.org"],
+        )
+        self.assertEqual(summary["test_titles"]["dcat:accessURL"]["count"], 2)
+        self.assertEqual(summary["test_titles"]["dcat:accessURL"]["p50_s"], 30)
+
+    def test_write(self):
+        self.metrics.write(self.tmpdir / "metrics.csv", self.tmpdir / "metrics.json")
+        with open(self.tmpdir / "metrics.csv") as csvfile:
+            rows = list(csv.DictReader(csvfile))
+        self.assertEqual(
+            [(row["scope"], row["name"]) for row in rows],
+            [
+                ("run", "all"),
+                ("host", "example.org"),
+                ("host", "slow.org"),
+                ("test_title", "dcat:accessURL"),
+                ("test_title", "dcat:landingPage"),
+            ],
+        )
+        self.assertEqual(rows[2]["timeouts"], "1")
+        with open(self.tmpdir / "metrics.json") as jsonfile:
+            self.assertEqual(json.load(jsonfile)["urls"], 3)
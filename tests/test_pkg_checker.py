@@ -0,0 +1,141 @@
+import unittest
+from unittest import mock
+
+from ckan_pkg_checker import pkg_checker
+from ckan_pkg_checker.pkg_checker import PackageCheck
+
+
+def get_package_check(nr_pkgs, fetch_workers=3):
+    """PackageCheck with a fake ckan that has nr_pkgs datasets"""
+    names = sorted(f"pkg-{index:04d}" for index in range(nr_pkgs))
+
+    def package_search(fq, rows, start, sort, **params):
+        return {
+            "count": nr_pkgs,
+            "results": [{"name": name} for name in names[start : start + rows]],
+        }
+
+    check = PackageCheck.__new__(PackageCheck)
+    check.fetch_workers = fetch_workers
+    check.ogdremote = mock.Mock()
+    check.ogdremote.action.package_search.side_effect = package_search
+    return check, names
+
+
+class TestSearchPackages(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(pkg_checker, "SEARCH_ROWS", 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_search_packages_streams_all_pages_in_order(self):
+        check, names = get_package_check(nr_pkgs=95)
+        count, pkgs = check._search_packages(fq="dataset_type:dataset")
+        self.assertEqual(count, 95)
+        self.assertEqual([pkg["name"] for pkg in pkgs], names)
+        self.assertEqual(check.ogdremote.action.package_search.call_count, 10)
+
+    def test_search_packages_with_limit(self):
+        check, names = get_package_check(nr_pkgs=95)
+        count, pkgs = check._search_packages(fq="dataset_type:dataset", limit=25)
+        self.assertEqual(count, 25)
+        self.assertEqual([pkg["name"] for pkg in pkgs], names[:25])
+        self.assertEqual(check.ogdremote.action.package_search.call_count, 3)
+
+    def test_get_packages_modified_since(self):
+        check, names = get_package_check(nr_pkgs=5)
+        check.harvester_type = None
+        count, pkgs = check._get_packages(modified_since="2024-05-01T12:34:56.789012")
+        self.assertEqual(count, 5)
+        self.assertEqual(
+            check.ogdremote.action.package_search.call_args.kwargs["fq"],
+            "dataset_type:dataset AND " "metadata_modified:[2024-05-01T12:34:56Z TO *]",
+        )
+
+    def test_search_packages_without_results(self):
+        check, _ = get_package_check(nr_pkgs=0)
+        count, pkgs = check._search_packages(fq="dataset_type:dataset")
+        self.assertEqual(count, 0)
+        self.assertEqual(list(pkgs), [])
+
+
+class FakeChecker:
+    def __init__(self, fail_on=None):
+        self.checked = []
+        self.finished = False
+        self.fail_on = fail_on
+        self.prefetched = []
+
+    def prefetch(self, pkg):
+        self.prefetched.append(pkg["name"])
+
+    def check_package(self, pkg):
+        if pkg["name"] == self.fail_on:
+            raise ValueError("check failed")
+        self.checked.append(pkg["name"])
+
+    def finish(self):
+        self.finished = True
+
+
+class TestRunPipeline(unittest.TestCase):
+    def _get_package_check(self, pkgs, checker, check_workers):
+        check = PackageCheck.__new__(PackageCheck)
+        check.pkgs = iter(pkgs)
+        check.pkgs_count = len(pkgs)
+        check.check_workers = check_workers
+        check.queue_size = 5
+        check.active_checkers = [checker]
+        check.incremental_links = False
+        check.metadata_cache = mock.Mock()
+        check._enrich_package = mock.Mock()
+        return check
+
+    def test_run_checks_datasets_in_order_with_one_worker(self):
+        pkgs = [{"name": f"pkg-{index}", "type": "dataset"} for index in range(30)]
+        pkgs.append({"name": "harvest-source", "type": "harvest"})
+        checker = FakeChecker()
+        check = self._get_package_check(pkgs, checker, check_workers=1)
+        check.run()
+        self.assertEqual(checker.checked, [pkg["name"] for pkg in pkgs[:30]])
+        self.assertEqual(checker.prefetched, checker.checked)
+        self.assertTrue(checker.finished)
+
+    def test_run_checks_all_datasets_with_several_workers(self):
+        pkgs = [{"name": f"pkg-{index}", "type": "dataset"} for index in range(30)]
+        checker = FakeChecker(fail_on="pkg-3")
+        check = self._get_package_check(pkgs, checker, check_workers=4)
+        check.run()
+        self.assertEqual(
+            sorted(checker.checked),
+            sorted(pkg["name"] for pkg in pkgs if pkg["name"] != "pkg-3"),
+        )
+        self.assertTrue(checker.finished)
+
+    def test_run_continues_after_a_package_that_cannot_be_prepared(self):
+        pkgs = [{"name": f"pkg-{index}", "type": "dataset"} for index in range(5)]
+        checker = FakeChecker()
+        check = self._get_package_check(pkgs, checker, check_workers=2)
+
+        def enrich_package(pkg):
+            if pkg["name"] == "pkg-1":
+                raise KeyError("extras")
+
+        check._enrich_package = mock.Mock(side_effect=enrich_package)
+        check.run()
+        self.assertEqual(sorted(checker.checked), ["pkg-0", "pkg-2", "pkg-3", "pkg-4"])
+        self.assertTrue(checker.finished)
+
+    def test_run_checks_inventory_in_incremental_link_mode(self):
+        pkgs = [{"name": f"pkg-{index}", "type": "dataset"} for index in range(3)]
+        checker = FakeChecker()
+        checker.check_inventory = mock.Mock()
+        check = self._get_package_check(pkgs, checker, check_workers=1)
+        check.incremental_links = True
+        check.ogdremote = mock.Mock()
+        check.ogdremote.action.package_list.return_value = ["pkg-0", "pkg-1"]
+        check.run()
+        checker.check_inventory.assert_called_once_with(
+            {"pkg-0", "pkg-1"}, check._enrich_package
+        )
+        self.assertTrue(checker.finished)
@@ -0,0 +1,476 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from rdflib import Graph, Literal, URIRef
+from rdflib.compare import isomorphic
+
+from ckan_pkg_checker.utils import rdf_utils
+from ckan_pkg_checker.utils.streamed_source import RDF_XML_ACCEPT
+from tests.helpers import CATALOG
+from tests.local_server import LocalServer
+
+# datasets as rdf:Description and a distribution that is described on the top
+# level of the catalog
+FLAT_CATALOG = """<?xml version="1.0" encoding="utf-8"?>
+<rdf:RDF
+    xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+    xmlns:dcat="http://www.w3.org/ns/dcat#"
+    xmlns:dct="http://purl.org/dc/terms/"
+    xml:base="https://example.org/">
+  <rdf:Description rdf:about="dataset/1">
+    <rdf:type rdf:resource="http://www.w3.org/ns/dcat#Dataset"/>
+    <dct:identifier>dataset-1@org</dct:identifier>
+    <dcat:distribution rdf:resource="distribution/1"/>
+    <dcat:contactPoint>
+      <rdf:Description>
+        <dct:title>Contact</dct:title>
+      </rdf:Description>
+    </dcat:contactPoint>
+  </rdf:Description>
+  <dcat:Distribution rdf:about="distribution/1">
+    <dct:title xml:lang="de">Distribution 1</dct:title>
+  </dcat:Distribution>
+</rdf:RDF>
+"""
+
+# a language on the root element and a distribution of dataset 1 that is
+# described in the element of dataset 2, the identifiers reset the language
+NESTED_CATALOG = """<?xml version="1.0" encoding="utf-8"?>
+<rdf:RDF
+    xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+    xmlns:dcat="http://www.w3.org/ns/dcat#"
+    xmlns:dct="http://purl.org/dc/terms/"
+    xml:lang="de">
+  <dcat:Catalog rdf:about="https://example.org/catalog">
+    <dcat:dataset>
+      <dcat:Dataset rdf:about="https://example.org/dataset/1">
+        <dct:identifier xml:lang="">dataset-1@org</dct:identifier>
+        <dct:title>Datensatz 1</dct:title>
+        <dcat:distribution rdf:resource="https://example.org/distribution/2"/>
+      </dcat:Dataset>
+    </dcat:dataset>
+    <dcat:dataset>
+      <dcat:Dataset rdf:about="https://example.org/dataset/2">
+        <dct:identifier xml:lang="">dataset-2@org</dct:identifier>
+        <dct:title>Datensatz 2</dct:title>
+        <dcat:distribution>
+          <dcat:Distribution rdf:about="https://example.org/distribution/2">
+            <dct:title>Distribution 2</dct:title>
+            <dct:license rdf:parseType="Resource">
+              <dct:title>Lizenz</dct:title>
+            </dct:license>
+          </dcat:Distribution>
+        </dcat:distribution>
+      </dcat:Dataset>
+    </dcat:dataset>
+  </dcat:Catalog>
+</rdf:RDF>
+"""
+
+NESTED_SHAPES = """
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+@prefix dcat: <http://www.w3.org/ns/dcat#> .
+@prefix dct: <http://purl.org/dc/terms/> .
+
+<http://example.org/DatasetShape> a sh:NodeShape ;
+    sh:targetClass dcat:Dataset ;
+    sh:property [ sh:path dct:title ; sh:languageIn ( "fr" ) ] .
+
+<http://example.org/DistributionShape> a sh:NodeShape ;
+    sh:targetClass dcat:Distribution ;
+    sh:property [ sh:path dct:title ; sh:languageIn ( "fr" ) ] ;
+    sh:property [ sh:path dct:license ; sh:maxCount 1 ] .
+"""
+
+
+class TestHarvestSourceMethods(unittest.TestCase):
+    def setUp(self):
+        fd, self.source_url = tempfile.mkstemp(suffix=".rdf")
+        with os.fdopen(fd, "w") as catalog:
+            catalog.write(CATALOG)
+        self.dataset_ref = URIRef("https://example.org/dataset/1")
+        self.distribution_ref = URIRef("https://example.org/distribution/1")
+
+    def tearDown(self):
+        os.remove(self.source_url)
+
+    def test_parse_harvest_source_indexes_identifiers(self):
+        harvest_source = rdf_utils.parse_harvest_source(self.source_url)
+        self.assertEqual(
+            harvest_source.datasets[Literal("dataset-1@org")], [self.dataset_ref]
+        )
+        self.assertEqual(len(harvest_source.datasets), 2)
+
+    def test_extract_dataset_graph(self):
+        harvest_source = rdf_utils.parse_harvest_source(self.source_url)
+        dataset = rdf_utils.extract_dataset_graph(harvest_source, "dataset-1@org")
+        self.assertIn(
+            (self.dataset_ref, rdf_utils.DCT.identifier, Literal("dataset-1@org")),
+            dataset,
+        )
+        self.assertIn(
+            (
+                self.distribution_ref,
+                rdf_utils.DCT.title,
+                Literal("Distribution 1", lang="de"),
+            ),
+            dataset,
+        )
+        self.assertNotIn(
+            URIRef("https://example.org/dataset/2"), set(dataset.subjects())
+        )
+
+    def test_extract_dataset_graph_unknown_identifier(self):
+        harvest_source = rdf_utils.parse_harvest_source(self.source_url)
+        dataset = rdf_utils.extract_dataset_graph(harvest_source, "unknown")
+        self.assertEqual(len(dataset), 0)
+
+    def test_harvest_source_cache_parses_source_once(self):
+        cache = rdf_utils.HarvestSourceCache(maxsize=2)
+        with mock.patch.object(
+            rdf_utils,
+            "parse_harvest_source",
+            wraps=rdf_utils.parse_harvest_source,
+        ) as parse:
+            for identifier in ["dataset-1@org", "dataset-2@org", "dataset-1@org"]:
+                dataset = rdf_utils.get_dataset_graph_from_source(
+                    self.source_url, identifier, cache=cache
+                )
+                self.assertTrue(len(dataset))
+        self.assertEqual(parse.call_count, 1)
+
+    def test_harvest_source_cache_evicts_least_recently_used(self):
+        cache = rdf_utils.HarvestSourceCache(maxsize=1)
+        with mock.patch.object(
+            rdf_utils, "parse_harvest_source", side_effect=lambda url, fetcher=None: url
+        ) as parse:
+            cache.get("source-1")
+            cache.get("source-2")
+            cache.get("source-1")
+        self.assertEqual(parse.call_count, 3)
+
+
+class TestStreamedHarvestSource(unittest.TestCase):
+    def setUp(self):
+        self.source_urls = []
+
+    def tearDown(self):
+        for source_url in self.source_urls:
+            os.remove(source_url)
+
+    def _write_catalog(self, content):
+        fd, source_url = tempfile.mkstemp(suffix=".rdf")
+        with os.fdopen(fd, "w") as catalog:
+            catalog.write(content)
+        self.source_urls.append(source_url)
+        return source_url
+
+    def test_streamed_datasets_match_parsed_datasets(self):
+        source_url = self._write_catalog(CATALOG)
+        parsed_source = rdf_utils.parse_harvest_source(source_url)
+        streamed_source = rdf_utils.stream_harvest_source(source_url)
+        self.addCleanup(streamed_source.close)
+        for identifier in ["dataset-1@org", "dataset-2@org", "unknown"]:
+            with self.subTest(identifier=identifier):
+                self.assertEqual(
+                    set(rdf_utils.extract_dataset_graph(streamed_source, identifier)),
+                    set(rdf_utils.extract_dataset_graph(parsed_source, identifier)),
+                )
+
+    def test_nested_catalog_gets_the_same_results_as_parsed(self):
+        source_url = self._write_catalog(NESTED_CATALOG)
+        parsed_source = rdf_utils.parse_harvest_source(source_url)
+        streamed_source = rdf_utils.stream_harvest_source(source_url)
+        self.addCleanup(streamed_source.close)
+        shacl_graph = Graph().parse(data=NESTED_SHAPES, format="turtle")
+        results = {}
+        for mode, harvest_source in [
+            ("parsed", parsed_source),
+            ("streamed", streamed_source),
+        ]:
+            for identifier in ["dataset-1@org", "dataset-2@org"]:
+                dataset = rdf_utils.extract_dataset_graph(harvest_source, identifier)
+                results[mode, identifier] = (
+                    dataset,
+                    sorted(
+                        (str(result.node), result.property, str(result.value))
+                        for result in rdf_utils.get_shacl_results(
+                            dataset, shacl_graph, Graph()
+                        )
+                    ),
+                )
+        for identifier in ["dataset-1@org", "dataset-2@org"]:
+            with self.subTest(identifier=identifier):
+                parsed_dataset, parsed_results = results["parsed", identifier]
+                streamed_dataset, streamed_results = results["streamed", identifier]
+                self.assertTrue(isomorphic(streamed_dataset, parsed_dataset))
+                self.assertEqual(streamed_results, parsed_results)
+                # the titles of the dataset and of the distribution are in german
+                self.assertEqual(len(streamed_results), 2)
+        self.assertIn(
+            (
+                URIRef("https://example.org/distribution/2"),
+                rdf_utils.DCT.title,
+                Literal("Distribution 2", lang="de"),
+            ),
+            results["streamed", "dataset-1@org"][0],
+        )
+
+        source_url = self._write_catalog(FLAT_CATALOG)
+        streamed_source = rdf_utils.stream_harvest_source(source_url)
+        self.addCleanup(streamed_source.close)
+        dataset = rdf_utils.extract_dataset_graph(streamed_source, "dataset-1@org")
+        parsed_dataset = rdf_utils.extract_dataset_graph(
+            rdf_utils.parse_harvest_source(source_url), "dataset-1@org"
+        )
+        self.assertIn(
+            (
+                URIRef("https://example.org/distribution/1"),
+                rdf_utils.DCT.title,
+                Literal("Distribution 1", lang="de"),
+            ),
+            dataset,
+        )
+        self.assertTrue(isomorphic(dataset, parsed_dataset))
+
+    def test_close_removes_the_source_file(self):
+        streamed_source = rdf_utils.stream_harvest_source(self._write_catalog(CATALOG))
+        path = streamed_source.path
+        self.assertTrue(os.path.exists(path))
+        streamed_source.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_broken_source(self):
+        source_url = self._write_catalog("<rdf:RDF")
+        self.assertIsNone(rdf_utils.stream_harvest_source(source_url))
+
+    def test_remote_source_is_requested_as_rdf_xml(self):
+        with LocalServer() as server:
+            server.catalog = CATALOG.encode("utf-8")
+            harvest_source = rdf_utils.stream_harvest_source(server.url("/catalog"))
+        self.addCleanup(harvest_source.close)
+        self.assertEqual(server.accept_headers, [RDF_XML_ACCEPT])
+
+    def test_harvest_source_cache_streams_sources(self):
+        source_url = self._write_catalog(CATALOG)
+        cache = rdf_utils.HarvestSourceCache(stream=True)
+        self.addCleanup(cache.close)
+        dataset = rdf_utils.get_dataset_graph_from_source(
+            source_url, "dataset-1@org", cache=cache
+        )
+        self.assertIsInstance(cache.get(source_url), rdf_utils.StreamedHarvestSource)
+        self.assertIn(
+            (
+                URIRef("https://example.org/dataset/1"),
+                rdf_utils.DCT.identifier,
+                Literal("dataset-1@org"),
+            ),
+            dataset,
+        )
+
+
+class TestLoadShaclGraphs(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.shacl_file = os.path.join(self.cache_dir, "shapes.ttl")
+        self.ont_file = os.path.join(self.cache_dir, "ontology.ttl")
+        with open(self.shacl_file, "w") as shapes:
+            shapes.write(
+                "@prefix sh: <http://www.w3.org/ns/shacl#> .\n"
+                "<http://example.org/shape> a sh:NodeShape .\n"
+            )
+        self._write_ontology("<http://example.org/a> a <http://example.org/B> .\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _write_ontology(self, content):
+        with open(self.ont_file, "w") as ontology:
+            ontology.write(content)
+
+    def _load(self):
+        with mock.patch.object(
+            rdf_utils, "_parse_shacl_graphs", wraps=rdf_utils._parse_shacl_graphs
+        ) as parse:
+            graphs = rdf_utils.load_shacl_graphs(
+                self.shacl_file, [self.ont_file], cache_dir=self.cache_dir
+            )
+        return graphs, parse.call_count
+
+    def _bundles(self):
+        return [
+            filename
+            for filename in os.listdir(self.cache_dir)
+            if filename.startswith(rdf_utils.SHACL_BUNDLE_PREFIX)
+        ]
+
+    def test_graphs_are_loaded_from_bundle(self):
+        (shacl_graph, ont_graph), parse_count = self._load()
+        self.assertEqual(parse_count, 1)
+        (cached_shacl_graph, cached_ont_graph), parse_count = self._load()
+        self.assertEqual(parse_count, 0)
+        self.assertEqual(set(cached_shacl_graph), set(shacl_graph))
+        self.assertEqual(set(cached_ont_graph), set(ont_graph))
+        self.assertEqual(len(self._bundles()), 1)
+
+    def test_bundle_is_rebuilt_when_a_file_changes(self):
+        self._load()
+        old_bundles = self._bundles()
+        self._write_ontology("<http://example.org/c> a <http://example.org/B> .\n")
+        (_, ont_graph), parse_count = self._load()
+        self.assertEqual(parse_count, 1)
+        self.assertIn(URIRef("http://example.org/c"), set(ont_graph.subjects()))
+        self.assertEqual(len(self._bundles()), 1)
+        self.assertNotEqual(self._bundles(), old_bundles)
+
+    def test_pruned_graphs_are_stored_in_their_own_bundle(self):
+        self._load()
+        (_, ont_graph) = rdf_utils.load_shacl_graphs(
+            self.shacl_file, [self.ont_file], cache_dir=self.cache_dir, prune=True
+        )
+        self.assertEqual(len(self._bundles()), 1)
+        self.assertEqual(len(ont_graph), 1)
+
+
+SHAPES = """
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+@prefix ex: <http://example.org/> .
+
+ex:Shape a sh:NodeShape ;
+    sh:property [ sh:path ex:direct ] ;
+    sh:property [ sh:path ( ex:first [ sh:inversePath ex:inverse ] ) ] ;
+    sh:sparql [ sh:select "SELECT $this WHERE { $this ex:inQuery ?value . }" ] .
+"""
+
+ONTOLOGY = """
+@prefix ex: <http://example.org/> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+
+ex:a a ex:Class ;
+    ex:direct ex:b ;
+    ex:first ex:c ;
+    ex:inverse ex:d ;
+    ex:inQuery ex:e ;
+    ex:unused ex:f ;
+    rdfs:label "a" .
+"""
+
+
+class TestPruneOntologyGraph(unittest.TestCase):
+    def test_keeps_only_predicates_reached_by_the_shapes(self):
+        shacl_graph = Graph().parse(data=SHAPES, format="turtle")
+        ont_graph = Graph().parse(data=ONTOLOGY, format="turtle")
+        pruned_graph = rdf_utils.prune_ontology_graph(ont_graph, shacl_graph)
+        self.assertEqual(
+            set(pruned_graph.predicates()),
+            {
+                rdf_utils.RDF.type,
+                URIRef("http://example.org/direct"),
+                URIRef("http://example.org/first"),
+                URIRef("http://example.org/inverse"),
+                URIRef("http://example.org/inQuery"),
+            },
+        )
+
+
+BATCH_SHAPES = """
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+@prefix ex: <http://example.org/> .
+
+ex:Shape a sh:NodeShape ;
+    sh:targetClass ex:Dataset ;
+    sh:property [ sh:path ex:title ; sh:minCount 1 ] ;
+    sh:property [ sh:path ex:part ; sh:class ex:Part ] .
+"""
+
+BATCH_DATASETS = [
+    "<http://example.org/1> a <http://example.org/Dataset> ; "
+    '<http://example.org/title> "1" .',
+    "<http://example.org/2> a <http://example.org/Dataset> ; "
+    "<http://example.org/part> <http://example.org/part> .",
+    "<http://example.org/3> a <http://example.org/Dataset> ; "
+    "<http://example.org/part> <http://example.org/part> . "
+    "<http://example.org/part> a <http://example.org/Part> .",
+]
+
+
+class TestBatchShaclResults(unittest.TestCase):
+    def test_batch_results_match_single_results(self):
+        shacl_graph = Graph().parse(data=BATCH_SHAPES, format="turtle")
+        dataset_graphs = [
+            Graph().parse(data=dataset, format="turtle") for dataset in BATCH_DATASETS
+        ]
+        batch_results = rdf_utils.get_batch_shacl_results(
+            dataset_graphs, shacl_graph, Graph()
+        )
+        single_results = [
+            rdf_utils.get_shacl_results(dataset_graph, shacl_graph, Graph())
+            for dataset_graph in dataset_graphs
+        ]
+        self.assertEqual(
+            [set(results) for results in batch_results],
+            [set(results) for results in single_results],
+        )
+        # the part of dataset 2 is only described by dataset 3
+        self.assertEqual(len(single_results[1]), 2)
+        self.assertEqual(len(single_results[2]), 1)
+
+
+RESULT_SHAPES = """
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+@prefix dcat: <http://www.w3.org/ns/dcat#> .
+@prefix dct: <http://purl.org/dc/terms/> .
+
+<http://example.org/Shape> a sh:NodeShape ;
+    sh:targetClass dcat:Dataset ;
+    sh:property [ sh:path dct:title ; sh:minCount 1 ; sh:message "title" ] ;
+    sh:property [
+        sh:path dcat:contactPoint ;
+        sh:nodeKind sh:IRI ;
+        sh:severity sh:Warning ;
+        sh:message "contact"
+    ] .
+"""
+
+RESULT_DATASETS = """
+@prefix dcat: <http://www.w3.org/ns/dcat#> .
+@prefix vcard: <http://www.w3.org/2006/vcard/ns#> .
+
+<http://example.org/1> a dcat:Dataset ;
+    dcat:contactPoint [ vcard:hasEmail "info@example.org" ] .
+<http://example.org/2> a dcat:Dataset .
+"""
+
+
+class TestShaclResults(unittest.TestCase):
+    def test_get_shacl_results(self):
+        shacl_graph = Graph().parse(data=RESULT_SHAPES, format="turtle")
+        dataset_graph = Graph().parse(data=RESULT_DATASETS, format="turtle")
+        rdf_utils._bind_namespaces(dataset_graph)
+        results = rdf_utils.get_shacl_results(dataset_graph, shacl_graph, Graph())
+        self.assertEqual(
+            sorted(
+                (
+                    str(result.node),
+                    result.property,
+                    str(result.value),
+                    result.msg,
+                    result.severity,
+                )
+                for result in results
+            ),
+            [
+                (
+                    "http://example.org/1",
+                    "dcat:contactPoint",
+                    "vcard:hasEmail info@example.org",
+                    "contact",
+                    "Warning",
+                ),
+                ("http://example.org/1", "dct:title", "None", "title", "Violation"),
+                ("http://example.org/2", "dct:title", "None", "title", "Violation"),
+            ],
+        )
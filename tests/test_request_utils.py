@@ -0,0 +1,184 @@
+import time
+import unittest
+from unittest import mock
+
+from ckan_pkg_checker.utils import request_utils
+from tests.local_server import ETAG, LocalServer
+
+
+class TestCheckUrl(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalServer().__enter__()
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_check_url_ok(self):
+        self.assertIsNone(request_utils.check_url(self.server.url("/ok")))
+
+    def test_check_url_not_found(self):
+        self.assertEqual(
+            request_utils.check_url(self.server.url("/notfound")),
+            "Failed to load resource: the server responded with a status of 404 "
+            "(Not Found)",
+        )
+
+    def test_check_url_method_not_allowed_is_ignored(self):
+        self.assertIsNone(request_utils.check_url(self.server.url("/nohead")))
+
+    def test_check_url_server_error(self):
+        url = self.server.url("/error")
+        self.assertEqual(
+            request_utils.check_url(url),
+            f"500 Server Error: Internal Server Error for url: {url}",
+        )
+
+    def test_check_url_with_session_reuses_connection(self):
+        session = request_utils.get_session()
+        for _ in range(5):
+            request_utils.check_url(self.server.url("/ok"), session=session)
+        session.close()
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_check_url_without_session_opens_connection_per_request(self):
+        for _ in range(5):
+            request_utils.check_url(self.server.url("/ok"))
+        self.assertEqual(len(self.server.connections), 5)
+
+    def test_check_url_with_validators(self):
+        url_check = request_utils.check_url_with_validators(self.server.url("/etag"))
+        self.assertEqual(url_check, request_utils.UrlCheck(None, ETAG, None))
+
+    def test_revalidate_url_not_modified(self):
+        self.assertTrue(
+            request_utils.revalidate_url(
+                self.server.url("/etag"), etag=ETAG, last_modified=None
+            )
+        )
+        self.assertEqual(self.server.requests, [("HEAD", "/etag")])
+
+    def test_revalidate_url_not_found(self):
+        self.assertFalse(
+            request_utils.revalidate_url(
+                self.server.url("/notfound"), etag=ETAG, last_modified=None
+            )
+        )
+
+
+class TestHostStrategy(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalServer().__enter__()
+        self.strategy = request_utils.HostStrategy()
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_hosts_that_reject_head_are_checked_with_get(self):
+        for index in range(3):
+            self.assertIsNone(
+                request_utils.check_url(
+                    self.server.url(f"/getonly?{index}"), strategy=self.strategy
+                )
+            )
+        self.assertEqual(
+            [method for method, _ in self.server.requests],
+            ["HEAD", "HEAD", "GET", "GET", "GET"],
+        )
+
+    def test_without_strategy_head_is_always_tried(self):
+        for index in range(2):
+            request_utils.check_url(self.server.url(f"/getonly?{index}"))
+        self.assertEqual(
+            [method for method, _ in self.server.requests],
+            ["HEAD", "HEAD", "GET"] * 2,
+        )
+
+    def test_unreachable_url_is_requested_once(self):
+        url = self.server.url("/ok")
+        self.server.__exit__()
+        with mock.patch.object(
+            request_utils, "_send_request", wraps=request_utils._send_request
+        ) as send_request:
+            self.assertTrue(request_utils.check_url(url, strategy=self.strategy))
+        self.assertEqual(send_request.call_count, 1)
+        self.assertFalse(self.strategy.rejects_head(url))
+
+    def test_read_timeout(self):
+        strategy = request_utils.HostStrategy(read_timeout=0.1)
+        self.assertIn(
+            "Read timed out",
+            request_utils.check_url(self.server.url("/slow"), strategy=strategy),
+        )
+
+
+class TestHostCircuitBreaker(unittest.TestCase):
+    def test_opens_after_max_failures(self):
+        breaker = request_utils.HostCircuitBreaker(max_failures=2, reset_timeout=60)
+        url = "https://example.org/path"
+        breaker.record(url, "timeout", request_utils.TIMED_OUT)
+        self.assertIsNone(breaker.get_error(url))
+        breaker.record(url, "refused", request_utils.UNREACHABLE)
+        self.assertEqual(
+            breaker.get_error("https://example.org/other"),
+            "Host example.org unreachable: url not requested after 2 failed "
+            "requests to the host",
+        )
+        self.assertIsNone(breaker.get_error("https://other.org/path"))
+        self.assertEqual(breaker.short_circuited, 1)
+
+    def test_http_errors_reset_failures(self):
+        breaker = request_utils.HostCircuitBreaker(max_failures=2)
+        url = "https://example.org/path"
+        breaker.record(url, "refused", request_utils.UNREACHABLE)
+        breaker.record(url, "404", None)
+        breaker.record(url, "refused", request_utils.UNREACHABLE)
+        self.assertIsNone(breaker.get_error(url))
+
+    def test_half_open_probe(self):
+        breaker = request_utils.HostCircuitBreaker(max_failures=1, reset_timeout=0.05)
+        url = "https://example.org/path"
+        breaker.record(url, "refused", request_utils.UNREACHABLE)
+        self.assertTrue(breaker.get_error(url))
+        time.sleep(0.05)
+        # one url is let through as probe, the others are still short-circuited
+        self.assertIsNone(breaker.get_error(url))
+        self.assertTrue(breaker.get_error(url))
+        breaker.record(url, None, None)
+        self.assertIsNone(breaker.get_error(url))
+        self.assertFalse(breaker.is_open(url))
+
+    def test_failed_probe_keeps_circuit_open(self):
+        breaker = request_utils.HostCircuitBreaker(max_failures=1, reset_timeout=0.05)
+        url = "https://example.org/path"
+        breaker.record(url, "refused", request_utils.UNREACHABLE)
+        time.sleep(0.05)
+        self.assertIsNone(breaker.get_error(url))
+        breaker.record(url, "timed out", request_utils.TIMED_OUT)
+        self.assertEqual(
+            breaker.get_error(url),
+            "Host example.org timed out: url not requested after 1 failed "
+            "requests to the host",
+        )
+
+    def test_urls_of_unreachable_host_are_short_circuited(self):
+        server = LocalServer().__enter__()
+        urls = [server.url(f"/ok?{index}") for index in range(5)]
+        server.__exit__()
+        breaker = request_utils.HostCircuitBreaker(max_failures=2)
+        strategy = request_utils.HostStrategy(circuit_breaker=breaker)
+        with mock.patch.object(
+            request_utils, "_send_request", wraps=request_utils._send_request
+        ) as send_request:
+            errors = [request_utils.check_url(url, strategy=strategy) for url in urls]
+        self.assertEqual(send_request.call_count, 2)
+        host = urls[0].split("/")[2]
+        self.assertEqual(
+            errors[2:],
+            [
+                f"Host {host} unreachable: url not requested after 2 failed "
+                "requests to the host"
+            ]
+            * 3,
+        )
+        self.assertEqual(breaker.short_circuited, 3)
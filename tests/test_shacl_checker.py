@@ -0,0 +1,205 @@
+import configparser
+import csv
+import shutil
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from ckan_pkg_checker.checkers.shacl_checker import ShaclChecker
+from ckan_pkg_checker.utils import rdf_utils, utils
+from tests.helpers import CATALOG
+
+SHAPES = """
+@prefix dcat: <http://www.w3.org/ns/dcat#> .
+@prefix dct: <http://purl.org/dc/terms/> .
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+@prefix skos: <http://www.w3.org/2004/02/skos/core#> .
+@prefix : <http://example.org/shapes#> .
+
+:DatasetShape
+    a sh:NodeShape ;
+    sh:targetClass dcat:Dataset ;
+    sh:property [
+        sh:path dct:description ;
+        sh:minCount 1 ;
+        sh:severity sh:Violation ;
+        sh:message "description is missing" ;
+    ] ;
+    sh:property [
+        sh:path dcat:theme ;
+        sh:minCount 1 ;
+        sh:severity sh:Warning ;
+        sh:message "theme is missing" ;
+    ] .
+"""
+
+ONTOLOGY = """
+@prefix skos: <http://www.w3.org/2004/02/skos/core#> .
+
+<http://example.org/theme/1> a skos:Concept ;
+    skos:inScheme <http://example.org/theme> .
+"""
+
+ONT_OPTIONS = [
+    "frequency_file",
+    "theme_file",
+    "licenses_file",
+    "formats_file",
+    "mime_types_file",
+    "language_file",
+]
+
+
+def get_test_package(name, identifier, source_url):
+    return {
+        "name": name,
+        "identifier": identifier,
+        "source_url": source_url,
+        "title": {"de": f"Titel {name}"},
+        "organization": {"name": "org"},
+        "contact_points": [{"name": "Person", "email": "person@org.ch"}],
+    }
+
+
+class TestShaclChecker(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.rundir = self.tmpdir / "run"
+        utils.get_csvdir(self.rundir).mkdir(parents=True)
+        files = {
+            "shacl_file": SHAPES,
+            "catalog.rdf": CATALOG,
+            **{option: ONTOLOGY for option in ONT_OPTIONS},
+        }
+        for name, content in files.items():
+            (self.tmpdir / name).write_text(content)
+        self.source_url = str(self.tmpdir / "catalog.rdf")
+        self.pkgs = [
+            get_test_package(
+                f"dataset-{index}", f"dataset-{index}@org", self.source_url
+            )
+            for index in [1, 2]
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_test_config(self, **shaclchecker_options):
+        config = configparser.ConfigParser()
+        config.read_dict(
+            {
+                "shaclchecker": {
+                    "csvfile": "shaclchecker.csv",
+                    "statfile": "shaclstatistics.csv",
+                    "shacl_file": str(self.tmpdir / "shacl_file"),
+                    **{option: str(self.tmpdir / option) for option in ONT_OPTIONS},
+                    **shaclchecker_options,
+                },
+                "contacts": {"statsfile": "contactstats.csv"},
+            }
+        )
+        return config
+
+    def _run_checker(self, config, prefetch=False, **kwargs):
+        checker = ShaclChecker(
+            rundir=self.rundir, config=config, siteurl="https://ckan.org", **kwargs
+        )
+        if prefetch:
+            for pkg in self.pkgs:
+                checker.prefetch(pkg)
+        for pkg in self.pkgs:
+            checker.check_package(pkg)
+        checker.finish()
+        with open(checker.csvfilename) as csvfile:
+            return list(csv.DictReader(csvfile))
+
+    def test_check_package(self):
+        rows = self._run_checker(self.get_test_config())
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(
+            sorted((row["dataset_url"], row["error_msg"]) for row in rows),
+            [
+                ("https://ckan.org/dataset/dataset-1", "description is missing"),
+                ("https://ckan.org/dataset/dataset-1", "theme is missing"),
+                ("https://ckan.org/dataset/dataset-2", "description is missing"),
+                ("https://ckan.org/dataset/dataset-2", "theme is missing"),
+            ],
+        )
+
+    def test_worker_processes_write_same_results(self):
+        sequential_rows = self._run_checker(self.get_test_config())
+        worker_rows = self._run_checker(self.get_test_config(), workers=2)
+        self.assertEqual(
+            sorted(tuple(row.values()) for row in sequential_rows),
+            sorted(tuple(row.values()) for row in worker_rows),
+        )
+
+    def test_batch_validation_writes_same_results(self):
+        sequential_rows = self._run_checker(self.get_test_config())
+        for workers in [1, 2]:
+            batch_rows = self._run_checker(
+                self.get_test_config(batch_size="10"), workers=workers
+            )
+            self.assertEqual(
+                sorted(tuple(row.values()) for row in sequential_rows),
+                sorted(tuple(row.values()) for row in batch_rows),
+            )
+
+    def test_incremental_mode_validates_changed_datasets_only(self):
+        rows = self._run_checker(self.get_test_config(), incremental=True)
+        with mock.patch.object(
+            rdf_utils, "get_shacl_results", wraps=rdf_utils.get_shacl_results
+        ) as get_shacl_results:
+            stored_rows = self._run_checker(self.get_test_config(), incremental=True)
+            self.assertEqual(get_shacl_results.call_count, 0)
+            self.assertEqual(
+                sorted(tuple(row.values()) for row in rows),
+                sorted(tuple(row.values()) for row in stored_rows),
+            )
+            (self.tmpdir / "catalog.rdf").write_text(
+                CATALOG.replace("Datensatz 2", "Datensatz zwei")
+            )
+            self._run_checker(self.get_test_config(), incremental=True)
+            self.assertEqual(get_shacl_results.call_count, 1)
+            (self.tmpdir / "shacl_file").write_text(SHAPES.replace("theme", "Theme"))
+            self._run_checker(self.get_test_config(), incremental=True)
+            self.assertEqual(get_shacl_results.call_count, 3)
+
+    def test_prefetched_source_is_parsed_once(self):
+        sequential_rows = self._run_checker(self.get_test_config())
+        with mock.patch.object(
+            rdf_utils, "parse_harvest_source", wraps=rdf_utils.parse_harvest_source
+        ) as parse:
+            prefetched_rows = self._run_checker(self.get_test_config(), prefetch=True)
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(
+            sorted(tuple(row.values()) for row in sequential_rows),
+            sorted(tuple(row.values()) for row in prefetched_rows),
+        )
+
+    def test_prefetch_waits_until_a_prefetched_source_is_checked(self):
+        checker = ShaclChecker(
+            rundir=self.rundir,
+            config=self.get_test_config(prefetch_sources="1"),
+            siteurl="https://ckan.org",
+        )
+        other_source_url = str(self.tmpdir / "other.rdf")
+        (self.tmpdir / "other.rdf").write_text(CATALOG)
+        checker.prefetch(self.pkgs[0])
+        other_prefetch = threading.Thread(
+            target=checker.prefetch,
+            args=({**self.pkgs[0], "source_url": other_source_url},),
+        )
+        other_prefetch.start()
+        # no check has used the first prefetched source yet
+        other_prefetch.join(0.2)
+        self.assertTrue(other_prefetch.is_alive())
+        self.assertEqual(checker.prefetched_sources, {self.source_url})
+        checker.check_package(self.pkgs[0])
+        other_prefetch.join()
+        self.assertEqual(checker.prefetched_sources, {other_source_url})
+        checker.check_package({**self.pkgs[0], "source_url": other_source_url})
+        self.assertEqual(checker.prefetched_sources, set())
+        checker.finish()
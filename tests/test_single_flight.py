@@ -0,0 +1,39 @@
+import threading
+import unittest
+
+import requests
+
+from ckan_pkg_checker.utils.single_flight import SingleFlight
+from tests.helpers import call_at_once
+from tests.local_server import LocalServer
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_for_one_key_hit_the_server_once(self):
+        flights = SingleFlight()
+        with LocalServer() as server:
+            url = server.url("/slow")
+            futures = call_at_once(
+                lambda: flights.do(url, lambda: requests.get(url).status_code)
+            )
+            self.assertEqual([future.result() for future in futures], [200] * 10)
+            self.assertEqual(server.requests, [("GET", "/slow")])
+
+    def test_waiting_callers_get_the_exception(self):
+        flights = SingleFlight()
+        calls = []
+
+        def fail():
+            calls.append(1)
+            threading.Event().wait(0.1)
+            raise ValueError("failed")
+
+        futures = call_at_once(lambda: flights.do("key", fail))
+        for future in futures:
+            self.assertIsInstance(future.exception(), ValueError)
+        self.assertEqual(len(calls), 1)
+
+    def test_keys_are_forgotten_once_done(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.do("key", lambda: 1), 1)
+        self.assertEqual(flights.do("key", lambda: 2), 2)
@@ -0,0 +1,104 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import requests
+from rdflib import Literal
+
+from ckan_pkg_checker.utils import rdf_utils
+from ckan_pkg_checker.utils.source_fetcher import HarvestSourceFetcher
+from ckan_pkg_checker.utils.streamed_source import RDF_XML_ACCEPT
+from tests.helpers import CATALOG, call_at_once
+from tests.local_server import LocalServer
+
+
+class TestHarvestSourceFetcher(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = Path(tempfile.mkdtemp())
+        # removed after the fetchers are closed
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.server = LocalServer().__enter__()
+        self.server.catalog = CATALOG.encode("utf-8")
+        self.source_url = self.server.url("/catalog")
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def _get_fetcher(self, **kwargs):
+        fetcher = HarvestSourceFetcher(self.cache_dir, **kwargs)
+        self.addCleanup(fetcher.close)
+        return fetcher
+
+    def test_gzip_source_is_stored_decoded(self):
+        path = self._get_fetcher().fetch(self.source_url)
+        self.assertEqual(Path(path).read_text(), CATALOG)
+
+    def test_source_is_requested_as_rdf_xml(self):
+        self._get_fetcher().fetch(self.source_url)
+        self.assertEqual(self.server.accept_headers, [RDF_XML_ACCEPT])
+
+    def test_unchanged_source_is_revalidated_across_runs(self):
+        path = self._get_fetcher().fetch(self.source_url)
+        fetcher = self._get_fetcher()
+        self.assertEqual(fetcher.fetch(self.source_url), path)
+        self.assertEqual((fetcher.downloaded_count, fetcher.revalidated_count), (0, 1))
+        self.assertEqual(
+            self.server.requests, [("GET", "/catalog"), ("GET", "/catalog")]
+        )
+        self.assertEqual(Path(path).read_text(), CATALOG)
+
+    def test_failed_download_raises(self):
+        with self.assertRaises(requests.HTTPError):
+            self._get_fetcher().fetch(self.server.url("/notfound"))
+        self.assertEqual(list(self.cache_dir.iterdir()), [])
+
+    def test_not_modified_without_cached_copy_raises(self):
+        with self.assertRaises(requests.HTTPError):
+            self._get_fetcher().fetch(self.server.url("/notmodified"))
+        self.assertEqual(list(self.cache_dir.iterdir()), [])
+
+    def test_sources_that_were_not_fetched_are_pruned_on_close(self):
+        fetcher = self._get_fetcher()
+        path = fetcher.fetch(self.source_url)
+        old_path = fetcher.fetch(self.server.url("/catalog?removed"))
+        fetcher.close()
+        fetcher = self._get_fetcher()
+        fetcher.fetch(self.source_url)
+        fetcher.close()
+        self.assertEqual(
+            sorted(self.cache_dir.iterdir()),
+            [Path(path).with_suffix(".json"), Path(path)],
+        )
+        self.assertFalse(Path(old_path).exists())
+
+    def test_timeout(self):
+        with self.assertRaises(requests.Timeout):
+            self._get_fetcher(read_timeout=0.1).fetch(self.server.url("/slow"))
+
+    def test_local_files_are_not_copied(self):
+        self.assertEqual(
+            self._get_fetcher().fetch("/tmp/catalog.rdf"), "/tmp/catalog.rdf"
+        )
+
+    def test_harvest_source_cache_parses_fetched_source(self):
+        for stream in [False, True]:
+            with self.subTest(stream=stream):
+                cache = rdf_utils.HarvestSourceCache(
+                    stream=stream, fetcher=self._get_fetcher()
+                )
+                dataset = rdf_utils.get_dataset_graph_from_source(
+                    self.source_url, "dataset-1@org", cache=cache
+                )
+                cache.close()
+                self.assertIn(
+                    (None, rdf_utils.DCT.identifier, Literal("dataset-1@org")),
+                    dataset,
+                )
+
+    def test_harvest_source_cache_loads_source_once_for_concurrent_callers(self):
+        cache = rdf_utils.HarvestSourceCache(fetcher=self._get_fetcher())
+        futures = call_at_once(lambda: cache.get(self.source_url))
+        harvest_sources = [future.result() for future in futures]
+        self.assertTrue(all(source is harvest_sources[0] for source in harvest_sources))
+        self.assertEqual(self.server.requests, [("GET", "/catalog")])
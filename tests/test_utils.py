@@ -1,9 +1,15 @@
+import configparser
+import io
+import shutil
+import tempfile
 import unittest
 from datetime import datetime
 from pathlib import Path
+from unittest import mock
 from urllib.parse import urljoin
 
 from ckan_pkg_checker.utils import utils
+from ckan_pkg_checker.utils.metadata_cache import MetadataCache
 
 
 class TestResourceCheckMethods(unittest.TestCase):
@@ -127,3 +133,74 @@ class TestResourceCheckMethods(unittest.TestCase):
         contact_type, contact_mail = utils.process_msg_file_name(filename)
         self.assertEqual(contact_type, "geocat")
         self.assertEqual(contact_mail, "max.moore@swisstopo.ch")
+
+    def test_queued_csv_writer(self):
+        csvfile = io.StringIO()
+        writer = utils.QueuedCsvWriter(csvfile, fieldnames=["name", "email"])
+        writer.writeheader()
+        writer.writerow({"name": self.person1_name, "email": self.person1_email})
+        writer.writerows([{"name": self.person2_name, "email": self.person2_email}] * 2)
+        writer.close()
+        self.assertEqual(
+            csvfile.getvalue().splitlines(),
+            [
+                "name,email",
+                "Person1,person1@org.ch",
+                "Person2,person2@org.ch",
+                "Person2,person2@org.ch",
+            ],
+        )
+
+
+def get_fake_ogdremote():
+    ogdremote = mock.Mock()
+    ogdremote.action.group_tree.return_value = [
+        {"name": "parent", "children": [{"name": "child"}]},
+        {"name": "other"},
+    ]
+    admins = {"parent": [["user-1", "user", "admin"]], "child": [], "other": []}
+    ogdremote.action.member_list.side_effect = lambda id, **kwargs: admins[id]
+    ogdremote.action.user_show.side_effect = lambda id: {"email": f"{id}@org.ch"}
+    return ogdremote
+
+
+class TestContactMapping(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_path = Path(self.tmpdir) / "metadata.json"
+        self.config = configparser.ConfigParser()
+        self.config.read_dict({"emailsender": {"dcat_admin": "admin@ckan.org"}})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _set_up_contact_mapping(self, ogdremote, refresh=False):
+        metadata_cache = MetadataCache(self.cache_path, ttl=3600, refresh=refresh)
+        contact_dict = utils.set_up_contact_mapping(
+            self.config, ogdremote, metadata_cache=metadata_cache, workers=4
+        )
+        metadata_cache.save()
+        return contact_dict
+
+    def test_contacts_are_taken_from_metadata_cache(self):
+        expected_contacts = {
+            utils.ContactKey("parent", utils.DCAT): ["user-1@org.ch"],
+            utils.ContactKey("child", utils.DCAT): ["user-1@org.ch"],
+            utils.ContactKey("other", utils.DCAT): ["admin@ckan.org"],
+        }
+        ogdremote = get_fake_ogdremote()
+        self.assertEqual(self._set_up_contact_mapping(ogdremote), expected_contacts)
+        self.assertEqual(ogdremote.action.group_tree.call_count, 1)
+
+        cached_ogdremote = get_fake_ogdremote()
+        self.assertEqual(
+            self._set_up_contact_mapping(cached_ogdremote), expected_contacts
+        )
+        self.assertEqual(cached_ogdremote.action.group_tree.call_count, 0)
+        self.assertEqual(cached_ogdremote.action.member_list.call_count, 0)
+        self.assertEqual(cached_ogdremote.action.user_show.call_count, 0)
+
+        refreshed_ogdremote = get_fake_ogdremote()
+        self._set_up_contact_mapping(refreshed_ogdremote, refresh=True)
+        self.assertEqual(refreshed_ogdremote.action.group_tree.call_count, 1)
+        self.assertTrue(refreshed_ogdremote.action.member_list.call_count)